@@ -0,0 +1 @@
+"""Бенчмарки: запускаются как python -m src.bench.<имя>."""
@@ -0,0 +1,274 @@
+"""
+Локальные заглушки внешних API для нагрузочного бенчмарка.
+
+Один aiohttp-сервер отвечает за три провайдера:
+    GET  /3.0/items            — поиск 2ГИС: синтетические места вокруг location
+    GET  /1.x/                 — геокодер Яндекса, прямой и обратный
+    POST /v1/chat/completions  — OpenAI-совместимый чат (в т.ч. stream=True)
+    GET  /stats                — сколько запросов и ошибок отдал каждый провайдер
+
+Ответ GPT собирается по промпту: классификация интересов, выбор индексов,
+пояснения, структурированный выбор (json_schema) и переформулировка
+запросов узнаются по тексту системного сообщения и response_format.
+
+Профиль задаёт задержку, разброс, долю ошибок (500 и 429 с Retry-After) и
+размер выдачи; отдельные параметры профиля переопределяются флагами.
+
+Запуск: python -m src.bench.fake_providers [--port 8099] [--profile realistic] [--error-rate 0.05]
+Приложение подключается переменными окружения:
+    DGIS_ITEMS_URL=http://127.0.0.1:8099/3.0/items
+    YANDEX_GEOCODER_URL=http://127.0.0.1:8099/1.x/
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Tuple
+
+from aiohttp import web
+
+from ..categories_config import ALL_CATEGORIES
+from ..twogis import CITY_CENTER_NN
+
+# latency/jitter — сек на запрос к 2ГИС и Яндексу; llm_latency — до первого токена GPT,
+# llm_chunk_delay — между кусками потокового ответа; items — мест на страницу 2ГИС
+PROFILES: Dict[str, Dict[str, float]] = {
+    "fast": {"latency": 0.005, "jitter": 0.005, "llm_latency": 0.02, "llm_chunk_delay": 0.001, "error_rate": 0.0, "items": 10},
+    "realistic": {"latency": 0.12, "jitter": 0.08, "llm_latency": 0.6, "llm_chunk_delay": 0.02, "error_rate": 0.01, "items": 10},
+    "slow": {"latency": 0.4, "jitter": 0.3, "llm_latency": 2.0, "llm_chunk_delay": 0.05, "error_rate": 0.02, "items": 10},
+    "flaky": {"latency": 0.12, "jitter": 0.08, "llm_latency": 0.6, "llm_chunk_delay": 0.02, "error_rate": 0.15, "items": 10},
+    "heavy": {"latency": 0.12, "jitter": 0.08, "llm_latency": 0.6, "llm_chunk_delay": 0.02, "error_rate": 0.01, "items": 50},
+}
+
+RUBRIC_POOL = [
+    "Музеи", "Парки культуры и отдыха", "Скверы", "Храмы", "Театры", "Галереи", "Набережные",
+    "Достопримечательности", "Смотровые площадки", "Памятники", "Библиотеки", "Кафе", "Рестораны",
+    "Кофейни", "Бары", "Офисы компаний", "Банки", "Бизнес-центры",
+]
+NAME_SUFFIXES = ["центральный", "Нижегородский", "на Волге", "старый", "городской", "у Кремля", "Заречный", "им. Горького"]
+EXPLANATIONS = [
+    "Здесь вы увидите одно из самых узнаваемых мест города и почувствуете его историю 🏛",
+    "Вам откроется вид на слияние Оки и Волги — отличная точка для фотографий 🌅",
+    "Здесь вы спокойно прогуляетесь и отдохнёте между насыщенными остановками маршрута 🌳",
+    "Вам откроется коллекция, которая хорошо дополняет ваши интересы и настроение прогулки 🎨",
+]
+CLASSIFICATION_QUERIES = {
+    "history": ["музей истории", "кремль"],
+    "art": ["галерея", "художественный музей"],
+    "views": ["набережная", "смотровая площадка"],
+    "parks": ["парк", "сквер"],
+    "religion": ["храм"],
+    "culture": ["театр"],
+    "food": ["кафе"],
+}
+SPREAD_M = 1500.0  # если радиус не задан — разброс мест вокруг точки
+
+
+class FakeProviders:
+    """Состояние заглушки: профиль, генератор задержек и счётчики по провайдерам."""
+
+    def __init__(self, profile: Dict[str, float], seed: int = 1) -> None:
+        self.profile = profile
+        self._rng = random.Random(seed)
+        self.stats: Dict[str, Dict[str, int]] = {
+            name: {"requests": 0, "errors": 0} for name in ("2gis", "yandex", "openai")
+        }
+
+    async def _delay(self, base: float) -> None:
+        await asyncio.sleep(max(0.0, base + self._rng.uniform(-1, 1) * self.profile["jitter"]))
+
+    def _fail(self, provider: str) -> bool:
+        self.stats[provider]["requests"] += 1
+        if self._rng.random() < self.profile["error_rate"]:
+            self.stats[provider]["errors"] += 1
+            return True
+        return False
+
+    # --- 2ГИС ---
+
+    async def items(self, request: web.Request) -> web.Response:
+        await self._delay(self.profile["latency"])
+        if self._fail("2gis"):
+            return web.json_response({"meta": {"code": 500}}, status=500)
+        query = request.query.get("q", "")
+        lon, lat = _parse_pair(request.query.get("location"), (CITY_CENTER_NN[1], CITY_CENTER_NN[0]))
+        radius = float(request.query.get("radius") or SPREAD_M)
+        page = int(request.query.get("page") or 1)
+        page_size = min(int(request.query.get("page_size") or 10), int(self.profile["items"]))
+        # Выдача детерминирована запросом, точкой и страницей — как у настоящего поиска
+        rng = random.Random(zlib.crc32(f"{query}|{lat:.3f}|{lon:.3f}|{radius:.0f}|{page}".encode()))
+        word = query.replace("Нижний Новгород", "").strip() or "Место"
+        items = [_fake_item(rng, word, lat, lon, radius) for _ in range(page_size)]
+        items.sort(key=lambda it: _dist2(it["point"], lat, lon))
+        return web.json_response({"meta": {"code": 200}, "result": {"items": items, "total": page_size * 3}})
+
+    # --- Яндекс ---
+
+    async def geocode(self, request: web.Request) -> web.Response:
+        await self._delay(self.profile["latency"])
+        if self._fail("yandex"):
+            return web.json_response({"statusCode": 500}, status=500)
+        text = request.query.get("geocode", "")
+        if re.fullmatch(r"\s*-?\d+(\.\d+)?\s*,\s*-?\d+(\.\d+)?\s*", text):
+            lon, lat = _parse_pair(text, (0.0, 0.0))
+            rng = random.Random(zlib.crc32(text.encode()))
+            address = f"Россия, Нижний Новгород, улица {rng.choice(NAME_SUFFIXES)}, {rng.randint(1, 120)}"
+        else:
+            rng = random.Random(zlib.crc32(text.lower().encode()))
+            lat = CITY_CENTER_NN[0] + rng.uniform(-0.03, 0.03)
+            lon = CITY_CENTER_NN[1] + rng.uniform(-0.05, 0.05)
+            address = f"Россия, Нижний Новгород, {text}"
+        member = {
+            "GeoObject": {
+                "metaDataProperty": {"GeocoderMetaData": {"text": address, "kind": "house"}},
+                "Point": {"pos": f"{lon:.6f} {lat:.6f}"},
+            }
+        }
+        return web.json_response({"response": {"GeoObjectCollection": {"featureMember": [member]}}})
+
+    # --- OpenAI ---
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        await self._delay(self.profile["llm_latency"])
+        if self._fail("openai"):
+            if self._rng.random() < 0.5:
+                error = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+                return web.json_response(error, status=429, headers={"retry-after": "0.2"})
+            return web.json_response({"error": {"message": "Internal error", "type": "server_error"}}, status=500)
+
+        content = _llm_answer(body)
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages") or []) // 3
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 3, "total_tokens": prompt_tokens + len(content) // 3}
+        base = {"id": f"chatcmpl-{int(time.time() * 1000)}", "created": int(time.time()), "model": body.get("model") or "fake"}
+        if not body.get("stream"):
+            return web.json_response({
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        async def send(payload: Dict[str, Any]) -> None:
+            await response.write(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', **payload}, ensure_ascii=False)}\n\n".encode())
+
+        for i in range(0, len(content), 24):
+            await send({"choices": [{"index": 0, "delta": {"content": content[i:i + 24]}, "finish_reason": None}]})
+            await asyncio.sleep(self.profile["llm_chunk_delay"])
+        await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({"choices": [], "usage": usage})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def stats_view(self, _: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def healthz(self, _: web.Request) -> web.Response:
+        return web.json_response({"ok": True})
+
+
+def _parse_pair(text: Any, default: Tuple[float, float]) -> Tuple[float, float]:
+    try:
+        a, b = (float(x) for x in str(text).split(","))
+        return a, b
+    except (TypeError, ValueError):
+        return default
+
+
+def _dist2(point: Dict[str, float], lat: float, lon: float) -> float:
+    return (point["lat"] - lat) ** 2 + ((point["lon"] - lon) * 0.55) ** 2
+
+
+def _fake_item(rng: random.Random, word: str, lat: float, lon: float, radius_m: float) -> Dict[str, Any]:
+    # Равномерно по кругу радиуса: 1° широты ≈ 111 км, долготы на 56° с.ш. ≈ 62 км
+    r = radius_m * rng.random() ** 0.5
+    angle = rng.uniform(0, 2 * math.pi)
+    dlat = r * math.sin(angle) / 111_000
+    dlon = r * math.cos(angle) / 62_000
+    rubrics = rng.sample(RUBRIC_POOL, rng.randint(1, 3))
+    return {
+        "id": str(rng.getrandbits(48)),
+        "type": "branch",
+        "name": f"{word.capitalize()} {rng.choice(NAME_SUFFIXES)} №{rng.randint(1, 999)}",
+        "address_name": f"улица {rng.choice(NAME_SUFFIXES)}, {rng.randint(1, 120)}",
+        "point": {"lat": round(lat + dlat, 6), "lon": round(lon + dlon, 6)},
+        "rubrics": [{"name": name} for name in rubrics],
+        "rating": {"rating": round(rng.uniform(3.5, 5.0), 1)},
+    }
+
+
+def _first_int(pattern: str, text: str, default: int) -> int:
+    match = re.search(pattern, text)
+    return int(match.group(1)) if match else default
+
+
+def _llm_answer(body: Dict[str, Any]) -> str:
+    """Правдоподобный ответ модели для одного из этапов конвейера по тексту промпта."""
+    messages = body.get("messages") or []
+    system = str(messages[0].get("content") or "") if messages else ""
+    user = str(messages[-1].get("content") or "") if messages else ""
+    rng = random.Random(zlib.crc32(user.encode()))
+
+    if body.get("response_format"):
+        # Один вызов: выбор мест с пояснениями по json_schema
+        count = _first_int(r"список из (\d+) мест", user, 10)
+        target = _first_int(r"Выбери (\d+)", user, 5)
+        picks = rng.sample(range(count), min(target, count))
+        places = [{"index": i, "explanation": rng.choice(EXPLANATIONS), "minutes": rng.choice((20, 30, 45, 60))} for i in picks]
+        return json.dumps({"places": places}, ensure_ascii=False)
+    if "индексов" in system:
+        count = _first_int(r"от 0 до (\d+)", user, 9) + 1
+        target = _first_int(r"JSON-массив из (\d+) индексов", user, 5)
+        return json.dumps(rng.sample(range(count), min(target, count)))
+    if "объяснениями" in system:
+        count = _first_int(r"Ровно (\d+) элементов", user, 5)
+        items = [{"explanation": rng.choice(EXPLANATIONS), "minutes": rng.choice((20, 30, 45, 60))} for _ in range(count)]
+        return json.dumps(items, ensure_ascii=False)
+    if "альтернативные" in system:
+        return json.dumps(["планетарий", "выставочный зал", "арт-пространство", "смотровая площадка", "усадьба"], ensure_ascii=False)
+    # Классификация интересов в поисковые запросы
+    chosen = rng.sample(sorted(CLASSIFICATION_QUERIES), rng.randint(2, 3))
+    return json.dumps({cat: CLASSIFICATION_QUERIES.get(cat, []) if cat in chosen else [] for cat in ALL_CATEGORIES}, ensure_ascii=False)
+
+
+def build_app(profile: Dict[str, float], seed: int = 1) -> web.Application:
+    fake = FakeProviders(profile, seed)
+    app = web.Application()
+    app.router.add_get("/3.0/items", fake.items)
+    app.router.add_get("/1.x/", fake.geocode)
+    app.router.add_post("/v1/chat/completions", fake.chat)
+    app.router.add_get("/stats", fake.stats_view)
+    app.router.add_get("/healthz", fake.healthz)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушки 2ГИС, геокодера Яндекса и OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--seed", type=int, default=1)
+    for name in ("latency", "jitter", "llm_latency", "llm_chunk_delay", "error_rate", "items"):
+        parser.add_argument("--" + name.replace("_", "-"), type=float, dest=name, help="переопределяет параметр профиля")
+    args = parser.parse_args()
+    profile = dict(PROFILES[args.profile])
+    profile.update({k: getattr(args, k) for k in profile if getattr(args, k, None) is not None})
+    print(f"Заглушки на http://{args.host}:{args.port}, профиль {args.profile}: {profile}", flush=True)
+    web.run_app(build_app(profile, args.seed), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
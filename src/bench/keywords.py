@@ -0,0 +1,95 @@
+"""
+Фильтр кандидатов и эвристики интересов: один проход KeywordMatcher против
+прежних линейных проверок any(k in text ...).
+
+На 10 000 синтетических мест и строк интересов сверяет, что результаты
+совпадают, и сравнивает время.
+
+Запуск: python -m src.bench.keywords [N]
+"""
+
+from __future__ import annotations
+
+import random
+import sys
+import time
+from typing import Callable, List, Set
+
+from ..categories_config import (
+    ADMIN_KEYWORDS,
+    FOOD_KEYWORDS,
+    FOOD_PLACE_KEYWORDS,
+    HEURISTIC_RULES,
+    NATURE_PLACE_KEYWORDS,
+    PARK_KEYWORDS,
+)
+from ..gpt_chat import _INTEREST_MATCHER, _filter_unwanted_places
+from ..place import RUBRICS as RUBRIC_TABLE, Place
+
+RUBRICS = [
+    "Музеи", "Парки культуры и отдыха", "Кафе", "Рестораны", "Банки", "Офисы компаний", "Скверы",
+    "Храмы", "Театры", "Кофейни", "Бизнес-центры", "Набережные", "Библиотеки", "Галереи", "Бары",
+]
+NAME_WORDS = ["Нижегородский", "Городской", "Волжский", "Кремлёвский", "Сбербанк", "Гриль", "Сад", "Дом", "Центр", "Арт"]
+INTEREST_WORDS = [
+    "история", "кремль", "храмы", "парки", "гулять", "кафе", "еда", "набережная", "мосты", "закат",
+    "музеи", "искусство", "военная техника", "стрит-арт", "спорт", "дети", "кино", "архитектура века",
+]
+
+
+def _old_filter(places: List[Place], allow_food: bool) -> List[Place]:
+    """Прежний _filter_unwanted_places: по проходу any() на каждый список слов."""
+    filtered = []
+    for p in places:
+        rub = ", ".join(p.rubrics).lower()
+        name = p.name.lower()
+        if any(k in rub or k in name for k in ADMIN_KEYWORDS):
+            continue
+        if not allow_food:
+            is_food = any(k in rub or k in name for k in FOOD_PLACE_KEYWORDS)
+            is_nature = any(k in rub or k in name for k in NATURE_PLACE_KEYWORDS)
+            if is_food and not is_nature:
+                continue
+        filtered.append(p)
+    return filtered
+
+
+def _old_interest_hits(text: str) -> Set[object]:
+    def _match(keyword: str) -> bool:
+        parts = [part.strip() for part in keyword.split("&") if part.strip()]
+        return all(part in text for part in parts)
+
+    hits: Set[object] = {i for i, (keywords, _, _) in enumerate(HEURISTIC_RULES) if any(_match(k) for k in keywords)}
+    if any(k in text for k in FOOD_KEYWORDS):
+        hits.add("food")
+    if any(k in text for k in PARK_KEYWORDS):
+        hits.add("parks")
+    return hits
+
+
+def _timed(fn: Callable[[], List]) -> tuple[List, float]:
+    t0 = time.perf_counter()
+    out = fn()
+    return out, (time.perf_counter() - t0) * 1000
+
+
+def main(n: int = 10_000) -> None:
+    rng = random.Random(0)
+    places = [
+        Place(name=" ".join(rng.sample(NAME_WORDS, 2)), rubric_ids=RUBRIC_TABLE.ids(rng.sample(RUBRICS, rng.randint(1, 3))))
+        for _ in range(n)
+    ]
+    interests = [", ".join(rng.sample(INTEREST_WORDS, rng.randint(1, 4))) for _ in range(n)]
+
+    old_places, old_places_ms = _timed(lambda: _old_filter(places, allow_food=False))
+    new_places, new_places_ms = _timed(lambda: _filter_unwanted_places(places, allow_food=False))
+    old_hits, old_hits_ms = _timed(lambda: [_old_interest_hits(text) for text in interests])
+    new_hits, new_hits_ms = _timed(lambda: [_INTEREST_MATCHER.labels(text) for text in interests])
+
+    print(f"Мест / строк интересов: {n}")
+    print(f"Фильтр мест:       было {old_places_ms:7.1f} мс, стало {new_places_ms:7.1f} мс, совпадает: {old_places == new_places}")
+    print(f"Правила интересов: было {old_hits_ms:7.1f} мс, стало {new_hits_ms:7.1f} мс, совпадает: {old_hits == new_hits}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
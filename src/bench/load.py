@@ -0,0 +1,207 @@
+"""
+Нагрузочный бенчмарк конвейера маршрутов на заглушках провайдеров.
+
+Поднимает src.bench.fake_providers отдельным процессом, направляет на него
+2ГИС, геокодер Яндекса и OpenAI и гоняет N запросов маршрута с
+параллельностью C: геокодирование старта (адрес → координаты или
+координаты → адрес, как в боте), затем generate_route_result с колбэком
+прогресса. Печатает пропускную способность, долю удачных маршрутов,
+p50/p95/p99 по этапам (src.metrics) и число вызовов каждого провайдера на
+маршрут: если этап снова начнёт ходить в сеть последовательно, это видно по
+его перцентилям и по общему времени.
+
+Кэши — только в памяти, каталог мест не подключается: каждый запуск
+начинается с холодных кэшей.
+
+Запуск: python -m src.bench.load [-n 200] [-c 20] [--profile realistic] [--error-rate 0.05]
+Остальные настройки конвейера (LLM_PIPELINE_MODE, RANKING_MODE, OPENAI_RPM, ...)
+берутся из окружения как обычно.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List, Tuple
+
+INTERESTS = [
+    "история и архитектура", "музеи", "парки и набережная", "храмы", "искусство и галереи",
+    "красивые виды на Волгу", "театр и культура", "гулять по центру и кофе", "стрит-арт",
+    "что-нибудь необычное для ребёнка", "закат у воды", "старинные усадьбы и купеческие дома",
+]
+ADDRESSES = [
+    "Большая Покровская, 1", "площадь Минина и Пожарского", "Рождественская, 24", "Верхне-Волжская набережная, 5",
+    "Московский вокзал", "Нижне-Волжская набережная, 10", "Ильинская, 50", "проспект Гагарина, 100",
+]
+TIMES = (1.0, 2.0, 3.0, 4.0)
+SERVER_START_TIMEOUT = 20.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _configure_env(base_url: str) -> None:
+    """Направляет клиенты на заглушки; вызывается до импорта модулей конвейера."""
+    os.environ.update({
+        "DGIS_ITEMS_URL": f"{base_url}/3.0/items",
+        "YANDEX_GEOCODER_URL": f"{base_url}/1.x/",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_KEY": "bench",
+        "DGIS_API_KEY": "bench",
+        "YANDEX_API_KEY": "bench",
+        "CACHE_DB_PATH": "",
+        "POI_CATALOG_PATH": os.path.join("data", "catalog", "bench-none.json"),
+    })
+
+
+def _start_server(port: int, args: argparse.Namespace) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "src.bench.fake_providers", "--port", str(port), "--profile", args.profile]
+    for name in ("latency", "llm_latency", "error_rate", "items"):
+        value = getattr(args, name)
+        if value is not None:
+            cmd += ["--" + name.replace("_", "-"), str(value)]
+    proc = subprocess.Popen(cmd)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("fake providers did not start")
+
+
+def _fetch_json(url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+def _requests(n: int, seed: int) -> List[Dict[str, Any]]:
+    """Анкеты пользователей: половина пишет адрес, половина шлёт геопозицию."""
+    from ..twogis import CITY_CENTER_NN
+
+    rng = random.Random(seed)
+    forms = []
+    for i in range(n):
+        form: Dict[str, Any] = {"interests": rng.choice(INTERESTS), "time": rng.choice(TIMES)}
+        if i % 2:
+            form["location"] = rng.choice(ADDRESSES)
+        else:
+            form["location_coords"] = (
+                CITY_CENTER_NN[0] + rng.uniform(-0.03, 0.03),
+                CITY_CENTER_NN[1] + rng.uniform(-0.05, 0.05),
+            )
+        forms.append(form)
+    return forms
+
+
+async def _one(form: Dict[str, Any]) -> Tuple[bool, float]:
+    from ..gpt_chat import generate_route_result
+    from ..metrics import observe, stage
+    from ..yandex_api import get_address, get_coordinates
+
+    async def progress(_: str) -> None:
+        pass
+
+    started = time.perf_counter()
+    data = dict(form)
+    try:
+        with stage("geocode"):
+            if data.get("location_coords"):
+                data["location_label"] = await get_address(*data["location_coords"]) or ""
+            else:
+                coords = await get_coordinates(data["location"])
+                if coords:
+                    data["location_coords"] = coords
+        _, _, ok = await generate_route_result(data, progress=progress)
+    except Exception as e:
+        print(f"Ошибка маршрута: {e!r}", file=sys.stderr)
+        ok = False
+    elapsed = time.perf_counter() - started
+    observe("request", elapsed, "ok" if ok else "error")
+    return ok, elapsed
+
+
+async def _run(forms: List[Dict[str, Any]], concurrency: int) -> Tuple[int, float]:
+    from ..client import shutdown_clients
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(form: Dict[str, Any]) -> Tuple[bool, float]:
+        async with semaphore:
+            return await _one(form)
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(limited(form) for form in forms))
+    finally:
+        await shutdown_clients()
+    return sum(ok for ok, _ in results), time.perf_counter() - started
+
+
+def _report(total: int, ok: int, elapsed: float, providers: Dict[str, Dict[str, int]]) -> None:
+    from ..llm_scheduler import get_llm_scheduler_stats
+    from ..metrics import PERCENTILES, get_stage_stats
+    from ..route_cache import get_route_cache_stats
+
+    print(f"\nМаршрутов: {total}, удачных: {ok} ({ok / total:.0%}), за {elapsed:.1f} с — {total / elapsed:.2f} маршр./с")
+    header = f"{'этап':<16} | {'вызовов':>7} | {'запасной':>8} | {'ошибок':>6} | {'среднее мс':>10} | " + " | ".join(f"{'p%d мс' % p:>8}" for p in PERCENTILES)
+    print(header)
+    print("-" * len(header))
+    for name, stats in sorted(get_stage_stats().items(), key=lambda kv: -kv[1].total):
+        pct = stats.percentiles()
+        print(
+            f"{name:<16} | {stats.count:>7} | {stats.outcomes['fallback']:>8} | {stats.errors:>6} | {stats.total / stats.count * 1000:>10.1f} | "
+            + " | ".join(f"{pct[p] * 1000:>8.1f}" for p in PERCENTILES)
+        )
+    print("\nВызовы провайдеров на маршрут:")
+    for name, counters in providers.items():
+        print(f"  {name:<7} {counters['requests'] / total:>6.2f} (ошибок заглушки: {counters['errors']})")
+    print(f"\nКэш маршрутов: {get_route_cache_stats()}")
+    llm = get_llm_scheduler_stats()
+    print(f"\nOpenAI: повторов {llm['retries']}, 429 — {llm['rate_limited']}, отказов {llm['failures']}, очередь {llm['classes']}")
+
+
+def main() -> None:
+    # Модули конвейера читают адреса провайдеров при импорте — окружение настраивается раньше
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    _configure_env(base_url)
+    from .fake_providers import PROFILES
+
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон generate_route_result на заглушках провайдеров")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="сколько маршрутов построить")
+    parser.add_argument("-c", "--concurrency", type=int, default=10, help="сколько маршрутов строится одновременно")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="realistic")
+    parser.add_argument("--latency", type=float, help="задержка 2ГИС/Яндекса, сек")
+    parser.add_argument("--llm-latency", type=float, help="задержка GPT до первого токена, сек")
+    parser.add_argument("--error-rate", type=float, help="доля ответов с ошибкой")
+    parser.add_argument("--items", type=float, help="мест на страницу выдачи 2ГИС")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server = _start_server(port, args)
+    try:
+        forms = _requests(args.requests, args.seed)
+        ok, elapsed = asyncio.run(_run(forms, args.concurrency))
+        providers = _fetch_json(f"{base_url}/stats")
+    finally:
+        server.terminate()
+        server.wait()
+    _report(len(forms), ok, elapsed, providers)
+
+
+if __name__ == "__main__":
+    main()
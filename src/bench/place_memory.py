@@ -0,0 +1,86 @@
+"""
+Память на одно место: словарь (как раньше) против Place.
+
+Читает N мест из JSON (как из кэша поиска или файла каталога), дописывает
+поля конвейера и меряет через tracemalloc, сколько памяти удерживает одно
+место. Названия и адреса у всех мест разные; рубрики берутся из небольшого
+словаря, как в реальной выдаче.
+
+Запуск: python -m src.bench.place_memory [N]
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+from ..place import RUBRICS, Place
+
+RUBRIC_VOCABULARY = [
+    "Музеи", "Выставочные залы", "Парки культуры и отдыха", "Скверы", "Храмы", "Театры",
+    "Кафе", "Рестораны", "Памятники", "Смотровые площадки", "Достопримечательности", "Галереи",
+]
+
+
+def _raw(rng: random.Random, i: int) -> str:
+    """Одно место в том виде, в каком оно лежит в JSON-кэше или файле каталога."""
+    return json.dumps({
+        "name": f"Место {i} {rng.randrange(10 ** 6)}",
+        "address": f"улица {rng.randrange(500)}, {rng.randrange(1, 200)}",
+        "coords": [56.2 + rng.random() * 0.2, 43.8 + rng.random() * 0.3],
+        "rubrics": rng.sample(RUBRIC_VOCABULARY, rng.randint(1, 3)),
+        "rating": round(rng.uniform(3, 5), 1),
+        "type": "branch",
+    }, ensure_ascii=False)
+
+
+def _as_dict(line: str) -> dict:
+    item = json.loads(line)
+    item["coords"] = tuple(item["coords"])
+    item.update(category="history", distance_km=1.5, radius_m=5000)
+    return item
+
+
+def _as_place(line: str) -> Place:
+    place = Place.from_dict(json.loads(line))
+    place.category = "history"
+    place.distance_km = 1.5
+    place.radius_m = 5000
+    return place
+
+
+def _measure(build: Callable[[str], Any], lines: List[str]) -> tuple[float, float]:
+    """Удерживаемая память на место (tracemalloc) и время сборки без трассировки."""
+    t0 = time.perf_counter()
+    items = [build(line) for line in lines]
+    elapsed = time.perf_counter() - t0
+    del items
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [build(line) for line in lines]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return size / len(lines), elapsed
+
+
+def main(n: int = 50_000) -> None:
+    rng = random.Random(0)
+    lines = [_raw(rng, i) for i in range(n)]
+    RUBRICS.ids(RUBRIC_VOCABULARY)
+    dict_bytes, dict_s = _measure(_as_dict, lines)
+    place_bytes, place_s = _measure(_as_place, lines)
+    print(f"Мест: {n}")
+    print(f"dict : {dict_bytes:7.0f} байт/место, сборка {dict_s * 1000:6.1f} мс")
+    print(f"Place: {place_bytes:7.0f} байт/место, сборка {place_s * 1000:6.1f} мс")
+    print(f"Экономия: {1 - place_bytes / dict_bytes:.0%}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
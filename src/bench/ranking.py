@@ -0,0 +1,86 @@
+"""
+Размер промпта выбора мест с локальным ранжированием и без него.
+
+На воспроизводимых пулах кандидатов сравнивает промпт _gpt_select_best_places
+для всего пула (как раньше) и для RANKING_TOP_K лучших мест, долю
+релевантных мест в том, что видит модель, и время самого ранжирования.
+Точный расход токенов и задержку выбора на живом трафике показывает
+get_llm_usage_stats(): этапы select и select_ranked считаются отдельно.
+
+Запуск: python -m src.bench.ranking [число_сценариев]
+"""
+
+from __future__ import annotations
+
+import random
+import statistics
+import sys
+import time
+from typing import List
+
+from ..gpt_chat import _selection_prompt
+from ..place import RUBRICS, Place
+from ..ranking import RANKING_TOP_K, rank_candidates
+
+POOL_SIZES = (20, 50, 100)
+CHARS_PER_TOKEN = 2.7  # грубая оценка для русского текста
+TARGET = 5
+
+# (запрос, подходящие рубрики); «чужие» рубрики разбавляют пул, как реальная выдача 2ГИС
+WANTED = [("музей", ["Музеи", "Выставочные залы"]), ("парк", ["Парки культуры и отдыха", "Скверы"])]
+NOISE = ["Кафе", "Банки", "Салоны красоты", "Магазины одежды", "Автосервисы", "Офисы компаний"]
+
+
+def _pool(rng: random.Random, n: int) -> List[Place]:
+    places = []
+    for i in range(n):
+        if rng.random() < 0.35:
+            query, rubrics = rng.choice(WANTED)
+            picked = [rng.choice(rubrics)]
+        else:
+            query, picked = "", [rng.choice(NOISE)]
+        places.append(Place(
+            name=f"Место {i}",
+            rubric_ids=RUBRICS.ids(picked + ([rng.choice(NOISE)] if rng.random() < 0.3 else [])),
+            rating=round(rng.uniform(3.0, 5.0), 1) if rng.random() < 0.8 else None,
+            distance_km=rng.uniform(0.2, 10.0),
+            category="history" if query == "музей" else "parks" if query == "парк" else "general",
+        ))
+    return places
+
+
+def _relevant_share(places: List[Place]) -> float:
+    wanted = {r for _, rubrics in WANTED for r in rubrics}
+    shown = places[:30]  # _describe_candidates показывает модели не больше 30 мест
+    return sum(1 for p in shown if wanted & set(p.rubrics)) / max(1, len(shown))
+
+
+def main(runs: int = 100) -> None:
+    queries = [q for q, _ in WANTED]
+    print(f"{'пул':>4} | {'≈токенов было':>13} | {'≈токенов стало':>14} | {'релев. было':>11} | {'релев. стало':>12} | {'ранж. p50 мс':>12} | {'p99 мс':>7}")
+    for n in POOL_SIZES:
+        rng = random.Random(n)
+        before: List[float] = []
+        after: List[float] = []
+        share_before: List[float] = []
+        share_after: List[float] = []
+        elapsed: List[float] = []
+        for _ in range(runs):
+            pool = _pool(rng, n)
+            before.append(len(_selection_prompt(pool, "музеи и парки", TARGET)) / CHARS_PER_TOKEN)
+            share_before.append(_relevant_share(pool))
+            t0 = time.perf_counter()
+            ranked = rank_candidates([p.copy() for p in pool], queries, limit=RANKING_TOP_K)
+            elapsed.append((time.perf_counter() - t0) * 1000)
+            after.append(len(_selection_prompt(ranked, "музеи и парки", TARGET)) / CHARS_PER_TOKEN)
+            share_after.append(_relevant_share(ranked))
+        elapsed.sort()
+        print(
+            f"{n:>4} | {statistics.mean(before):>13.0f} | {statistics.mean(after):>14.0f} | "
+            f"{statistics.mean(share_before):>11.0%} | {statistics.mean(share_after):>12.0%} | "
+            f"{elapsed[len(elapsed) // 2]:>12.2f} | {elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.99))]:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
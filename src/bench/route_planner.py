@@ -0,0 +1,75 @@
+"""
+Сравнение планировщика маршрута с прежним порядком «как вернул GPT».
+
+На случайных (но воспроизводимых) шортлистах вокруг центра Нижнего
+Новгорода считает суммарное время переходов, число мест в маршруте и
+время работы планировщика.
+
+Запуск: python -m src.bench.route_planner [число_сценариев]
+"""
+
+from __future__ import annotations
+
+import random
+import statistics
+import sys
+import time
+from typing import List, Tuple
+
+from ..place import Place
+from ..route_planner import plan_route, plan_route_in_order
+from ..twogis import CITY_CENTER_NN
+
+SHORTLIST_SIZES = (4, 5, 8, 12, 20)
+TIME_HOURS = (1.0, 2.0, 3.0, 4.0)
+SPREAD_DEG = 0.04  # ~4 км по широте
+
+
+def _scenario(rng: random.Random, n: int) -> Tuple[List[Place], Tuple[float, float], float]:
+    lat0, lon0 = CITY_CENTER_NN
+    places = [
+        Place(
+            name=f"Место {i + 1}",
+            lat=lat0 + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            lon=lon0 + rng.uniform(-SPREAD_DEG * 1.8, SPREAD_DEG * 1.8),
+            gpt_time=rng.choice((20, 30, 30, 45, 60, 90)),
+        )
+        for i in range(n)
+    ]
+    start = (lat0 + rng.uniform(-0.01, 0.01), lon0 + rng.uniform(-0.02, 0.02))
+    return places, start, rng.choice(TIME_HOURS)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main(runs: int = 200) -> None:
+    print(f"{'мест':>5} | {'переходы GPT':>12} | {'переходы план':>13} | {'мест GPT':>8} | {'мест план':>9} | {'p50 мс':>7} | {'p99 мс':>7}")
+    for n in SHORTLIST_SIZES:
+        rng = random.Random(n)
+        travel_old: List[float] = []
+        travel_new: List[float] = []
+        count_old: List[int] = []
+        count_new: List[int] = []
+        elapsed: List[float] = []
+        for _ in range(runs):
+            places, start, hours = _scenario(rng, n)
+            old = plan_route_in_order(places, hours, start)
+            t0 = time.perf_counter()
+            new = plan_route(places, hours, start)
+            elapsed.append((time.perf_counter() - t0) * 1000)
+            travel_old.append(old.travel_min)
+            travel_new.append(new.travel_min)
+            count_old.append(len(old.order))
+            count_new.append(len(new.order))
+        print(
+            f"{n:>5} | {statistics.mean(travel_old):>12.1f} | {statistics.mean(travel_new):>13.1f} | "
+            f"{statistics.mean(count_old):>8.2f} | {statistics.mean(count_new):>9.2f} | "
+            f"{_percentile(elapsed, 0.5):>7.2f} | {_percentile(elapsed, 0.99):>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
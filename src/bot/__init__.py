@@ -6,6 +6,11 @@ from aiogram.enums import ParseMode
 from dotenv import load_dotenv
 
 from src.bot.handlers import get_handlers_router
+from src.bot.storage import create_storage
+from src.catalog import start_catalog_crawler, stop_catalog_crawler
+from src.client import startup_clients, shutdown_clients
+from src.metrics import start_metrics_server, stop_metrics_server
+from src.warmup import start_cache_warmup, stop_cache_warmup
 
 load_dotenv()
 BOT_TOKEN = getenv("BOT_TOKEN")
@@ -14,5 +19,13 @@ bot = Bot(
     token=BOT_TOKEN,
     default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2)
 )
-dp = Dispatcher()
-dp.include_router(get_handlers_router())
\ No newline at end of file
+dp = Dispatcher(storage=create_storage())
+dp.include_router(get_handlers_router())
+dp.startup.register(startup_clients)
+dp.startup.register(start_catalog_crawler)
+dp.startup.register(start_metrics_server)
+dp.startup.register(start_cache_warmup)
+dp.shutdown.register(stop_catalog_crawler)
+dp.shutdown.register(stop_cache_warmup)
+dp.shutdown.register(shutdown_clients)
+dp.shutdown.register(stop_metrics_server)
@@ -1,4 +1,8 @@
+import asyncio
+from contextlib import suppress
+
 from aiogram import F, Router
+from aiogram.exceptions import TelegramAPIError
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
@@ -10,9 +14,13 @@ from src.bot.states.main_states import MainForm
 from src.bot.utils.check_correct import is_valid_time, is_valid_location
 from src.bot.utils.correction import correction_location
 from src.bot.utils.json_loader import get_phrase_data
+from src.bot.utils.prefetch import prefetcher
+from src.bot.utils.progress import ProgressMessage
+from src.bot.utils.route_jobs import route_fingerprint, route_flights, route_queue
 import src.bot.keyboards.user_keyboards as ukb
 from src.yandex_api import get_coordinates, get_address, get_map, get_map_route
 from src.gpt_chat import generate_route_result
+from src.metrics import stage
 
 router = Router()
 
@@ -20,6 +28,7 @@ router = Router()
 @router.message(CommandStart())
 async def start_handler(message: Message, state: FSMContext):
     await state.clear()
+    prefetcher.cancel(message.chat.id)
     await message.answer(
         get_phrase_data("WELCOME", "message"),
         reply_markup=ukb.main_keyboard
@@ -37,6 +46,7 @@ async def help_handler(message: Message):
 @router.message(F.text == "Составить план прогулки")
 async def start_handler(message: Message, state: FSMContext):
     await state.clear()
+    prefetcher.cancel(message.chat.id)
     await message.answer(
         get_phrase_data("FORM", "INTERESTS_QUESTION", "message")
     )
@@ -56,12 +66,16 @@ async def process_interests(message: Message, state: FSMContext):
 @router.callback_query(F.data == "accept_interests")
 async def accept_interests(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
+    # Пока пользователь отвечает про время и место, интересы классифицируются в фоне
+    data = await state.get_data()
+    prefetcher.interests(callback.message.chat.id, data.get("interests") or "")
     await callback.message.answer(get_phrase_data("FORM", "TIME_QUESTION", "message"))
     await state.set_state(MainForm.TIME)
 
 @router.callback_query(F.data == "add_interests")
 async def add_interests(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
+    prefetcher.cancel(callback.message.chat.id)
     await callback.message.answer("Введите ещё интересы:")
     await state.set_state(MainForm.ADD_INTERESTS)
 
@@ -85,6 +99,7 @@ async def process_add_interests(message: Message, state: FSMContext):
 @router.callback_query(F.data == "delete_interests")
 async def delete_interests(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
+    prefetcher.cancel(callback.message.chat.id)
     await callback.message.answer("Введите интересы заново:")
     await state.update_data(interests="")
     await state.set_state(MainForm.INTERESTS)
@@ -129,11 +144,12 @@ async def process_location_geo(message: Message, state: FSMContext):
     loc = message.location
     coords = f"{loc.latitude}, {loc.longitude}"
     address = await get_address(loc.latitude, loc.longitude)
-    await state.update_data(
+    data = await state.update_data(
         location=coords,
         location_coords=(loc.latitude, loc.longitude),
         location_label=address or coords,
     )
+    prefetcher.places(message.chat.id, data.get("interests") or "", (loc.latitude, loc.longitude))
 
     await message.answer(
         f"Ваша локация: {address}. Верно?",
@@ -153,11 +169,12 @@ async def process_location_text(message: Message, state: FSMContext):
     coords = await get_coordinates(correction_location(message.text))
     address = await get_address(coords[0], coords[1])
 
-    await state.update_data(
+    data = await state.update_data(
         location=f"{coords[0]}, {coords[1]}",
         location_coords=(coords[0], coords[1]),
         location_label=address or message.text,
     )
+    prefetcher.places(message.chat.id, data.get("interests") or "", (coords[0], coords[1]))
 
     await message.answer(
         f"Ваша локация: {address}. Верно?",
@@ -169,11 +186,13 @@ async def process_location_text(message: Message, state: FSMContext):
 async def accept_location(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
     data = await state.get_data()
-    await send_summary(callback.message, data)
+    if not await send_summary(callback.message, data):
+        await callback.answer("Маршрут уже строится ⏳")
 
 @router.callback_query(F.data == "change_location")
 async def change_location(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup()
+    prefetcher.cancel(callback.message.chat.id, "places")
     await state.update_data(location="", location_coords=None, location_label="")
     await callback.message.answer(
         "Введите локацию заново:",
@@ -182,7 +201,41 @@ async def change_location(callback: CallbackQuery, state: FSMContext):
 
 
 # Итог
-async def send_summary(message: Message, data: dict):
+async def send_summary(message: Message, data: dict) -> bool:
+    """Строит и отправляет маршрут; False — такой же маршрут для этого чата уже строится.
+
+    Маршрут по другим данным, который ещё строится для этого чата, отменяется.
+    """
+    task, fresh = route_flights.do(message.chat.id, lambda: _deliver_route(message, data), version=route_fingerprint(data))
+    if not fresh:
+        return False
+    await asyncio.wait([task])
+    if not task.cancelled():
+        task.result()
+    return True
+
+
+async def _build_route(data: dict, progress: ProgressMessage):
+    """Маршрут через общую очередь; при перегрузке — облегчённый, без GPT и без очереди."""
+    if route_queue.overloaded():
+        route_queue.record_shed()
+        await progress.update("🧭 Сейчас очень много запросов — соберу маршрут по-быстрому ⏳")
+        return await generate_route_result(data, progress=progress.update, use_llm=False)
+
+    async def on_position(position: int) -> None:
+        await progress.update(
+            f"⏳ Сейчас много желающих прогуляться: вы {position}-й в очереди. "
+            "Начну подбирать маршрут, как только освободится место."
+        )
+
+    await route_queue.acquire(on_position)
+    try:
+        return await generate_route_result(data, progress=progress.update)
+    finally:
+        route_queue.release()
+
+
+async def _deliver_route(message: Message, data: dict):
     interests = data.get("interests")
     time = data.get("time")
     location = data.get("location")
@@ -194,30 +247,44 @@ async def send_summary(message: Message, data: dict):
         parse_mode=None
     )
 
+    # Сообщение об ожидании дописывается по мере готовности этапов
+    progress = ProgressMessage(loading_msg)
+
     try:
+        # Поиски, начатые, пока заполнялась анкета, достраиваются и берутся из кэшей
+        await prefetcher.settle(message.chat.id)
         # Генерация маршрута и списка координат
-        route_text, places_coords, ok = generate_route_result(data)
+        route_text, places_coords, ok = await _build_route(data, progress)
+        await progress.close()
 
         # Удаляем сообщение об ожидании
         await loading_msg.delete()
 
-        # Отправляем текст маршрута
-        await message.answer(
-            route_text,
-            reply_markup=ukb.main_keyboard,
-            parse_mode=None
-        )
-
-        # Отправляем ссылку на карту (с Markdown-ссылкой)
-        map_url = get_map(places_coords)
-        await message.answer(
-            f"[🗺 Посмотреть карту маршрута]({map_url})",
-            reply_markup=ukb.main_keyboard,
-            parse_mode="Markdown"
-        )
-
+        with stage("send"):
+            # Отправляем текст маршрута
+            await message.answer(
+                route_text,
+                reply_markup=ukb.main_keyboard,
+                parse_mode=None
+            )
+
+            # Отправляем ссылку на карту (с Markdown-ссылкой)
+            map_url = get_map(places_coords)
+            await message.answer(
+                f"[🗺 Посмотреть карту маршрута]({map_url})",
+                reply_markup=ukb.main_keyboard,
+                parse_mode="Markdown"
+            )
+
+    except asyncio.CancelledError:
+        # Пользователь изменил данные, пока строилось: новый маршрут уже подбирается
+        await progress.close()
+        with suppress(TelegramAPIError):
+            await loading_msg.edit_text("🔄 Данные изменились — подбираю маршрут заново.")
+        raise
     except Exception as e:
         # Если что-то пошло не так
+        await progress.close()
         await loading_msg.edit_text(
             "😕 Не удалось подобрать маршрут. Попробуйте ещё раз чуть позже."
         )
@@ -0,0 +1,175 @@
+"""
+Хранилище состояний FSM (анкета: интересы, время, локация) в SQLite.
+
+Файл в режиме WAL переживает перезапуск бота и общий для всех процессов
+на одной машине (воркеры вебхука, BOT_MODE=webhook): ответ пользователя
+может прийти в любой из них. Запись — одна строка на ключ FSM: состояние
+и данные компактным JSON. Каждая запись продлевает срок жизни на FSM_TTL;
+брошенные анкеты удаляются, а если сессий больше FSM_MAX_SESSIONS, первыми
+уходят те, что дольше всех не менялись. update_data — одна транзакция,
+чтобы два процесса не затёрли данные друг друга.
+
+SQLite синхронный, а ожидание блокировки файла другим процессом может
+длиться до FSM_BUSY_TIMEOUT, поэтому все обращения идут через один
+отдельный поток со своим соединением: цикл событий воркера не блокируется,
+а запросы одного процесса выполняются по очереди.
+
+FSM_DB_PATH пустой — обычное хранилище aiogram в памяти (для разработки).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from dotenv import load_dotenv
+
+from src.cache import connect
+
+load_dotenv()
+
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "")
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))  # сек с последнего изменения анкеты
+FSM_MAX_SESSIONS = int(os.getenv("FSM_MAX_SESSIONS", "100000"))
+FSM_BUSY_TIMEOUT = float(os.getenv("FSM_BUSY_TIMEOUT", "5"))  # сек ожидания блокировки файла другим процессом
+
+PURGE_INTERVAL = 60.0  # как часто (сек) при записи чистить просроченные и лишние сессии
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """BaseStorage aiogram поверх таблицы fsm(key, state, data, expires_at)."""
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = FSM_TTL,
+        max_sessions: int = FSM_MAX_SESSIONS,
+        key_builder: Optional[KeyBuilder] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._conn = connect(path, shared=False, timeout=FSM_BUSY_TIMEOUT)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+        self._purged_at = 0.0
+
+    async def _call(self, fn: Callable[..., T], *args: Any) -> T:
+        """Выполняет fn в потоке хранилища."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Чтение и запись под одной блокировкой файла — между процессами тоже."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _row(self, key: str) -> tuple[Optional[str], Dict[str, Any]]:
+        row = self._conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            # state.clear(): пустую анкету не храним
+            self._conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "expires_at = excluded.expires_at",
+                (key, state, _dumps(data), time.time() + self.ttl),
+            )
+        self._maybe_purge()
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        self.purge(now)
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Удаляет просроченные сессии и самые старые сверх max_sessions; возвращает, сколько удалено."""
+        removed = self._conn.execute("DELETE FROM fsm WHERE expires_at < ?", (now or time.time(),)).rowcount
+        extra = self._conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0] - self.max_sessions
+        if extra > 0:
+            removed += self._conn.execute(
+                "DELETE FROM fsm WHERE key IN (SELECT key FROM fsm ORDER BY expires_at LIMIT ?)", (extra,)
+            ).rowcount
+        if removed:
+            logger.info("FSM storage: removed %d stale sessions", removed)
+        return removed
+
+    def _set_state(self, skey: str, value: Optional[str]) -> None:
+        with self._transaction():
+            _, data = self._row(skey)
+            self._write(skey, value, data)
+
+    def _set_data(self, skey: str, data: Dict[str, Any]) -> None:
+        with self._transaction():
+            state, _ = self._row(skey)
+            self._write(skey, state, data)
+
+    def _update_data(self, skey: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self._transaction():
+            state, current = self._row(skey)
+            current.update(data)
+            self._write(skey, state, current)
+        return dict(current)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._call(self._set_state, self.key_builder.build(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._call(self._row, self.key_builder.build(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._call(self._set_data, self.key_builder.build(key), dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._call(self._row, self.key_builder.build(key)))[1]
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._call(self._update_data, self.key_builder.build(key), dict(data))
+
+    async def close(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+def create_storage() -> BaseStorage:
+    """SQLiteStorage, если задан FSM_DB_PATH, иначе MemoryStorage."""
+    if FSM_DB_PATH:
+        return SQLiteStorage(FSM_DB_PATH)
+    return MemoryStorage()
@@ -0,0 +1,163 @@
+"""
+Упреждающая подготовка маршрута, пока пользователь заполняет анкету.
+
+После подтверждения интересов в фоне классифицируются интересы, после
+ввода локации — выполняются поиски 2ГИС вокруг точки старта. Результаты
+ложатся в общие кэши (классификации и поиска), и построение маршрута берёт
+их оттуда; перед построением send_summary дожидается (не дольше
+PREFETCH_WAIT секунд) ещё идущей подготовки этого чата, чтобы не повторять
+те же запросы.
+
+Вызовы GPT подготовки идут с фоновым приоритетом и уступают маршрутам,
+которых пользователи уже ждут; когда построение маршрута этого чата начинает
+ждать подготовку, её вызовы поднимаются до интерактивных — иначе под
+нагрузкой ожидание съедало бы весь PREFETCH_WAIT. Подготовка одного чата отменяется, если он
+начинает анкету заново или меняет ответ; чатов с подготовкой не больше
+PREFETCH_MAX_SESSIONS (старейшие вытесняются), а брошенные через
+PREFETCH_TTL секунд отменяются.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from src.gpt_chat import prefetch_route_inputs
+from src.llm_scheduler import PRIORITY_BACKGROUND, Priority, background_priority
+from src.metrics import register_gauge
+
+PREFETCH_MAX_SESSIONS = int(os.getenv("PREFETCH_MAX_SESSIONS", "500"))  # 0 — без упреждающей подготовки
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "900"))
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class _Session:
+    __slots__ = ("started_at", "tasks", "priorities")
+
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.tasks: Dict[str, asyncio.Task] = {}  # "interests" | "places" → задача
+        self.priorities: List[Priority] = []  # приоритеты вызовов GPT задач — поднимаются в settle()
+
+
+class Prefetcher:
+    """Фоновые задачи подготовки по чатам с ограничением числа чатов и времени жизни."""
+
+    def __init__(self, max_sessions: int = PREFETCH_MAX_SESSIONS, ttl: float = PREFETCH_TTL) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[int, _Session]" = OrderedDict()
+        self.stats = {"started": 0, "used": 0, "cancelled": 0, "evicted": 0, "failed": 0}
+
+    def _session(self, chat_id: int) -> _Session:
+        self._expire()
+        session = self._sessions.get(chat_id)
+        if session is None:
+            while len(self._sessions) >= self.max_sessions:
+                _, oldest = self._sessions.popitem(last=False)
+                self.stats["evicted"] += self._cancel_tasks(oldest)
+            session = self._sessions[chat_id] = _Session()
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            chat_id, session = next(iter(self._sessions.items()))
+            if session.started_at > deadline:
+                break
+            del self._sessions[chat_id]
+            self.stats["evicted"] += self._cancel_tasks(session)
+
+    @staticmethod
+    def _cancel_tasks(session: _Session) -> int:
+        pending = [task for task in session.tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+    def _start(self, chat_id: int, kind: str, interests: str, origin: Optional[Tuple[float, float]]) -> None:
+        if self.max_sessions <= 0:
+            return
+        session = self._session(chat_id)
+        previous = session.tasks.get(kind)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self.stats["cancelled"] += 1
+        before = session.tasks.get("interests") if kind == "places" else None
+        priority = Priority(PRIORITY_BACKGROUND)
+        session.priorities.append(priority)
+
+        async def run() -> None:
+            if before is not None:
+                # Сначала дождаться классификации тех же интересов, чтобы не спрашивать GPT дважды
+                await asyncio.wait([before])
+            try:
+                with background_priority(priority):
+                    await prefetch_route_inputs(interests, origin)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.debug("Prefetch %s for chat %s failed: %s", kind, chat_id, e)
+
+        session.tasks[kind] = asyncio.ensure_future(run())
+        self.stats["started"] += 1
+
+    def interests(self, chat_id: int, interests: str) -> None:
+        """Интересы подтверждены: классифицировать их в фоне."""
+        self._start(chat_id, "interests", interests, None)
+
+    def places(self, chat_id: int, interests: str, origin: Tuple[float, float]) -> None:
+        """Известна точка старта: выполнить поиски мест в фоне."""
+        self._start(chat_id, "places", interests, origin)
+
+    def cancel(self, chat_id: int, kind: Optional[str] = None) -> None:
+        """Отменяет подготовку чата целиком или одного вида (ответ изменён, анкета начата заново)."""
+        session = self._sessions.get(chat_id)
+        if session is None:
+            return
+        if kind is None:
+            del self._sessions[chat_id]
+            self.stats["cancelled"] += self._cancel_tasks(session)
+            return
+        task = session.tasks.pop(kind, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.stats["cancelled"] += 1
+
+    async def settle(self, chat_id: int, timeout: float = PREFETCH_WAIT) -> None:
+        """Перед построением маршрута: ждёт незавершённую подготовку чата и забывает её."""
+        session = self._sessions.pop(chat_id, None)
+        if session is None or not session.tasks:
+            return
+        self.stats["used"] += 1
+        pending = [task for task in session.tasks.values() if not task.done()]
+        if not pending:
+            return
+        # Подготовку теперь ждёт пользователь: её вызовы GPT больше не фоновые
+        for priority in session.priorities:
+            priority.promote()
+        _, still_running = await asyncio.wait(pending, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+prefetcher = Prefetcher()
+
+register_gauge("prefetch_sessions", "Чатов с упреждающей подготовкой маршрута", lambda: len(prefetcher))
+register_gauge(
+    "prefetch_total",
+    "Упреждающая подготовка: started, used — пригодилась при построении, cancelled, evicted, failed",
+    lambda: [({"kind": kind}, count) for kind, count in prefetcher.stats.items()],
+    kind="counter",
+)
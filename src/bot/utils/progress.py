@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+# Не чаще одной правки сообщения за столько секунд (лимиты Telegram на edit)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "1.5"))
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMessage:
+    """Сообщение «подбираю маршрут», которое дописывается по ходу работы.
+
+    update() можно вызывать сколь угодно часто, он не ждёт Telegram: правка
+    уходит фоновой задачей сразу, если с прошлой прошло min_interval, иначе
+    откладывается и отправляется последний текст. Ошибки правки (сообщение удалено, текст не изменился,
+    сеть) не прерывают построение маршрута; на просьбу Telegram подождать
+    (RetryAfter) правка откладывается на указанное время.
+    """
+
+    def __init__(self, message: Message, min_interval: float = PROGRESS_EDIT_INTERVAL) -> None:
+        self.message = message
+        self.min_interval = min_interval
+        self._text = message.text or ""
+        self._pending: Optional[str] = None
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def update(self, text: str) -> None:
+        """Запоминает текст; правка уходит в фоновой задаче, вызывающий не ждёт Telegram."""
+        if self._closed or not text or text == self._text:
+            return
+        self._pending = text
+        if self._flush_task is None:
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            self._flush_task = asyncio.create_task(self._flush_later(max(0.0, wait)))
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        text, self._pending = self._pending, None
+        if self._closed or text is None or text == self._text:
+            return
+        previous = self._text
+        self._last_edit = time.monotonic()
+        self._text = text
+        try:
+            await self.message.edit_text(text[:4096], parse_mode=None)
+        except TelegramBadRequest:
+            pass
+        except TelegramRetryAfter as e:
+            # Текст не ушёл: отправим последний, когда Telegram разрешит
+            self._text = previous
+            if self._pending is None:
+                self._pending = text
+            self._last_edit = time.monotonic() + e.retry_after - self.min_interval
+            if self._flush_task is None and not self._closed:
+                self._flush_task = asyncio.create_task(self._flush_later(e.retry_after))
+        except TelegramAPIError as e:
+            self._text = previous
+            logger.warning("Progress message edit failed: %s", e)
+
+    async def close(self) -> None:
+        """Отменяет отложенную правку; после этого сообщение можно удалить или заменить."""
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
@@ -0,0 +1,151 @@
+"""
+Очередь построения маршрутов: не больше ROUTE_CONCURRENCY конвейеров
+одновременно на процесс, остальные ждут по порядку и видят своё место в
+очереди. Если ждущих уже ROUTE_QUEUE_MAX, новый запрос в очередь не
+ставится — вызывающий строит облегчённый маршрут без GPT.
+
+В одном чате строится не больше одного маршрута. Повторный запрос того же
+маршрута (двойное нажатие «Верно», повторное подтверждение той же локации)
+присоединяется к уже идущему, а запрос с другими данными (пока строилось,
+пользователь прислал новую локацию) отменяет прежнее построение.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from src.metrics import register_gauge
+
+ROUTE_CONCURRENCY = int(os.getenv("ROUTE_CONCURRENCY", "8"))
+ROUTE_QUEUE_MAX = int(os.getenv("ROUTE_QUEUE_MAX", "30"))
+
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class _Waiter:
+    __slots__ = ("granted", "moved")
+
+    def __init__(self) -> None:
+        self.granted = False
+        self.moved = asyncio.Event()  # очередь сдвинулась или место выдано
+
+
+class RouteQueue:
+    """FIFO на ограниченное число одновременных маршрутов."""
+
+    def __init__(self, concurrency: int = ROUTE_CONCURRENCY, max_waiting: int = ROUTE_QUEUE_MAX) -> None:
+        self.concurrency = max(1, concurrency)
+        self.max_waiting = max(0, max_waiting)
+        self.active = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self.stats = {"started": 0, "queued": 0, "shed": 0}
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def overloaded(self) -> bool:
+        """Свободных мест нет и очередь заполнена — новый запрос пора обслуживать облегчённо."""
+        return self.active >= self.concurrency and len(self._waiters) >= self.max_waiting
+
+    async def acquire(self, on_position: Optional[PositionCallback] = None) -> None:
+        """Ждёт свободного места; пока ждёт, сообщает on_position(номер в очереди с 1)."""
+        self.stats["started"] += 1
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        self.stats["queued"] += 1
+        waiter = _Waiter()
+        self._waiters.append(waiter)
+        try:
+            while True:
+                # Сбрасываем до колбэка: сдвиг очереди во время правки сообщения не потеряется
+                waiter.moved.clear()
+                if waiter.granted:
+                    return
+                if on_position is not None:
+                    await on_position(self._waiters.index(waiter) + 1)
+                await waiter.moved.wait()
+        except BaseException:
+            if waiter.granted:
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                self._notify_moved()
+            raise
+
+    def release(self) -> None:
+        """Освобождает место: отдаёт его первому в очереди или уменьшает число занятых."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.moved.set()
+            self._notify_moved()
+        else:
+            self.active -= 1
+
+    def _notify_moved(self) -> None:
+        for waiter in self._waiters:
+            waiter.moved.set()
+
+    def record_shed(self) -> None:
+        self.stats["shed"] += 1
+
+
+def route_fingerprint(data: Dict[str, Any]) -> str:
+    """Что определяет маршрут: интересы, время и точка старта из данных анкеты."""
+    coords = data.get("location_coords")
+    return json.dumps(
+        [
+            " ".join(str(data.get("interests") or "").lower().split()),
+            str(data.get("time") or ""),
+            [round(float(c), 5) for c in coords] if coords else str(data.get("location") or "").strip().lower(),
+        ],
+        ensure_ascii=False,
+    )
+
+
+class SingleFlight:
+    """Одна задача на ключ: повторный вызов с тем же ключом и той же версией получает уже идущую.
+
+    Вызов с другой версией отменяет идущую задачу ключа и запускает новую.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: Dict[Hashable, Tuple[asyncio.Task, Hashable]] = {}
+
+    def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]], version: Hashable = None) -> Tuple[asyncio.Task, bool]:
+        """Возвращает (задача, новая ли). Задача забывается, как только завершится."""
+        current = self._tasks.get(key)
+        if current is not None and not current[0].done():
+            if current[1] == version:
+                return current[0], False
+            current[0].cancel()
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = (task, version)
+        task.add_done_callback(lambda t: self._tasks.pop(key, None) if self._tasks.get(key, (None,))[0] is t else None)
+        return task, True
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+
+route_queue = RouteQueue()
+route_flights = SingleFlight()
+
+register_gauge(
+    "route_slots",
+    "Маршруты в работе (active) и ждущие в очереди (waiting)",
+    lambda: [({"state": "active"}, route_queue.active), ({"state": "waiting"}, route_queue.waiting)],
+)
+register_gauge(
+    "route_requests_total",
+    "Запросы маршрутов: started — всего, queued — ждали места, shed — облегчённые при перегрузке",
+    lambda: [({"kind": kind}, count) for kind, count in route_queue.stats.items()],
+    kind="counter",
+)
+register_gauge("route_builds_in_flight", "Чатов, для которых сейчас строится маршрут", lambda: len(route_flights))
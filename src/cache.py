@@ -0,0 +1,277 @@
+"""
+Кэши для внешних вызовов: LRU в памяти с TTL и необязательный слой в SQLite.
+
+Запись в SQLite (кэши, счётчики популярности, журнал запросов) идёт в фоне:
+run_on_db_thread() ставит её в очередь одного потока со своим соединением,
+и цикл событий не ждёт ни вставок, ни чистки, ни контрольных точек WAL.
+Чтение по ключу остаётся синхронным: в режиме WAL оно не ждёт писателя.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Один файл SQLite на все постоянные кэши (по таблице на кэш). Пусто — только память.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")
+CACHE_DB_MAX_ROWS = int(os.getenv("CACHE_DB_MAX_ROWS", "200000"))  # строк на таблицу кэша; 0 — без ограничения
+
+PURGE_INTERVAL = 60.0  # как часто (сек) при записи чистить просроченные и лишние строки
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()  # Маркер «нет в кэше», чтобы отличать его от закэшированного None
+
+_connections: Dict[str, sqlite3.Connection] = {}
+_db_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-db")
+_db_thread_connections: Dict[str, sqlite3.Connection] = {}  # только для потока _db_thread
+
+
+def _encode(value: Any) -> Any:
+    """Объекты с to_dict() (например, Place) пишутся на диск своим словарём."""
+    to_dict = getattr(value, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def connect(path: str, shared: bool = True, timeout: float = 5.0) -> sqlite3.Connection:
+    """Соединение с файлом SQLite в режиме WAL (автокоммит, транзакции — явно).
+
+    shared — общее на процесс соединение; иначе — своё (для кода, который
+    держит на нём транзакции из отдельного потока).
+    """
+    conn = _connections.get(path) if shared else None
+    if conn is None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if shared:
+            _connections[path] = conn
+    return conn
+
+
+def db_thread_connection(path: str = CACHE_DB_PATH) -> sqlite3.Connection:
+    """Соединение потока записи; вызывать только из функций, переданных в run_on_db_thread()."""
+    conn = _db_thread_connections.get(path)
+    if conn is None:
+        conn = _db_thread_connections[path] = connect(path, shared=False)
+    return conn
+
+
+def _log_failure(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Cache DB write failed: %s", future.exception())
+
+
+def run_on_db_thread(fn: Callable[..., Any], *args: Any) -> Future:
+    """Выполняет fn(*args) в потоке записи SQLite, по порядку постановки.
+
+    Ждать результата не обязательно (ошибки пишутся в лог); из корутины —
+    await asyncio.wrap_future(run_on_db_thread(...)).
+    """
+    future = _db_thread.submit(fn, *args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+class SQLiteStore:
+    """Постоянный слой кэша: таблица key → JSON-значение со сроком годности.
+
+    Запись и чистка — в потоке записи (run_on_db_thread). При записи (не чаще
+    раза в PURGE_INTERVAL) удаляются просроченные строки, а если их больше
+    max_rows — те, что истекают раньше всех.
+    """
+
+    def __init__(self, table: str, path: str = CACHE_DB_PATH, max_rows: int = CACHE_DB_MAX_ROWS) -> None:
+        self.table = table
+        self.path = path
+        self.max_rows = max_rows
+        self.grace = 0.0  # сколько ещё хранить строку после срока (окно stale_ttl кэша)
+        self._purged_at = 0.0
+        self._conn = connect(path)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+
+    def get(self, key: str) -> Tuple[Any, float] | None:
+        row = self._conn.execute(
+            f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float) -> None:
+        # JSON собирается сразу: значение может измениться, пока запись ждёт очереди
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_encode)
+        run_on_db_thread(self._write, key, text, expires_at)
+        now = time.time()
+        if now - self._purged_at >= PURGE_INTERVAL:
+            self._purged_at = now
+            run_on_db_thread(self.purge, now)
+
+    def _write(self, key: str, text: str, expires_at: float) -> None:
+        db_thread_connection(self.path).execute(
+            f"INSERT INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, text, expires_at),
+        )
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        """Удаляет просроченные строки (в потоке записи)."""
+        cur = db_thread_connection(self.path).execute(f"DELETE FROM {self.table} WHERE expires_at < ?", ((now or time.time()) - self.grace,))
+        return cur.rowcount
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Удаляет просроченные и истекающие раньше всех сверх max_rows (в потоке записи); возвращает, сколько удалено."""
+        conn = db_thread_connection(self.path)
+        removed = self.purge_expired(now)
+        if self.max_rows > 0:
+            extra = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_rows
+            if extra > 0:
+                removed += conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY expires_at LIMIT ?)",
+                    (extra,),
+                ).rowcount
+        if removed:
+            logger.info("Cache %s: removed %d stale rows", self.table, removed)
+        return removed
+
+
+def open_db() -> Optional[sqlite3.Connection]:
+    """Общее соединение с CACHE_DB_PATH для своих таблиц или None, если файл не задан."""
+    if not CACHE_DB_PATH:
+        return None
+    return connect(CACHE_DB_PATH)
+
+
+def open_store(table: str) -> Optional[SQLiteStore]:
+    """Возвращает постоянный слой для таблицы или None, если CACHE_DB_PATH не задан."""
+    if not CACHE_DB_PATH:
+        return None
+    return SQLiteStore(table, CACHE_DB_PATH)
+
+
+class TTLCache:
+    """LRU-кэш в памяти с TTL, ограничением размера и статистикой попаданий.
+
+    Если передан store, промахи в памяти дочитываются с диска, а записи
+    дублируются туда же. Ключи постоянного слоя — строки, значения — JSON
+    (кортежи вернутся списками, их приводит вызывающий код).
+    stale_ttl — сколько ещё секунд после истечения TTL запись можно отдать
+    через lookup() как устаревшую (stale-while-revalidate).
+    decode — чем превратить прочитанный с диска JSON обратно в значение
+    (например, словари мест в Place), чтобы в памяти лежал один тип.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        store: Optional[SQLiteStore] = None,
+        stale_ttl: float = 0.0,
+        decode: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.store = store
+        if store is not None:
+            # Устаревшее в окне stale_ttl ещё отдаётся — с диска его удалять рано
+            store.grace = max(store.grace, stale_ttl)
+        self.decode = decode
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _find(self, key: Hashable, now: float) -> Tuple[Any, float, bool] | None:
+        """Ищет запись в памяти, затем на диске: (значение, срок, с_диска).
+
+        Записи старше окна stale_ttl выбрасываются.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[1] + self.stale_ttl >= now:
+                self._data.move_to_end(key)
+                return entry[0], entry[1], False
+            del self._data[key]
+        if self.store is not None:
+            stored = self.store.get(str(key))
+            if stored is not None and stored[1] + self.stale_ttl >= now:
+                value = self.decode(stored[0]) if self.decode is not None else stored[0]
+                self._remember(key, value, stored[1])
+                return value, stored[1], True
+        return None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает только свежее значение, иначе default."""
+        value, fresh = self.lookup(key)
+        if value is MISSING or not fresh:
+            return default
+        return value
+
+    def lookup(self, key: Hashable) -> Tuple[Any, bool]:
+        """Возвращает (значение, свежее ли); устаревшее в окне stale_ttl — (значение, False), нет — (MISSING, False)."""
+        now = time.time()
+        entry = self._find(key, now)
+        if entry is None:
+            self.misses += 1
+            return MISSING, False
+        value, expires_at, from_disk = entry
+        if expires_at < now:
+            self.stale_hits += 1
+            return value, False
+        if from_disk:
+            self.disk_hits += 1
+        else:
+            self.hits += 1
+        return value, True
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        if self.store is not None:
+            self.store.set(str(key), value, expires_at)
+
+    def _remember(self, key: Hashable, value: Any, expires_at: float) -> None:
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Есть ли свежее значение (в памяти или на диске); статистику попаданий не трогает."""
+        now = time.time()
+        entry = self._find(key, now)
+        return entry is not None and entry[1] >= now
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+        }
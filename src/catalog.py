@@ -0,0 +1,359 @@
+"""
+Локальный каталог мест Нижнего Новгорода.
+
+Каталог хранит те же записи Place, что отдаёт search_places_2gis_by_query,
+и индексирует их сеткой
+по координатам и обратным индексом по рубрикам. Заполняется фоновым
+обходчиком по запросам из HEURISTIC_RULES и DEFAULT_CATEGORIES.
+
+Ручной обход: python -m src.catalog
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+from .categories_config import DEFAULT_CATEGORIES, HEURISTIC_RULES
+from .geo import distances_from
+from .place import Place
+from .twogis import CITY_CENTER_NN, plan_searches, search_places_2gis_many, snap_to_cell
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POI_CATALOG_PATH = os.getenv("POI_CATALOG_PATH", "data/catalog/nn_places.json")
+POI_CATALOG_CELL_M = float(os.getenv("POI_CATALOG_CELL_M", "1000"))
+POI_CATALOG_REFRESH_HOURS = float(os.getenv("POI_CATALOG_REFRESH_HOURS", "168"))  # 0 — не обходить в фоне
+POI_CATALOG_MIN_HITS = int(os.getenv("POI_CATALOG_MIN_HITS", "3"))  # меньше — идём в живой поиск
+POI_CATALOG_RELOAD_SEC = float(os.getenv("POI_CATALOG_RELOAD_SEC", "60"))  # как часто воркеры без обхода проверяют файл
+
+# Точки, из которых обходчик опрашивает 2ГИС: центр и районы города (lat, lon)
+CRAWL_ORIGINS: List[Tuple[float, float]] = [
+    CITY_CENTER_NN,      # Нижегородский
+    (56.300, 44.030),    # Советский
+    (56.270, 43.990),    # Приокский
+    (56.320, 43.940),    # Канавинский
+    (56.290, 43.930),    # Ленинский
+    (56.245, 43.860),    # Автозаводский
+    (56.330, 43.880),    # Московский
+    (56.350, 43.870),    # Сормовский
+]
+CRAWL_RADIUS_M = 20000
+CRAWL_LIMIT = 30  # две страницы на запрос
+
+# Рубрика считается «своей» для запроса, если встретилась хотя бы у такой доли его выдачи
+QUERY_RUBRIC_SHARE = 0.2
+RUBRIC_SCAN_LIMIT = 512  # до такого числа мест по рубрикам проверяем их напрямую, дальше — через сетку
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+
+def _is_named(query: str) -> bool:
+    """Запрос называет конкретное место («Нижегородский кремль», «набережная Федоровского»), а не тип мест."""
+    return any(ch.isupper() for ch in query or "")
+
+
+def crawl_queries() -> List[str]:
+    """Все поисковые строки, которые может породить классификация интересов."""
+    queries: List[str] = []
+    for _, _, rule_queries in HEURISTIC_RULES:
+        queries.extend(rule_queries)
+    for default_queries in DEFAULT_CATEGORIES.values():
+        queries.extend(default_queries)
+    return list(dict.fromkeys(queries))
+
+
+class PlaceCatalog:
+    """Места в памяти с сеточным индексом по координатам и индексами по рубрикам и запросам."""
+
+    def __init__(self, cell_m: float = POI_CATALOG_CELL_M) -> None:
+        self.cell_m = cell_m
+        self.places: List[Place] = []
+        self.crawled_at = 0.0
+        self._by_key: Dict[str, int] = {}
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._by_rubric: Dict[str, Set[int]] = {}  # нормализованное название рубрики → места
+        self._by_query: Dict[str, List[int]] = {}
+        self._query_rubrics: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def add(self, place: Place, query: Optional[str] = None) -> int:
+        """Добавляет место (повтор по name|address не дублируется) и привязывает его к запросу."""
+        key = place.key
+        pid = self._by_key.get(key)
+        if pid is None:
+            # Поля конвейера (расстояние, пояснения) в каталог не попадают
+            item = Place(
+                name=place.name,
+                address=place.address,
+                lat=place.lat,
+                lon=place.lon,
+                rubric_ids=place.rubric_ids,
+                rating=place.rating,
+                type=place.type,
+            )
+            pid = len(self.places)
+            self.places.append(item)
+            self._by_key[key] = pid
+            if item.coords is not None:
+                cell, _ = snap_to_cell(item.coords, self.cell_m)
+                self._grid.setdefault(cell, []).append(pid)
+            for rubric in item.normalized_rubrics:
+                self._by_rubric.setdefault(rubric, set()).add(pid)
+        if query:
+            ids = self._by_query.setdefault(_norm(query), [])
+            if pid not in ids:
+                ids.append(pid)
+                self._query_rubrics.pop(_norm(query), None)
+        return pid
+
+    def rubrics_for_query(self, query: str) -> Set[str]:
+        """Рубрики, типичные для выдачи 2ГИС по этому запросу (по результатам обхода)."""
+        key = _norm(query)
+        cached = self._query_rubrics.get(key)
+        if cached is not None:
+            return cached
+        ids = self._by_query.get(key) or []
+        counts = Counter(r for pid in ids for r in self.places[pid].normalized_rubrics)
+        threshold = max(1, math.ceil(len(ids) * QUERY_RUBRIC_SHARE))
+        rubrics = {rubric for rubric, n in counts.items() if n >= threshold}
+        if ids:
+            self._query_rubrics[key] = rubrics
+        return rubrics
+
+    def _ids_near(self, origin: Tuple[float, float], radius_m: float) -> Iterable[int]:
+        (ci, cj), _ = snap_to_cell(origin, self.cell_m)
+        dlat = self.cell_m / 111_320.0
+        dlon = self.cell_m / (111_320.0 * math.cos(math.radians(CITY_CENTER_NN[0])))
+        di = math.ceil((radius_m / 111_320.0) / dlat)
+        dj = math.ceil((radius_m / (111_320.0 * math.cos(math.radians(origin[0])))) / dlon)
+        for i in range(ci - di, ci + di + 1):
+            for j in range(cj - dj, cj + dj + 1):
+                yield from self._grid.get((i, j), ())
+
+    def _rubric_ids(self, origin: Tuple[float, float], radius_m: float, rubrics: Set[str]) -> Iterable[int]:
+        wanted: Set[int] = set()
+        for rubric in rubrics:
+            wanted |= self._by_rubric.get(_norm(rubric), set())
+        if len(wanted) <= RUBRIC_SCAN_LIMIT:
+            # Короткий список по рубрикам быстрее проверить напрямую, чем обходить ячейки сетки
+            return wanted
+        return (pid for pid in self._ids_near(origin, radius_m) if pid in wanted)
+
+    def _nearest(self, origin: Tuple[float, float], radius_m: float, ids: Iterable[int]) -> List[Tuple[float, int]]:
+        """(расстояние, место) в радиусе, ближние первыми."""
+        radius_km = radius_m / 1000.0
+        pids = [pid for pid in ids if self.places[pid].coords is not None]
+        distances = distances_from(origin, [self.places[pid].coords for pid in pids]).tolist() if pids else []
+        return sorted((d, pid) for d, pid in zip(distances, pids) if d <= radius_km)
+
+    def find(
+        self,
+        origin: Tuple[float, float],
+        radius_m: float,
+        rubrics: Optional[Set[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Place]:
+        """Места в радиусе от origin (ближние первыми), при rubrics — только с этими рубриками.
+
+        Возвращает копии с заполненным distance_km, как после живого поиска.
+        """
+        ids = self._rubric_ids(origin, radius_m, rubrics) if rubrics is not None else self._ids_near(origin, radius_m)
+        found = self._nearest(origin, radius_m, ids)
+        if limit is not None:
+            found = found[:limit]
+        return [self.places[pid].copy(distance_km=d) for d, pid in found]
+
+    def find_for_query(self, query: str, origin: Tuple[float, float], radius_m: float, limit: int) -> Optional[List[Place]]:
+        """Кандидаты для поискового запроса из каталога; None — каталог запрос не покрывает.
+
+        Сначала — места, которые 2ГИС нашёл по этому запросу при обходе. Общий
+        запрос («музей») добирается местами его типичных рубрик; названный
+        («Нижегородский кремль») — только если своих мест в радиусе мало, и
+        тогда они идут первыми: иначе ближайшие места той же рубрики подменили бы
+        то, что просил пользователь.
+        """
+        own = self._nearest(origin, radius_m, self._by_query.get(_norm(query)) or ())
+        found = own
+        named = _is_named(query)
+        if not named or len(own) < POI_CATALOG_MIN_HITS:
+            rubrics = self.rubrics_for_query(query)
+            if rubrics:
+                own_ids = {pid for _, pid in own}
+                wider = [(d, pid) for d, pid in self._nearest(origin, radius_m, self._rubric_ids(origin, radius_m, rubrics)) if pid not in own_ids]
+                found = own + wider if named else sorted(own + wider)
+        found = found[:limit]
+        if len(found) < min(limit, POI_CATALOG_MIN_HITS) or (named and not own):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [self.places[pid].copy(distance_km=d) for d, pid in found]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "places": len(self.places),
+            "queries": len(self._by_query),
+            "rubrics": len(self._by_rubric),
+            "crawled_at": self.crawled_at,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def save(self, path: str = POI_CATALOG_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "crawled_at": self.crawled_at,
+            "places": [place.to_dict() for place in self.places],
+            "queries": self._by_query,
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = POI_CATALOG_PATH) -> "PlaceCatalog":
+        catalog = cls()
+        if not os.path.exists(path):
+            return catalog
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        places = payload.get("places") or []
+        for place in places:
+            catalog.add(Place.from_dict(place))
+        for query, ids in (payload.get("queries") or {}).items():
+            catalog._by_query[_norm(query)] = [pid for pid in ids if 0 <= pid < len(places)]
+        catalog.crawled_at = float(payload.get("crawled_at") or 0.0)
+        return catalog
+
+
+_catalog: Optional[PlaceCatalog] = None
+_catalog_mtime: Optional[float] = None  # mtime файла, из которого прочитан каталог
+_crawler_task: Optional[asyncio.Task] = None
+
+
+def _file_mtime(path: str = POI_CATALOG_PATH) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def get_catalog() -> PlaceCatalog:
+    """Каталог процесса; при первом обращении читается с диска."""
+    global _catalog, _catalog_mtime
+    if _catalog is None:
+        _catalog_mtime = _file_mtime()
+        _catalog = PlaceCatalog.load()
+    return _catalog
+
+
+async def crawl_catalog(
+    origins: Optional[List[Tuple[float, float]]] = None,
+    queries: Optional[List[str]] = None,
+    concurrency: int = 2,
+) -> PlaceCatalog:
+    """Обходит 2ГИС по всем запросам из каждой точки обхода и собирает новый каталог."""
+    catalog = PlaceCatalog()
+    queries = queries or crawl_queries()
+    searches = plan_searches(queries, [CRAWL_RADIUS_M], limit=CRAWL_LIMIT)
+    for origin in origins or CRAWL_ORIGINS:
+        results = await search_places_2gis_many(searches, origin=origin, concurrency=concurrency)
+        for (query, _, _, _), found in zip(searches, results):
+            for place in found:
+                catalog.add(place, query=query)
+    catalog.crawled_at = time.time()
+    return catalog
+
+
+async def _crawl_forever() -> None:
+    global _catalog, _catalog_mtime
+    while True:
+        catalog = get_catalog()
+        age_h = (time.time() - catalog.crawled_at) / 3600
+        if age_h >= POI_CATALOG_REFRESH_HOURS:
+            try:
+                fresh = await crawl_catalog()
+                if len(fresh):
+                    fresh.save()
+                    _catalog = fresh
+                    _catalog_mtime = _file_mtime()
+                    logger.info("POI catalog refreshed: %s", fresh.stats())
+            except Exception as e:
+                logger.warning("POI catalog crawl failed: %s", e)
+            age_h = 0.0
+        await asyncio.sleep(max(60.0, (POI_CATALOG_REFRESH_HOURS - age_h) * 3600))
+
+
+async def _reload_on_change() -> None:
+    """Перечитывает каталог, когда файл на диске заменён (обход сделал другой процесс)."""
+    global _catalog, _catalog_mtime
+    while True:
+        await asyncio.sleep(POI_CATALOG_RELOAD_SEC)
+        mtime = _file_mtime()
+        if mtime is None or mtime == _catalog_mtime:
+            continue
+        try:
+            fresh = await asyncio.to_thread(PlaceCatalog.load)
+        except Exception as e:
+            logger.warning("POI catalog reload failed: %s", e)
+            continue
+        _catalog, _catalog_mtime = fresh, mtime
+        logger.info("POI catalog reloaded: %s", fresh.stats())
+
+
+async def start_catalog_crawler(worker_index: int = 0) -> None:
+    """Запускает фоновый обход при старте бота (если POI_CATALOG_REFRESH_HOURS > 0).
+
+    В режиме вебхука с несколькими процессами обходит только воркер 0.
+    Процессы, которые не обходят сами, раз в POI_CATALOG_RELOAD_SEC проверяют
+    файл каталога и перечитывают его после обновления (обход воркером 0 или
+    вручную через python -m src.catalog).
+    """
+    global _crawler_task
+    get_catalog()
+    if _crawler_task is not None:
+        return
+    if POI_CATALOG_REFRESH_HOURS > 0 and worker_index == 0:
+        _crawler_task = asyncio.create_task(_crawl_forever())
+    elif POI_CATALOG_RELOAD_SEC > 0:
+        _crawler_task = asyncio.create_task(_reload_on_change())
+
+
+async def stop_catalog_crawler() -> None:
+    global _crawler_task
+    if _crawler_task is not None:
+        _crawler_task.cancel()
+        _crawler_task = None
+
+
+async def _main() -> None:
+    from .client import shutdown_clients
+
+    try:
+        catalog = await crawl_catalog()
+        catalog.save()
+        print(f"Каталог сохранён в {POI_CATALOG_PATH}: {catalog.stats()}")
+    finally:
+        await shutdown_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
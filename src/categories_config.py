@@ -32,7 +32,7 @@ HEURISTIC_RULES: List[Tuple[List[str], str, List[str]]] = [
      ["смотровая площадка", "панорама", "набережная", "обзорная площадка"]),
     
     # Виды: реки, набережные, мосты
-    (["река", "реки", "мост", "мосты", "закат", "вода", "у воды", "через реку"], "views",
+    (["река", "реки", "набережн", "мост", "мосты", "закат", "вода", "у воды", "через реку"], "views",
      ["набережная", "Верхне-Волжская набережная", "Нижне-Волжская набережная", 
       "набережная Федоровского", "набережная Гребного канала", "мост", "пешеходный мост"]),
     
@@ -95,6 +95,37 @@ FOOD_KEYWORDS = [
 
 PARK_KEYWORDS = ["парк", "сквер", "сад", "лесопарк", "гуля", "прогул"]
 
+# Фильтр кандидатов: слова ищутся в рубриках и названии места
+# Заведения питания (отбрасываются, если еду не просили)
+FOOD_PLACE_KEYWORDS = [
+    "ресто", "кафе", "кофе", "бар", "столовая", "бистро", "пицц", "суши",
+    "бургер", "питан", "кулинар", "фастфуд", "закусочная", "буфет", "гриль",
+]
+
+# Природные места: ресторан в парке — всё ещё парк
+NATURE_PLACE_KEYWORDS = ["парк", "сквер", "сад", "набережн", "бульвар", "лесопарк", "роща", "аллея", "променад"]
+
+# Административные/технические объекты, которые не интересны для прогулки
+ADMIN_KEYWORDS = [
+    # Административные учреждения
+    "дирекци", "администрац", "управлен", "офис", "план-схем", "информационн",
+    "комната матери", "жилищно-коммунальн", "организац", "учрежден",
+
+    # Финансовые и деловые
+    "банк", "страхов", "нотариус", "юридическ", "суд", "библиотек",
+
+    # Компании и корпорации (административные здания)
+    "газпром", "роснефт", "сбербанк", "втб", "альфа-банк", "тинькофф",
+    "мтс", "мегафон", "билайн", "ростелеком", "почта россии",
+
+    # Служебные помещения
+    "офисное здание", "бизнес-центр", "деловой центр", "административное здание",
+    "служебное помещение", "управляющая компания", "диспетчерская",
+
+    # Технические объекты
+    "котельная", "трансформаторная", "подстанция", "тепловой пункт",
+]
+
 # Дефолтные категории если ничего не найдено
 DEFAULT_CATEGORIES = {
     "history": ["музей", "памятник"],
@@ -1,18 +1,169 @@
+import logging
 import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+from .metrics import register_gauge
 
 # Подхватываем переменные окружения из .env
 load_dotenv()
 
-def get_client() -> OpenAI:
-    """Создаёт клиент OpenAI из переменной окружения OPENAI_API_KEY."""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY не найден. Укажите его в .env или окружении.")
-    return OpenAI(api_key=api_key)
+logger = logging.getLogger(__name__)
+
+# Параметры пулов соединений (общие для 2ГИС, Яндекса и OpenAI)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "8.0"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+
+class _ClientRegistry:
+    """Долгоживущие клиенты с keep-alive пулами соединений.
+
+    Создаются при старте Dispatcher и закрываются при его остановке;
+    если к клиенту обратились раньше (скрипты, бенчмарки), он создаётся лениво.
+    Для каждой интеграции считаются запросы и новые соединения:
+    разница между ними — число переиспользованных соединений.
+    """
+
+    def __init__(self) -> None:
+        self._twogis: Optional[httpx.AsyncClient] = None
+        self._yandex: Optional[aiohttp.ClientSession] = None
+        self._openai: Optional[AsyncOpenAI] = None
+        self.stats: Dict[str, Dict[str, int]] = {
+            name: {"requests": 0, "new_connections": 0} for name in ("2gis", "yandex", "openai")
+        }
+
+    def _httpx_client(self, name: str, timeout: float) -> httpx.AsyncClient:
+        counters = self.stats[name]
+
+        async def _trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                counters["new_connections"] += 1
+
+        async def _on_request(request: httpx.Request) -> None:
+            counters["requests"] += 1
+            request.extensions["trace"] = _trace
+
+        return httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"request": [_on_request]},
+        )
+
+    @property
+    def twogis(self) -> httpx.AsyncClient:
+        if self._twogis is None or self._twogis.is_closed:
+            self._twogis = self._httpx_client("2gis", HTTP_TIMEOUT)
+        return self._twogis
+
+    @property
+    def yandex(self) -> aiohttp.ClientSession:
+        if self._yandex is None or self._yandex.closed:
+            counters = self.stats["yandex"]
+
+            async def _on_request_start(session, ctx, params) -> None:
+                counters["requests"] += 1
+
+            async def _on_connection_create_end(session, ctx, params) -> None:
+                counters["new_connections"] += 1
+
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(_on_request_start)
+            trace.on_connection_create_end.append(_on_connection_create_end)
+            self._yandex = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                    keepalive_timeout=HTTP_KEEPALIVE_EXPIRY,
+                    ttl_dns_cache=300,
+                ),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+                trace_configs=[trace],
+            )
+        return self._yandex
+
+    @property
+    def openai(self) -> AsyncOpenAI:
+        if self._openai is None:
+            api_key = os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                raise RuntimeError("OPENAI_API_KEY не найден. Укажите его в .env или окружении.")
+            self._openai = AsyncOpenAI(
+                api_key=api_key,
+                timeout=OPENAI_TIMEOUT,
+                max_retries=0,  # повторяет src.llm_scheduler с учётом общих лимитов
+                http_client=self._httpx_client("openai", OPENAI_TIMEOUT),
+            )
+        return self._openai
+
+    async def close(self) -> None:
+        if self._twogis is not None:
+            await self._twogis.aclose()
+        if self._yandex is not None:
+            await self._yandex.close()
+        if self._openai is not None:
+            await self._openai.close()
+        self._twogis = self._yandex = self._openai = None
+
+
+_registry = _ClientRegistry()
+
+
+async def startup_clients() -> None:
+    """Создаёт общие клиенты заранее, чтобы первый маршрут не платил за их сборку."""
+    _registry.twogis
+    _registry.yandex
+    if os.getenv("OPENAI_API_KEY"):
+        _registry.openai
+
+
+async def shutdown_clients() -> None:
+    """Закрывает пулы соединений и пишет в лог статистику переиспользования."""
+    logger.info("HTTP connection stats: %s", get_connection_stats())
+    await _registry.close()
+
+
+def _connection_samples() -> List[Tuple[Dict[str, str], float]]:
+    return [
+        ({"service": name, "kind": kind}, counters[kind])
+        for name, counters in _registry.stats.items()
+        for kind in ("requests", "new_connections")
+    ]
+
+
+register_gauge("http_requests_total", "Запросы к внешним сервисам и новые соединения (остальные — из keep-alive пула)", _connection_samples, kind="counter")
+
+
+def get_connection_stats() -> Dict[str, Dict[str, int]]:
+    """Возвращает по каждой интеграции: запросы, новые и переиспользованные соединения."""
+    return {
+        name: {**counters, "reused": max(0, counters["requests"] - counters["new_connections"])}
+        for name, counters in _registry.stats.items()
+    }
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий httpx-клиент для 2ГИС."""
+    return _registry.twogis
+
+
+def get_aiohttp_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия для геокодера Яндекса."""
+    return _registry.yandex
+
+
+def get_client() -> AsyncOpenAI:
+    """Возвращает общий асинхронный клиент OpenAI (ключ из OPENAI_API_KEY)."""
+    return _registry.openai
 
 def get_model(default: str = "gpt-4o-mini") -> str:
     """Возвращает имя модели из OPENAI_MODEL или дефолт."""
     return os.getenv("OPENAI_MODEL", default)
-
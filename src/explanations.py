@@ -0,0 +1,186 @@
+"""
+Хранилище пояснений и времени на месте, общее для всех пользователей.
+
+Пояснение к месту почти не зависит от конкретного пользователя — только от
+самого места и грубой категории интереса (история, парки, ...). Поэтому
+ответ GPT сохраняется по ключу (место, категория) и переиспользуется.
+Заодно считается, как часто место попадает в маршруты: по этой статистике
+офлайн-задача заранее готовит пояснения для самых частых мест.
+
+Офлайн-подготовка: python -m src.explanations [N]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import sys
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .cache import TTLCache, db_thread_connection, open_db, open_store, run_on_db_thread
+from .llm_scheduler import background_priority
+from .metrics import register_cache
+from .place import Place
+
+load_dotenv()
+
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "20000"))
+EXPLANATION_TTL = float(os.getenv("EXPLANATION_TTL", str(90 * 24 * 3600)))
+EXPLANATION_BATCH_SIZE = 8  # Мест в одном запросе офлайн-подготовки
+
+# Подписи категорий для промпта офлайн-подготовки (там нет живого текста интересов)
+CATEGORY_LABELS: Dict[str, str] = {
+    "history": "история", "art": "искусство", "food": "еда и кафе", "views": "виды и набережные",
+    "parks": "парки и прогулки", "entertainment": "развлечения", "religion": "храмы и религия",
+    "sports": "спорт", "shopping": "шопинг", "kids": "отдых с детьми", "nature": "природа",
+    "culture": "культура и театры", "nightlife": "ночная жизнь", "education": "образование",
+    "street_art": "стрит-арт", "general": "общие",
+}
+
+_EMOJI_TAIL = re.compile(r"((?:[\U0001F1E6-\U0001F1FF]{2})|[\U0001F000-\U0001FFFF])\s*$")
+
+
+def place_identity(place: Place) -> str:
+    return place.key
+
+
+class ExplanationStore:
+    """Пояснения по ключу (место, категория) и счётчик появлений мест в маршрутах."""
+
+    def __init__(self) -> None:
+        self._cache = TTLCache(EXPLANATION_CACHE_SIZE, EXPLANATION_TTL, store=open_store("place_explanations"))
+        self._seen: Counter = Counter()  # без CACHE_DB_PATH статистика живёт только в памяти
+        self._seen_places: Dict[str, Dict[str, Any]] = {}
+        self._conn = open_db()
+        if self._conn is not None:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS place_popularity ("
+                "key TEXT PRIMARY KEY, place TEXT NOT NULL, category TEXT NOT NULL, seen INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    @staticmethod
+    def _key(place: Place, category: str) -> str:
+        return f"{place_identity(place)}|{category}"
+
+    def get(self, place: Place, category: str) -> Optional[Tuple[str, int]]:
+        """Возвращает (пояснение с эмодзи, минуты) или None."""
+        entry = self._cache.get(self._key(place, category))
+        if entry is None:
+            return None
+        reason = entry["explanation"] + (f" {entry['emoji']}" if entry.get("emoji") else "")
+        return reason, int(entry["minutes"])
+
+    def put(self, place: Place, category: str, explanation: str, minutes: int) -> None:
+        text = (explanation or "").strip()
+        emoji = ""
+        match = _EMOJI_TAIL.search(text)
+        if match:
+            emoji = match.group(1)
+            text = text[:match.start()].rstrip()
+        self._cache.set(self._key(place, category), {"explanation": text, "emoji": emoji, "minutes": int(minutes)})
+
+    def record_seen(self, places: List[Place], category_of) -> None:
+        """Отмечает, что места попали в шортлист (для выбора, что готовить заранее).
+
+        С CACHE_DB_PATH шортлист пишется одной пачкой в потоке записи кэшей.
+        """
+        rows = []
+        for place in places:
+            category = category_of(place)
+            key = self._key(place, category)
+            snapshot = {"name": place.name, "address": place.address, "rubrics": place.rubrics}
+            if self._conn is None:
+                self._seen[key] += 1
+                self._seen_places[key] = {"place": snapshot, "category": category}
+                continue
+            rows.append((key, json.dumps(snapshot, ensure_ascii=False), category))
+        if rows:
+            run_on_db_thread(self._write_seen, rows)
+
+    @staticmethod
+    def _write_seen(rows: List[Tuple[str, str, str]]) -> None:
+        conn = db_thread_connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO place_popularity (key, place, category, seen) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET seen = seen + 1",
+                rows,
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def most_frequent(self, limit: int) -> List[Tuple[Place, str]]:
+        """Самые частые (место, категория) из шортлистов."""
+        if self._conn is None:
+            return [
+                (Place.from_dict(self._seen_places[key]["place"]), self._seen_places[key]["category"])
+                for key, _ in self._seen.most_common(limit)
+            ]
+        rows = self._conn.execute(
+            "SELECT place, category FROM place_popularity ORDER BY seen DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [(Place.from_dict(json.loads(place)), category) for place, category in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+_store: Optional[ExplanationStore] = None
+
+
+def get_explanation_store() -> ExplanationStore:
+    global _store
+    if _store is None:
+        _store = ExplanationStore()
+    return _store
+
+
+register_cache("place_explanations", lambda: get_explanation_store().stats())
+
+
+async def pregenerate(limit: int = 200) -> int:
+    """Готовит пояснения для самых частых мест, которых ещё нет в хранилище. Возвращает число новых.
+
+    Вызовы GPT идут с фоновым приоритетом и уступают маршрутам пользователей.
+    """
+    from .gpt_chat import FALLBACK_EXPLANATION, _gpt_explain_and_estimate_time
+
+    store = get_explanation_store()
+    missing: Dict[str, List[Place]] = {}
+    for place, category in store.most_frequent(limit):
+        if store.get(place, category) is None:
+            missing.setdefault(category, []).append(place)
+    created = 0
+    with background_priority():
+        for category, places in missing.items():
+            for start in range(0, len(places), EXPLANATION_BATCH_SIZE):
+                batch = places[start:start + EXPLANATION_BATCH_SIZE]
+                explanations, times = await _gpt_explain_and_estimate_time(batch, CATEGORY_LABELS.get(category, category))
+                for place, explanation, minutes in zip(batch, explanations, times):
+                    if explanation != FALLBACK_EXPLANATION:
+                        store.put(place, category, explanation, minutes)
+                        created += 1
+    return created
+
+
+async def _main() -> None:
+    from .client import shutdown_clients
+
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    try:
+        created = await pregenerate(limit)
+        print(f"Подготовлено пояснений: {created}")
+    finally:
+        await shutdown_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
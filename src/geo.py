@@ -0,0 +1,95 @@
+"""
+Расстояния и время в пути для всего конвейера.
+
+Всё считается пачками на NumPy: от точки до всех мест сразу и матрицы
+«каждое с каждым» для планировщика маршрута. Скалярные distance_km и
+travel_time — те же формулы для одной пары, поэтому числа везде совпадают.
+
+Модель передвижения: до 2 км пешком (4.5 км/ч), дальше — транспорт
+(15 км/ч + 10 минут на ожидание, не больше 60 минут), больше 100 км —
+ошибка в координатах.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+WALK_SPEED_KMH = 4.5
+TRANSPORT_SPEED_KMH = 15.0
+TRANSPORT_OVERHEAD_MIN = 10  # ожидание транспорта
+TRANSPORT_MAX_MIN = 60
+WALK_MAX_KM = 2.0  # дальше — на транспорте
+INVALID_KM = 100.0  # дальше — координаты считаем ошибочными
+
+MODE_WALK, MODE_TRANSPORT, MODE_INVALID = 0, 1, 2
+MODE_NAMES = ("пешком", "транспорт", "ошибка")
+
+Coords = Tuple[float, float]
+
+
+def to_array(points: Sequence[Optional[Coords]]) -> np.ndarray:
+    """Точки (lat, lon) в массив N×2; у мест без координат — NaN."""
+    arr = np.full((len(points), 2), np.nan, dtype=np.float64)
+    for i, point in enumerate(points):
+        if point:
+            arr[i, 0] = float(point[0])
+            arr[i, 1] = float(point[1])
+    return arr
+
+
+def haversine_km(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Расстояние по дуге между массивами точек (…, 2) с обычным NumPy-бродкастингом."""
+    lat1 = np.radians(a[..., 0])
+    lat2 = np.radians(b[..., 0])
+    dlat = lat2 - lat1
+    dlon = np.radians(b[..., 1] - a[..., 1])
+    x = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(x))
+
+
+def distances_from(origin: Coords, points: Sequence[Optional[Coords]] | np.ndarray) -> np.ndarray:
+    """Расстояния в км от origin до каждой точки (NaN для мест без координат)."""
+    arr = points if isinstance(points, np.ndarray) else to_array(points)
+    return haversine_km(np.asarray(origin, dtype=np.float64), arr)
+
+
+def distance_matrix(points: Sequence[Optional[Coords]] | np.ndarray) -> np.ndarray:
+    """Матрица N×N расстояний в км между всеми точками."""
+    arr = points if isinstance(points, np.ndarray) else to_array(points)
+    return haversine_km(arr[:, None, :], arr[None, :, :])
+
+
+def travel_minutes(km: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Время в пути (минуты, целые) и способ (MODE_*) для массива расстояний.
+
+    Округление — до ближайшего чётного, как у встроенного round().
+    """
+    km = np.asarray(km, dtype=np.float64)
+    walk = np.rint(km / WALK_SPEED_KMH * 60)
+    transport = np.minimum(np.rint(km / TRANSPORT_SPEED_KMH * 60) + TRANSPORT_OVERHEAD_MIN, TRANSPORT_MAX_MIN)
+    modes = np.where(km > INVALID_KM, MODE_INVALID, np.where(km > WALK_MAX_KM, MODE_TRANSPORT, MODE_WALK))
+    minutes = np.select([modes == MODE_WALK, modes == MODE_TRANSPORT], [walk, transport], 0)
+    return np.nan_to_num(minutes).astype(np.int64), modes.astype(np.int8)
+
+
+def travel_matrix(points: Sequence[Optional[Coords]] | np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Матрицы N×N: минуты в пути, способ передвижения и расстояние в км."""
+    km = distance_matrix(points)
+    minutes, modes = travel_minutes(km)
+    return minutes, modes, km
+
+
+def distance_km(a: Coords, b: Coords) -> float:
+    return float(haversine_km(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)))
+
+
+def travel_time(a: Coords, b: Coords) -> Tuple[int, str, float]:
+    """Возвращает (время_минут, способ_передвижения, расстояние_км) для одной пары точек."""
+    km = distance_km(a, b)
+    minutes, mode = travel_minutes(np.asarray(km))
+    if mode == MODE_INVALID:
+        return 0, MODE_NAMES[MODE_INVALID], 0.0
+    return int(minutes), MODE_NAMES[int(mode)], km
@@ -1,19 +1,98 @@
 from typing import List, Dict, Any
+import json
+import logging
 import re
 import os
-from .client import get_client, get_model
-from .twogis import resolve_origin_2gis, search_places_2gis_by_query
+import time
+from .cache import TTLCache, open_store
+from .catalog import get_catalog
+from .client import get_model
+from .explanations import get_explanation_store
+from .geo import distances_from
+from .place import DEFAULT_STAY_MIN, Place
+from .ranking import RANKING_MODE, RANKING_TOP_K, get_ranking_stats, rank_candidates, record_local_only
+from .route_cache import cached_shortlist, pick_cached_route, route_cache_key, store_route
+from .route_planner import build_plan
+from .twogis import plan_searches, resolve_origin_2gis, search_places_2gis_many
+from .warmup import record_route_request
 from .categories_config import (
+    ADMIN_KEYWORDS,
     ALL_CATEGORIES,
     DEFAULT_CATEGORIES,
     FOOD_KEYWORDS,
+    FOOD_PLACE_KEYWORDS,
     HEURISTIC_RULES,
+    NATURE_PLACE_KEYWORDS,
     PARK_KEYWORDS,
     SYSTEM_PROMPT,
 )
+from .keywords import KeywordMatcher
+from .llm_scheduler import chat_completion, get_llm_scheduler_stats
+from .metrics import describe, inc, mark_fallback, observe, register_cache, stage
 
 MAX_INPUT_CHARS = 6000
 MAX_OUTPUT_TOKENS_ROUTE = 900
+FALLBACK_EXPLANATION = "Интересное место по вашим запросам"
+
+# multi — отдельные вызовы GPT на выбор и на пояснения; single — один вызов со структурированным ответом
+LLM_PIPELINE_MODE = os.getenv("LLM_PIPELINE_MODE", "multi").lower()
+
+logger = logging.getLogger(__name__)
+
+# Таблицы ключевых слов компилируются один раз: метки правил — их индексы в HEURISTIC_RULES
+_INTEREST_MATCHER = KeywordMatcher({
+    **{index: keywords for index, (keywords, _, _) in enumerate(HEURISTIC_RULES)},
+    "food": FOOD_KEYWORDS,
+    "parks": PARK_KEYWORDS,
+})
+_PLACE_MATCHER = KeywordMatcher({
+    "admin": ADMIN_KEYWORDS,
+    "food": FOOD_PLACE_KEYWORDS,
+    "nature": NATURE_PLACE_KEYWORDS,
+})
+
+# Расход токенов и время по этапам, чтобы сравнивать режимы конвейера
+_llm_usage: Dict[str, Dict[str, float]] = {}
+describe("llm_tokens_total", "Токены GPT по этапам конвейера (prompt/completion, из usage ответа)")
+
+# Кэш классификации интересов и порог уверенности эвристики, при котором GPT не нужен
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "5000"))
+CLASSIFY_CACHE_TTL = float(os.getenv("CLASSIFY_CACHE_TTL", str(30 * 24 * 3600)))
+CLASSIFY_HEURISTIC_MIN_CONFIDENCE = float(os.getenv("CLASSIFY_HEURISTIC_MIN_CONFIDENCE", "1.0"))
+# Ответ одних эвристик живёт в кэше меньше ответа GPT: правила могут ошибаться, а GPT их поправит
+CLASSIFY_HEURISTIC_TTL = float(os.getenv("CLASSIFY_HEURISTIC_TTL", str(24 * 3600)))
+HEURISTIC_MIN_STEM = 4  # более короткое ключевое слово («бар», «сад», «арт») покрывает только слово целиком
+
+_classification_cache = TTLCache(CLASSIFY_CACHE_SIZE, CLASSIFY_CACHE_TTL, store=open_store("interest_classification"))
+# Источник → счётчики; source="route" — классификации для маршрутов пользователей,
+# "prefetch" и "warmup" — упреждающие, их обращения к GPT пользователь не ждёт
+_classification_stats: Dict[str, Dict[str, int]] = {}
+register_cache("interest_classification", _classification_cache.stats)
+
+# Слова, которые не несут интереса и не должны снижать уверенность эвристики
+_INTEREST_STOPWORDS = {
+    "и", "или", "а", "но", "в", "во", "на", "с", "со", "по", "к", "у", "о", "об", "для", "про", "из", "от", "до",
+    "я", "мне", "меня", "мы", "нам", "хочу", "хочется", "люблю", "нравится", "интересно", "интересует",
+    "интересуют", "очень", "все", "всё", "еще", "ещё", "также", "тоже", "как", "что", "где", "какие",
+    "место", "места", "посмотреть", "посетить", "город", "города", "городе", "нн",
+}
+
+
+def _record_llm_usage(stage: str, usage: Any, started: float) -> None:
+    totals = _llm_usage.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0})
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    totals["calls"] += 1
+    totals["prompt_tokens"] += prompt_tokens
+    totals["completion_tokens"] += completion_tokens
+    totals["seconds"] += time.perf_counter() - started
+    inc("llm_tokens_total", prompt_tokens, stage=stage, kind="prompt")
+    inc("llm_tokens_total", completion_tokens, stage=stage, kind="completion")
+
+
+def get_llm_usage_stats() -> Dict[str, Dict[str, float]]:
+    """Вызовы, токены и суммарное время GPT по этапам конвейера."""
+    return {stage: dict(totals) for stage, totals in _llm_usage.items()}
 
 
 def _truncate(s: str, limit: int) -> str:
@@ -22,14 +101,97 @@ def _truncate(s: str, limit: int) -> str:
     if len(s) <= limit:
         return s
     return s[:limit]
-def _format_itinerary_from_2gis(places: List[Dict[str, Any]], time_hours: float, start_coords: tuple[float, float] | None, start_label: str | None = None, debug_info: List[str] | None = None) -> tuple[str, List[int]]:
-    """Формирует текстовый маршрут из списка мест 2ГИС."""
-    from math import radians, sin, cos, asin, sqrt
-
-    walk_speed_kmh = 4.5
-    remain_min = int(round(time_hours * 60)) + 30  # Буфер ±30 минут
-    total_walk_min = 0
-    total_stay_min = 0
+
+
+class _JsonObjectStream:
+    """Достаёт из потокового JSON-ответа плоские объекты {...} по мере их закрытия.
+
+    Так элементы массива (пояснения, выбранные места) можно показывать
+    пользователю, не дожидаясь конца ответа модели.
+    """
+
+    def __init__(self) -> None:
+        self._text = ""
+        self._pos = 0
+        self._stack: List[List[Any]] = []  # [начало объекта, есть ли вложенные объекты]
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self._text += chunk
+        found: List[Dict[str, Any]] = []
+        for i in range(self._pos, len(self._text)):
+            ch = self._text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._stack:
+                    self._stack[-1][1] = True
+                self._stack.append([i, False])
+            elif ch == "}" and self._stack:
+                start, has_children = self._stack.pop()
+                if not has_children:
+                    try:
+                        obj = json.loads(self._text[start:i + 1])
+                    except ValueError:
+                        continue
+                    if isinstance(obj, dict):
+                        found.append(obj)
+        self._pos = len(self._text)
+        return found
+
+
+async def _stream_completion(stage: str, on_object, **kwargs: Any) -> str:
+    """Потоковый вызов GPT: on_object получает каждый закрывшийся объект ответа; возвращает весь текст."""
+    started = time.perf_counter()
+    stream = await chat_completion(stage, stream=True, stream_options={"include_usage": True}, **kwargs)
+    parser = _JsonObjectStream()
+    parts: List[str] = []
+    usage = None
+    async for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if delta:
+            parts.append(delta)
+            for obj in parser.feed(delta):
+                await on_object(obj)
+    _record_llm_usage(stage, usage, started)
+    return "".join(parts)
+
+
+async def _emit_progress(progress, text: str) -> None:
+    """Сообщает о ходе построения маршрута; ошибки показа не должны ломать конвейер."""
+    if progress is None:
+        return
+    try:
+        await progress(text)
+    except Exception as e:
+        logger.debug("Progress callback failed: %s", e)
+
+
+def _valid_minutes(mins: Any) -> int:
+    # Валидация времени: от 10 до 90 минут
+    if isinstance(mins, bool) or not isinstance(mins, (int, float)) or mins < 10 or mins > 90:
+        return 30
+    return int(mins)
+
+
+def _format_itinerary_from_2gis(places: List[Place], time_hours: float, start_coords: tuple[float, float] | None, start_label: str | None = None, debug_info: List[str] | None = None) -> tuple[str, List[int]]:
+    """Формирует текстовый маршрут из списка мест 2ГИС.
+
+    Какие места взять и в каком порядке их обойти, решает планировщик
+    (src/route_planner.py): он укладывает маршрут в time_hours с минимумом переходов.
+    """
     lines: List[str] = []
 
     lines.append(f"Маршрут на {time_hours:g} часов")
@@ -38,88 +200,36 @@ def _format_itinerary_from_2gis(places: List[Dict[str, Any]], time_hours: float,
     else:
         lines.append("Старт: текущая локация пользователя" if start_coords else "Старт: центр города")
 
-    def travel_time(a: tuple[float, float], b: tuple[float, float]) -> tuple[int, str, float]:
-        """Возвращает (время_минут, способ_передвижения, расстояние_км)"""
-        lat1, lon1 = a
-        lat2, lon2 = b
-        R = 6371.0
-        phi1 = radians(lat1)
-        phi2 = radians(lat2)
-        dphi = radians(lat2 - lat1)
-        dlambda = radians(lon2 - lon1)
-        x = sin(dphi/2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda/2) ** 2
-        km = 2 * R * asin(sqrt(x))
-        
-        if km > 100.0:
-            return 0, "ошибка", 0.0
-        
-        if km > 2.0:
-            travel_min = int(round((km / 15.0) * 60)) + 10
-            travel_min = min(travel_min, 60)  # Макс. 60 минут на транспорт
-            return travel_min, "транспорт", km
-        else:
-            walk_min = int(round((km / walk_speed_kmh) * 60))
-            return walk_min, "пешком", km
-
-    prev = start_coords
-    step = 1
+    plan = build_plan(places, time_hours, start_coords)
+    if debug_info is not None:
+        debug_info.append(f"   Порядок обхода: {[i + 1 for i in plan.order]}, переходы {plan.travel_min} мин, бюджет {plan.budget_min} мин")
     skipped = []
-    places_added = 0
-    total_distance_km = 0.0
-    
-    included_indices: List[int] = []
-    for idx_place, p in enumerate(places):
-        name = p.get("name") or "Место"
-        address = p.get("address") or "адрес не указан"
-        coords = p.get("coords")  # (lat, lon) | None
-        rubrics_list = p.get("rubrics") or []
-        if isinstance(rubrics_list, list):
-            rubrics = ", ".join([r for r in rubrics_list if isinstance(r, str) and r])
-        else:
-            rubrics = str(rubrics_list)
-        rating = p.get("rating")
-        reason = p.get("gpt_reason")
+    for idx_place, why in plan.skipped:
+        name = places[idx_place].name or "Место"
+        skipped.append(f"{name} ({why})")
+        if debug_info is not None:
+            debug_info.append(f"   ⏭️ Пропущено: {name} - {why}")
+
+    for step, (idx_place, (travel_min, method, _), stay_min) in enumerate(zip(plan.order, plan.legs, plan.stays), start=1):
+        p = places[idx_place]
+        name = p.name or "Место"
+        address = p.address or "адрес не указан"
+        rubrics = ", ".join(p.rubrics)
+        reason = p.gpt_reason
         if not reason:
             why_parts = []
             if rubrics:
                 why_parts.append(rubrics)
-            if rating:
-                try:
-                    why_parts.append(f"рейтинг {float(rating):.1f}")
-                except Exception:
-                    pass
+            if p.rating:
+                why_parts.append(f"рейтинг {p.rating:.1f}")
             reason = "; ".join(why_parts) or "популярное место рядом по вашим интересам"
 
-        if prev and coords:
-            travel_min, method, distance_km = travel_time(prev, coords)
-            if method == "ошибка":
-                skipped.append(f"{name} (некорректные координаты)")
-                if debug_info is not None:
-                    debug_info.append(f"   ⏭️ Пропущено: {name} - некорректные координаты")
-                continue
-        else:
-            travel_min, method, distance_km = 0, "старт", 0.0
-        
-        stay_min = p.get("gpt_time", 30)
-        total_needed = travel_min + stay_min
-        
-        if places_added >= 3 and remain_min < total_needed:
-            skipped.append(f"{name} (нужно {total_needed} мин, осталось {remain_min} мин, переход {travel_min} мин {method})")
-            if debug_info is not None:
-                debug_info.append(f"   ⏭️ Пропущено: {name} - не хватает времени (нужно {total_needed}, осталось {remain_min})")
-            continue
-        
-        remain_min -= total_needed
-        total_walk_min += travel_min
-        total_stay_min += stay_min
-        total_distance_km += distance_km
-        
         if method == "старт":
             travel_desc = "0 мин"
         else:
             travel_desc = f"{travel_min} мин{' (транспорт)' if method == 'транспорт' else ''}"
 
-        reason_text = str(reason or "Интересное место по вашим запросам").strip()
+        reason_text = str(reason or FALLBACK_EXPLANATION).strip()
 
         emoji_match = re.search(r"((?:[\U0001F1E6-\U0001F1FF]{2})|[\U0001F000-\U0001FFFF])\s*$", reason_text)
         if emoji_match:
@@ -137,10 +247,12 @@ def _format_itinerary_from_2gis(places: List[Dict[str, Any]], time_hours: float,
             f"Время на месте: {stay_min} мин\n"
             f"Переход: {travel_desc}"
         )
-        prev = coords or prev
-        step += 1
-        places_added += 1
-        included_indices.append(idx_place)
+
+    places_added = len(plan.order)
+    included_indices: List[int] = list(plan.order)
+    total_walk_min = plan.travel_min
+    total_stay_min = plan.stay_min
+    total_distance_km = plan.distance_km
 
     total_min = total_walk_min + total_stay_min
     total_km = round(total_distance_km, 1)
@@ -156,19 +268,16 @@ def _format_itinerary_from_2gis(places: List[Dict[str, Any]], time_hours: float,
     
     return "\n".join(lines), included_indices
 
-def _gpt_explain_and_estimate_time(places: List[Dict[str, Any]], interests: str) -> tuple[List[str], List[int]]:
-    """GPT объясняет выбор мест И определяет время на каждое место."""
-    client = get_client()
+async def _gpt_explain_and_estimate_time(places: List[Place], interests: str, on_item=None) -> tuple[List[str], List[int]]:
+    """GPT объясняет выбор мест И определяет время на каждое место.
+
+    Если передан on_item(индекс, пояснение, минуты), ответ читается потоком
+    и каждое место отдаётся, как только модель его дописала.
+    """
     model_name = get_model()
     bullet_lines = []
     for idx, p in enumerate(places):
-        nm = p.get("name") or "Место"
-        rubrics = p.get("rubrics")
-        if isinstance(rubrics, list):
-            rubrics_str = ", ".join([str(r) for r in rubrics if isinstance(r, str)])
-        else:
-            rubrics_str = str(rubrics or "")
-        bullet_lines.append(f"{idx+1}. {nm} | рубрики: {rubrics_str}")
+        bullet_lines.append(f"{idx+1}. {p.name or 'Место'} | рубрики: {', '.join(p.rubrics)}")
     
     user_prompt = (
         "Ниже список мест для маршрута. Интересы пользователя: "
@@ -196,18 +305,32 @@ def _gpt_explain_and_estimate_time(places: List[Dict[str, Any]], interests: str)
         "Места:\n" + "\n".join(bullet_lines)
     )
     
+    request = dict(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": "Ты помогаешь планировать маршруты. Возвращай ТОЛЬКО валидный JSON-массив с объяснениями и временем."},
+            {"role": "user", "content": _truncate(user_prompt, MAX_INPUT_CHARS)},
+        ],
+        temperature=0.3,
+        max_tokens=800,
+    )
+    streamed = 0
+
+    async def on_object(item: Dict[str, Any]) -> None:
+        nonlocal streamed
+        if streamed < len(places):
+            await on_item(streamed, str(item.get("explanation", FALLBACK_EXPLANATION)), _valid_minutes(item.get("minutes", 30)))
+        streamed += 1
+
     try:
-        resp = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {"role": "system", "content": "Ты помогаешь планировать маршруты. Возвращай ТОЛЬКО валидный JSON-массив с объяснениями и временем."},
-                {"role": "user", "content": _truncate(user_prompt, MAX_INPUT_CHARS)},
-            ],
-            temperature=0.3,
-            max_tokens=800,
-        )
+        if on_item is None:
+            started = time.perf_counter()
+            resp = await chat_completion("explain", **request)
+            _record_llm_usage("explain", resp.usage, started)
+            content = (resp.choices[0].message.content or "").strip()
+        else:
+            content = (await _stream_completion("explain", on_object, **request)).strip()
         import json as _json
-        content = (resp.choices[0].message.content or "").strip()
         # Убираем markdown если есть
         if "```" in content:
             content = content.split("```")[1].replace("json", "").strip()
@@ -220,51 +343,181 @@ def _gpt_explain_and_estimate_time(places: List[Dict[str, Any]], interests: str)
             for i, item in enumerate(data[:len(places)]):
                 if isinstance(item, dict):
                     expl = item.get("explanation", "Интересное место")
-                    mins = item.get("minutes", 30)
-                    # Валидация времени: от 10 до 90 минут
-                    if not isinstance(mins, (int, float)) or mins < 10 or mins > 90:
-                        mins = 30
                     explanations.append(str(expl))
-                    times.append(int(mins))
+                    times.append(_valid_minutes(item.get("minutes", 30)))
                 else:
-                    explanations.append("Интересное место по вашим запросам")
+                    explanations.append(FALLBACK_EXPLANATION)
                     times.append(30)
             
             return explanations, times
-    except Exception:
-        pass
+    except Exception as e:
+        logger.warning("Explanations failed, using defaults: %s", e)
     
     # Fallback: дефолтные объяснения и время
-    explanations = ["Интересное место по вашим запросам"] * len(places)
+    mark_fallback()
+    explanations = [FALLBACK_EXPLANATION] * len(places)
     times = [30] * len(places)
     return explanations, times
 
 
-def _apply_heuristic_rules(text_lower: str, result: Dict[str, List[str]]) -> None:
-    """Применяет эвристические правила для классификации интересов."""
-    def _match(keyword: str) -> bool:
-        if "&" in keyword:
-            parts = [part.strip() for part in keyword.split("&") if part.strip()]
-            return all(part in text_lower for part in parts)
-        return keyword in text_lower
+async def _explain_with_store(places: List[Place], interests: str, default_category: str, on_item=None, use_llm: bool = True) -> tuple[List[str], List[int]]:
+    """Пояснения и время из общего хранилища; GPT спрашиваем только про недостающие места.
+
+    use_llm=False — недостающие получают пояснение и время по умолчанию.
+    """
+    store = get_explanation_store()
+
+    def category_of(place: Place) -> str:
+        return place.category or default_category
+
+    results = [store.get(p, category_of(p)) for p in places]
+    missing = [i for i, r in enumerate(results) if r is None]
+    on_missing_item = None
+    if on_item is not None:
+        for i, r in enumerate(results):
+            if r is not None:
+                await on_item(i, r[0], r[1])
+
+        async def on_missing_item(j: int, explanation: str, minutes: int) -> None:
+            await on_item(missing[j], explanation, minutes)
+
+    if missing and not use_llm:
+        for i in missing:
+            results[i] = (FALLBACK_EXPLANATION, DEFAULT_STAY_MIN)
+            if on_item is not None:
+                await on_item(i, FALLBACK_EXPLANATION, DEFAULT_STAY_MIN)
+    elif missing:
+        explanations, times = await _gpt_explain_and_estimate_time([places[i] for i in missing], interests, on_missing_item)
+        for i, explanation, minutes in zip(missing, explanations, times):
+            results[i] = (explanation, minutes)
+            if explanation != FALLBACK_EXPLANATION:
+                store.put(places[i], category_of(places[i]), explanation, minutes)
+    store.record_seen(places, category_of)
+    return [r[0] for r in results], [r[1] for r in results]
 
-    for keywords, category, queries in HEURISTIC_RULES:
-        if any(_match(kw) for kw in keywords):
+
+def _apply_heuristic_rules(text_lower: str, result: Dict[str, List[str]], hits: set | None = None) -> None:
+    """Применяет эвристические правила для классификации интересов.
+
+    hits — уже найденные _INTEREST_MATCHER метки для этого текста, чтобы не искать повторно.
+    """
+    if hits is None:
+        hits = _INTEREST_MATCHER.labels(text_lower)
+    for index, (_, category, queries) in enumerate(HEURISTIC_RULES):
+        if index in hits:
             if result[category]:
                 result[category] = list(dict.fromkeys(result[category] + queries))
             else:
                 result[category] = queries
 
 
-def _classify_interests_to_queries(interests: str) -> Dict[str, List[str]]:
-    """Классифицирует интересы пользователя в поисковые запросы для 2GIS."""
+def _interest_tokens(text: str) -> List[str]:
+    """Значимые слова из текста интересов: нижний регистр, ё→е, без стоп-слов."""
+    words = re.findall(r"[a-zа-я0-9-]+", (text or "").lower().replace("ё", "е"))
+    return [w for w in words if w not in _INTEREST_STOPWORDS]
+
+
+def _interests_cache_key(text: str) -> str:
+    """Ключ кэша: множество значимых слов без учёта порядка и повторов."""
+    return " ".join(sorted(set(_interest_tokens(text))))
+
+
+def _stem_covers(part: str, token: str) -> bool:
+    """Ключевое слово покрывает слово, если стоит в его начале; короткое — только если совпадает с ним."""
+    if len(part) < HEURISTIC_MIN_STEM:
+        return token == part or token.startswith(part + "-")
+    return token.startswith(part)
+
+
+def _heuristic_confidence(text: str) -> float:
+    """Доля значимых слов, которые покрыты ключевыми словами эвристик (0..1).
+
+    Слово засчитывается, только если сработавшее на нём правило действительно
+    попало в ответ: «кофе» рядом с «гулять» не покрыто — еду правило парков подавляет.
+    """
+    tokens = _interest_tokens(text)
+    if not tokens:
+        return 0.0
+    text_lower = " ".join(tokens)
+    hits = _INTEREST_MATCHER.labels(text_lower)
+    food_applied = "food" in hits and "parks" not in hits
+    covered = set()
+    for label, parts in _INTEREST_MATCHER.matched(text_lower):
+        # Метка parks только подавляет еду, своих категорий у неё нет (парки дают правила)
+        if label == "parks" or (label == "food" and not food_applied):
+            continue
+        for part in parts:
+            if " " in part:
+                # Фраза («торговый центр», «у воды») покрывает свои слова целиком
+                covered.update(i for i, token in enumerate(tokens) if token in part.split())
+            else:
+                covered.update(i for i, token in enumerate(tokens) if _stem_covers(part, token))
+    return len(covered) / len(tokens)
+
+
+def _count_classification(source: str, outcome: str) -> None:
+    counts = _classification_stats.setdefault(source, {"cached": 0, "llm_calls": 0, "llm_skipped": 0})
+    counts[outcome] += 1
+
+
+def get_classification_stats() -> Dict[str, Any]:
+    """Статистика классификации: кэш, вызовы GPT и сколько раз GPT не понадобился.
+
+    llm_calls, llm_skipped и llm_skip_rate — только по маршрутам пользователей;
+    by_source — те же счётчики (и попадания в кэш) по каждому источнику.
+    """
+    route = _classification_stats.get("route", {})
+    calls, skipped = route.get("llm_calls", 0), route.get("llm_skipped", 0)
+    return {
+        **_classification_cache.stats(),
+        "llm_calls": calls,
+        "llm_skipped": skipped,
+        "llm_skip_rate": round(skipped / (calls + skipped), 3) if calls + skipped else 0.0,
+        "by_source": {source: dict(counts) for source, counts in _classification_stats.items()},
+    }
+
+
+def classification_cost(interests: str) -> int:
+    """Сколько вызовов GPT потребует классификация: 0 — ответ уже в кэше или хватает эвристик."""
     text = str(interests or "").strip()
-    client = get_client()
+    if _interests_cache_key(text) in _classification_cache:
+        return 0
+    return 0 if _heuristic_confidence(text) >= CLASSIFY_HEURISTIC_MIN_CONFIDENCE else 1
+
+
+async def _classify_interests_to_queries(
+    interests: str, use_llm: bool = True, source: str = "route"
+) -> Dict[str, List[str]]:
+    """Классифицирует интересы пользователя в поисковые запросы для 2GIS.
+
+    Результат кэшируется по нормализованному набору слов. Если эвристики
+    уверенно покрывают текст, GPT не вызывается вовсе; при use_llm=False —
+    тоже, но неуверенный эвристический ответ не кэшируется. source —
+    под каким источником считать вызов в get_classification_stats().
+    """
+    text = str(interests or "").strip()
+    key = _interests_cache_key(text)
+    cached = _classification_cache.get(key)
+    if cached is not None:
+        _count_classification(source, "cached")
+        return {cat: list(queries) for cat, queries in cached.items()}
+
+    if _heuristic_confidence(text) >= CLASSIFY_HEURISTIC_MIN_CONFIDENCE:
+        _count_classification(source, "llm_skipped")
+        result = _heuristic_classification(text)
+        _classification_cache.set(key, result, ttl=CLASSIFY_HEURISTIC_TTL)
+        return {cat: list(queries) for cat, queries in result.items()}
+    if not use_llm:
+        return _heuristic_classification(text)
+
+    _count_classification(source, "llm_calls")
     model_name = get_model()
     
     # Попытка классификации через GPT
     try:
-        resp = client.chat.completions.create(
+        started = time.perf_counter()
+        resp = await chat_completion(
+            "classify",
             model=model_name,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
@@ -273,6 +526,7 @@ def _classify_interests_to_queries(interests: str) -> Dict[str, List[str]]:
             temperature=0.1,
             max_tokens=400,
         )
+        _record_llm_usage("classify", resp.usage, started)
         import json as _json
         content = resp.choices[0].message.content or "{}"
         data = _json.loads(content)
@@ -286,19 +540,26 @@ def _classify_interests_to_queries(interests: str) -> Dict[str, List[str]]:
                     out[k] = [str(v)[:40] for v in vals if isinstance(v, (str, int, float))][:6]
                 else:
                     out[k] = []
-            return out
-    except Exception:
-        pass
-    # Heuristic fallback
+            _classification_cache.set(key, out)
+            return {cat: list(queries) for cat, queries in out.items()}
+    except Exception as e:
+        logger.warning("Interest classification failed, using heuristics: %s", e)
+    mark_fallback()
+    return _heuristic_classification(text)
+
+
+def _heuristic_classification(text: str) -> Dict[str, List[str]]:
+    """Классификация интересов по правилам из categories_config без GPT."""
     l = text.lower()
     result: Dict[str, List[str]] = {cat: [] for cat in ALL_CATEGORIES}
+    hits = _INTEREST_MATCHER.labels(l)
     
     # Применяем правила из конфига
-    _apply_heuristic_rules(l, result)
+    _apply_heuristic_rules(l, result, hits)
     
     # Еда (НЕ добавляем если пользователь хочет гулять в парках)
-    parks_hit = any(x in l for x in PARK_KEYWORDS)
-    food_explicit = any(x in l for x in FOOD_KEYWORDS)
+    parks_hit = "parks" in hits
+    food_explicit = "food" in hits
     
     if food_explicit and not parks_hit:
         result["food"] = ["ресторан", "кафе", "кофейня", "бар"]
@@ -314,11 +575,11 @@ def _classify_interests_to_queries(interests: str) -> Dict[str, List[str]]:
     return result
 
 
-def _dedupe_places(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _dedupe_places(items: List[Place]) -> List[Place]:
     seen = set()
-    out: List[Dict[str, Any]] = []
+    out: List[Place] = []
     for it in items:
-        key = (it.get("name") or "").lower().strip() + "|" + (it.get("address") or "").lower().strip()
+        key = it.key
         if key in seen:
             continue
         seen.add(key)
@@ -326,117 +587,106 @@ def _dedupe_places(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return out
 
 
-def _filter_unwanted_places(places: List[Dict[str, Any]], allow_food: bool) -> List[Dict[str, Any]]:
+def _filter_unwanted_places(places: List[Place], allow_food: bool) -> List[Place]:
     """Фильтрует нежелательные места: еду (если не запрошена) и административные объекты."""
-    filtered: List[Dict[str, Any]] = []
-    
-    food_keywords = ["ресто", "кафе", "кофе", "бар", "столовая", "бистро", "пицц", "суши", 
-                     "бургер", "питан", "кулинар", "фастфуд", "закусочная", "буфет", "гриль"]
-    
-    # Административные/технические объекты, которые не интересны для прогулки
-    admin_keywords = [
-        # Административные учреждения
-        "дирекци", "администрац", "управлен", "офис", "план-схем", "информационн", 
-        "комната матери", "жилищно-коммунальн", "организац", "учрежден",
-        
-        # Финансовые и деловые
-        "банк", "страхов", "нотариус", "юридическ", "суд", "библиотек",
-        
-        # Компании и корпорации (административные здания)
-        "газпром", "роснефт", "сбербанк", "втб", "альфа-банк", "тинькофф",
-        "мтс", "мегафон", "билайн", "ростелеком", "почта россии",
-        
-        # Служебные помещения
-        "офисное здание", "бизнес-центр", "деловой центр", "административное здание",
-        "служебное помещение", "управляющая компания", "диспетчерская",
-        
-        # Технические объекты
-        "котельная", "трансформаторная", "подстанция", "тепловой пункт"
-    ]
+    filtered: List[Place] = []
     
     for p in places:
-        rub = ", ".join(p.get("rubrics", [])).lower()
-        name = (p.get("name") or "").lower()
+        # Рубрики и название проверяются вместе, каждый список — одним поиском
+        text = ", ".join(p.rubrics).lower() + "\n" + p.name.lower()
         
         # Фильтруем административные объекты
-        is_admin = any(k in rub or k in name for k in admin_keywords)
-        if is_admin:
+        if _PLACE_MATCHER.has("admin", text):
             continue
         
-        # Фильтруем еду, если не запрошена
-        if not allow_food:
-            is_food_place = any(k in rub or k in name for k in food_keywords)
-            is_nature_place = any(k in rub or k in name for k in ["парк", "сквер", "сад", "набережн", 
-                                                                    "бульвар", "лесопарк", "роща", "аллея", "променад"])
-            
-            # Если это ТОЛЬКО заведение питания (не парк с рестораном) — пропускаем
-            if is_food_place and not is_nature_place:
-                continue
+        # Если это ТОЛЬКО заведение питания (не парк с рестораном) — пропускаем, если еду не просили
+        if not allow_food and _PLACE_MATCHER.has("food", text) and not _PLACE_MATCHER.has("nature", text):
+            continue
         
         filtered.append(p)
     
     return filtered
 
 
-def _place_distance_km(a: tuple[float, float] | None, b: tuple[float, float] | None) -> float:
-    if not a or not b:
-        return 0.0
-    from math import radians, sin, cos, asin, sqrt
-    lat1, lon1 = a
-    lat2, lon2 = b
-    R = 6371.0
-    phi1 = radians(lat1)
-    phi2 = radians(lat2)
-    dphi = radians(lat2 - lat1)
-    dl = radians(lon2 - lon1)
-    x = sin(dphi/2) ** 2 + cos(phi1) * cos(phi2) * sin(dl/2) ** 2
-    return 2 * R * asin(sqrt(x))
-
-
-def _gpt_select_best_places(places: List[Dict[str, Any]], interests: str, target_count: int = 5) -> List[Dict[str, Any]]:
-    """GPT выбирает наиболее подходящие места из списка по интересам пользователя."""
-    if len(places) <= target_count:
-        return places
-    
-    client = get_client()
-    model_name = get_model()
-    
-    # Формируем список мест для GPT
+def _assign_radius_bands(items: List[Place], origin: tuple[float, float], radii: List[int]) -> List[Place]:
+    """Размечает места полосами радиусов по расстоянию от origin (поле radius_m).
+
+    Места дальше самого большого радиуса отбрасываются. Порядок — как при
+    прежних проходах по радиусам: сначала ближняя полоса, внутри полосы — порядок выдачи.
+    """
+    bands = sorted(radii)
+    banded: List[Place] = []
+    distances = distances_from(origin, [it.coords for it in items])
+    for it, distance_km in zip(items, distances.tolist()):
+        if it.coords:
+            band = next((r for r in bands if distance_km * 1000 <= r), None)
+            if band is None:
+                continue
+            it.distance_km = distance_km
+        else:
+            band = bands[-1]
+        it.radius_m = band
+        banded.append(it)
+    return sorted(banded, key=lambda it: it.radius_m)
+
+
+_SELECTION_RULES = (
+    "ВАЖНО:\n"
+    "- Выбирай места, которые РЕАЛЬНО соответствуют интересам\n"
+    "- Если интересы 'парки' — выбирай парки, а НЕ рестораны в парках\n"
+    "- Если интересы 'кремль' — Нижегородский кремль должен быть в приоритете\n"
+    "- НЕ выбирай административные здания (офисы Газпрома, банков, компаний)\n"
+    "- НЕ выбирай технические объекты (подстанции, котельные, диспетчерские)\n"
+    "- Учитывай рейтинг мест\n"
+    "- ПРИОРИТЕТ: места ДОЛЖНЫ быть ближе к начальной точке. Сначала выбирай варианты с расстоянием до 5 км, допускай до 10 км только если очень подходит.\n"
+    "- Старайся избегать точек дальше 5 км (если есть ближе) — они должны попадать в выбор если это популярные места, которые обязательно должны быть в маршруте или если эти места лучше, чем те, что поблизости.\n"
+    "- СТАРАЙСЯ выбирать места, расположенные РЯДОМ друг с другом (компактный маршрут)\n"
+    "- Избегай мест, которые находятся в разных концах города\n\n"
+)
+
+
+def _describe_candidates(places: List[Place]) -> List[str]:
+    """Строки «индекс: название | рубрики | рейтинг | расстояние» для промпта выбора."""
     items_text = []
     for idx, p in enumerate(places):
-        nm = p.get("name") or "Место"
-        rubrics = ", ".join(p.get("rubrics", [])) if isinstance(p.get("rubrics"), list) else ""
-        rating = p.get("rating")
-        rating_str = f" | рейтинг {rating:.1f}" if rating else ""
-        distance_km = p.get("distance_km")
-        if isinstance(distance_km, (int, float)):
-            distance_str = f" | расстояние {distance_km:.1f} км"
-        else:
-            distance_str = ""
+        nm = p.name or "Место"
+        rubrics = ", ".join(p.rubrics)
+        rating_str = f" | рейтинг {p.rating:.1f}" if p.rating else ""
+        distance_str = f" | расстояние {p.distance_km:.1f} км" if p.distance_km is not None else ""
         items_text.append(f"{idx}: {nm} | {rubrics}{rating_str}{distance_str}")
-    
-    prompt = (
+    return items_text[:30]  # Ограничим для экономии токенов
+
+
+def _ranked_stage(stage: str) -> str:
+    """Имя этапа в статистике GPT: с локальным ранжированием и без — отдельно, чтобы их сравнивать."""
+    return stage if RANKING_MODE == "off" else f"{stage}_ranked"
+
+
+def _selection_prompt(places: List[Place], interests: str, target_count: int) -> str:
+    return (
         f"Интересы пользователя: {interests}\n\n"
         f"Ниже список из {len(places)} мест в Нижнем Новгороде.\n"
         f"Выбери {target_count} САМЫХ ПОДХОДЯЩИХ мест для пешеходного маршрута.\n\n"
-        "ВАЖНО:\n"
-        "- Выбирай места, которые РЕАЛЬНО соответствуют интересам\n"
-        "- Если интересы 'парки' — выбирай парки, а НЕ рестораны в парках\n"
-        "- Если интересы 'кремль' — Нижегородский кремль должен быть в приоритете\n"
-        "- НЕ выбирай административные здания (офисы Газпрома, банков, компаний)\n"
-        "- НЕ выбирай технические объекты (подстанции, котельные, диспетчерские)\n"
-        "- Учитывай рейтинг мест\n"
-        "- ПРИОРИТЕТ: места ДОЛЖНЫ быть ближе к начальной точке. Сначала выбирай варианты с расстоянием до 5 км, допускай до 10 км только если очень подходит.\n"
-        "- Старайся избегать точек дальше 5 км (если есть ближе) — они должны попадать в выбор если это популярные места, которые обязательно должны быть в маршруте или если эти места лучше, чем те, что поблизости.\n"
-        "- СТАРАЙСЯ выбирать места, расположенные РЯДОМ друг с другом (компактный маршрут)\n"
-        "- Избегай мест, которые находятся в разных концах города\n\n"
+        + _SELECTION_RULES +
         f"Верни JSON-массив из {target_count} индексов (от 0 до {len(places)-1}) в порядке приоритета.\n"
         "Формат: [5, 12, 3, 8, 15]\n\n"
-        "Места:\n" + "\n".join(items_text[:30])  # Ограничим для экономии токенов
+        "Места:\n" + "\n".join(_describe_candidates(places))
     )
+
+
+async def _gpt_select_best_places(places: List[Place], interests: str, target_count: int = 5) -> List[Place]:
+    """GPT выбирает наиболее подходящие места из списка по интересам пользователя."""
+    if len(places) <= target_count:
+        return places
+    
+    model_name = get_model()
+    
+    prompt = _selection_prompt(places, interests, target_count)
     
     try:
-        resp = client.chat.completions.create(
+        started = time.perf_counter()
+        resp = await chat_completion(
+            _ranked_stage("select"),
             model=model_name,
             messages=[
                 {"role": "system", "content": "Ты эксперт по туристическим маршрутам. Выбираешь наиболее подходящие места. Отвечай ТОЛЬКО JSON-массивом индексов."},
@@ -445,6 +695,7 @@ def _gpt_select_best_places(places: List[Dict[str, Any]], interests: str, target
             temperature=0.2,
             max_tokens=200,
         )
+        _record_llm_usage(_ranked_stage("select"), resp.usage, started)
         import json as _json
         content = (resp.choices[0].message.content or "").strip()
         # Убираем markdown если есть
@@ -455,14 +706,204 @@ def _gpt_select_best_places(places: List[Dict[str, Any]], interests: str, target
             valid_indices = [i for i in indices if 0 <= i < len(places)][:target_count]
             if len(valid_indices) >= 3:  # Минимум 3 места
                 return [places[i] for i in valid_indices]
-    except Exception:
-        pass
+    except Exception as e:
+        logger.warning("Place selection failed, taking the first candidates: %s", e)
     
     # Fallback: берем первые target_count
+    mark_fallback()
     return places[:target_count]
 
-def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[float, float]]]:
-    """Строит маршрут: места из 2ГИС + GPT выбирает лучшие."""
+_SELECTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "places": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "explanation": {"type": "string"},
+                    "minutes": {"type": "integer"},
+                },
+                "required": ["index", "explanation", "minutes"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["places"],
+    "additionalProperties": False,
+}
+
+
+def _validate_selection(data: Any, candidates_count: int, target_count: int) -> List[tuple[int, str, int]]:
+    """Строго проверяет ответ одного вызова: [(индекс, пояснение, минуты)] или ValueError.
+
+    Минуты вне 10–90 заменяются на 30, как и в многошаговом режиме.
+    """
+    if not isinstance(data, dict) or set(data) != {"places"} or not isinstance(data["places"], list):
+        raise ValueError("ожидался объект {places: [...]}")
+    picks: List[tuple[int, str, int]] = []
+    seen = set()
+    for item in data["places"]:
+        if not isinstance(item, dict) or set(item) != {"index", "explanation", "minutes"}:
+            raise ValueError(f"некорректный элемент: {item!r}")
+        idx, explanation, minutes = item["index"], item["explanation"], item["minutes"]
+        if isinstance(idx, bool) or not isinstance(idx, int) or not 0 <= idx < candidates_count or idx in seen:
+            raise ValueError(f"некорректный индекс: {idx!r}")
+        if not isinstance(explanation, str) or not explanation.strip():
+            raise ValueError(f"пустое пояснение для {idx}")
+        if isinstance(minutes, bool) or not isinstance(minutes, int):
+            raise ValueError(f"некорректные минуты для {idx}: {minutes!r}")
+        if minutes < 10 or minutes > 90:
+            minutes = 30
+        seen.add(idx)
+        picks.append((idx, explanation.strip(), minutes))
+    picks = picks[:target_count]
+    if len(picks) < min(3, candidates_count):  # Минимум 3 места
+        raise ValueError(f"выбрано слишком мало мест: {len(picks)}")
+    return picks
+
+
+async def _gpt_select_and_explain(places: List[Place], interests: str, target_count: int, default_category: str, on_pick=None) -> List[Place] | None:
+    """Один вызов GPT со структурированным ответом: выбор мест, пояснения и время.
+
+    Возвращает шортлист с gpt_reason/gpt_time или None, если ответ не прошёл
+    проверку (тогда маршрут строится в многошаговом режиме). Если передан
+    on_pick(место, пояснение, минуты), ответ читается потоком и каждое
+    выбранное место отдаётся сразу (до итоговой проверки).
+    """
+    described = _describe_candidates(places)
+    prompt = (
+        f"Интересы пользователя: {interests or 'общие'}\n\n"
+        f"Ниже список из {len(described)} мест в Нижнем Новгороде.\n"
+        f"Выбери {min(target_count, len(described))} САМЫХ ПОДХОДЯЩИХ мест для пешеходного маршрута в порядке приоритета.\n\n"
+        + _SELECTION_RULES +
+        "Для КАЖДОГО выбранного места:\n"
+        "1. index — индекс места из списка\n"
+        "2. explanation — краткое объяснение (20-30 слов), почему вам туда стоит зайти (обращение на 'вы'), "
+        "в конце один уместный эмодзи\n"
+        "3. minutes — сколько минут провести на месте (от 15 до 90): памятник 10-15, небольшой музей 30-40, "
+        "большой музей 60-90, парк или набережная 30-45, смотровая площадка 15-20\n"
+        "- Запрещены слова: 'может быть', 'будет интересно', 'любителям'\n"
+        "- Активные формулировки: 'здесь вы увидите', 'вам откроется'\n\n"
+        "Места:\n" + "\n".join(described)
+    )
+    request = dict(
+        model=get_model(),
+        messages=[
+            {"role": "system", "content": "Ты эксперт по туристическим маршрутам. Выбираешь места и объясняешь выбор."},
+            {"role": "user", "content": _truncate(prompt, MAX_INPUT_CHARS)},
+        ],
+        temperature=0.3,
+        max_tokens=MAX_OUTPUT_TOKENS_ROUTE,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "route_selection", "strict": True, "schema": _SELECTION_SCHEMA},
+        },
+    )
+
+    async def on_object(item: Dict[str, Any]) -> None:
+        idx = item.get("index")
+        if isinstance(idx, int) and 0 <= idx < len(described):
+            await on_pick(places[idx], str(item.get("explanation") or ""), _valid_minutes(item.get("minutes")))
+
+    try:
+        if on_pick is None:
+            started = time.perf_counter()
+            resp = await chat_completion(_ranked_stage("select_explain"), **request)
+            _record_llm_usage(_ranked_stage("select_explain"), resp.usage, started)
+            content = resp.choices[0].message.content or ""
+        else:
+            content = await _stream_completion(_ranked_stage("select_explain"), on_object, **request)
+        picks = _validate_selection(json.loads(content), len(described), target_count)
+    except Exception as e:
+        logger.warning("Single-call selection failed, falling back to multi-call: %s", e)
+        mark_fallback()
+        return None
+
+    store = get_explanation_store()
+    shortlist: List[Place] = []
+    for idx, explanation, minutes in picks:
+        place = places[idx]
+        place.gpt_reason = explanation
+        place.gpt_time = minutes
+        store.put(place, place.category or default_category, explanation, minutes)
+        shortlist.append(place)
+    store.record_seen(shortlist, lambda p: p.category or default_category)
+    return shortlist
+
+
+SEARCH_RADII = [5000, 10000]  # 5км, 10км
+SEARCH_MAX_QUERIES = 5
+SEARCH_LIMIT = 10  # мест на запрос
+
+
+def _route_queries(cats: Dict[str, List[str]], interests: str) -> List[str]:
+    """Все поисковые запросы по категориям интересов; если их нет — общий поиск по тексту интересов."""
+    all_queries: List[str] = []
+    for cat in ALL_CATEGORIES:
+        all_queries.extend(cats.get(cat) or [])
+    return all_queries or [interests]
+
+
+def _split_searches(all_queries: List[str], origin: tuple[float, float]) -> tuple[Dict[str, List[Place]], List[str], list]:
+    """Места из локального каталога по запросам и план поисков 2ГИС для тех, чего в нём нет.
+
+    Один проход на запрос на самом большом радиусе (все запросы — параллельно),
+    полосы 5/10 км размечаются потом локально по координатам.
+    Возвращает (найденное в каталоге, запросы в 2ГИС, план поисков).
+    """
+    catalog = get_catalog()
+    found_by_query: Dict[str, List[Place]] = {}
+    live_queries: List[str] = []
+    for q in all_queries[:SEARCH_MAX_QUERIES]:  # Ограничим количество запросов
+        from_catalog = catalog.find_for_query(q, origin, max(SEARCH_RADII), limit=SEARCH_LIMIT)
+        if from_catalog is None:
+            live_queries.append(q)
+        else:
+            found_by_query[q] = from_catalog
+    return found_by_query, live_queries, plan_searches(live_queries, SEARCH_RADII, limit=SEARCH_LIMIT)
+
+
+async def prefetch_route_inputs(interests: str, origin: tuple[float, float] | None = None) -> None:
+    """Заранее делает первые этапы маршрута, пока пользователь заполняет анкету.
+
+    Классифицирует интересы, а если известна точка старта — выполняет те же
+    поиски 2ГИС, что и generate_route. Результаты остаются в кэшах
+    классификации и поиска, откуда их возьмёт построение маршрута.
+    """
+    interests = (interests or "").strip()
+    with stage("prefetch_classify"):
+        cats = await _classify_interests_to_queries(interests, source="prefetch")
+    if origin is None:
+        return
+    _, _, searches = _split_searches(_route_queries(cats, interests), origin)
+    with stage("prefetch_search"):
+        await search_places_2gis_many(searches, origin=origin)
+
+
+def _itinerary_from_cache(variant: Dict[str, Any], time_hours: float, origin: tuple[float, float], start_label: str | None) -> tuple[str, list[tuple[float, float]]]:
+    """Текст и координаты сохранённого варианта; для другого старта или времени маршрут собирается заново."""
+    if variant["start"] == [origin[0], origin[1], start_label or ""] and variant["time_hours"] == time_hours:
+        return variant["itinerary"], [tuple(c) for c in variant["coords"]]
+    shortlist = cached_shortlist(variant)
+    with stage("format"):
+        itinerary, included_indices = _format_itinerary_from_2gis(shortlist, time_hours=time_hours, start_coords=origin, start_label=start_label)
+    return itinerary, [shortlist[i].coords for i in included_indices if shortlist[i].coords]
+
+
+async def generate_route(data, model: str | None = None, progress=None, use_llm: bool = True) -> tuple[str, list[tuple[float, float]]]:
+    """Строит маршрут: места из 2ГИС + GPT выбирает лучшие.
+
+    Весь конвейер асинхронный (AsyncOpenAI + httpx.AsyncClient), поэтому
+    пока строится маршрут одного пользователя, бот обслуживает остальных.
+    progress(text) — необязательный колбэк: получает текст о ходе работы
+    после каждого этапа и по мере того, как GPT дописывает пункты маршрута.
+    use_llm=False — облегчённый маршрут без вызовов GPT (при перегрузке):
+    интересы по правилам, шортлист по локальной оценке, пояснения из хранилища.
+    Похожий маршрут отдаётся из кэша маршрутов (src.route_cache) без поиска и GPT.
+    """
+    route_started = time.perf_counter()
     interests = (data.get("interests") or "").strip()
     time_hours = float(data.get("time") or 2.0)
     location_text = (data.get("location") or "").strip()
@@ -484,46 +925,64 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
     start_label = location_label or (location_text if location_text and not start_coords else None)
 
     # 1) Классифицируем интересы в поисковые запросы
-    cats = _classify_interests_to_queries(interests)
-    origin = resolve_origin_2gis(start_coords, location_text if location_text else None)
+    with stage("classify"):
+        cats = await _classify_interests_to_queries(interests, use_llm=use_llm)
+    with stage("origin"):
+        origin = await resolve_origin_2gis(start_coords, location_text if location_text else None)
+    record_route_request(interests, origin)
+    allow_food = bool(cats.get("food"))
+    if not allow_food:
+        interest_hits = _INTEREST_MATCHER.labels((interests or "").lower())
+        if "food" in interest_hits and "parks" not in interest_hits:
+            allow_food = True
+
+    # Похожий маршрут уже строили: отдаём сохранённый вариант (в облегчённом режиме — любой)
+    debug = os.getenv("DGIS_DEBUG", "0").lower() in ("1", "true", "yes")
+    route_key = None if debug else route_cache_key(cats, origin, time_hours, allow_food)
+    cached = pick_cached_route(route_key, build_more=use_llm)
+    if cached is not None:
+        itinerary, coords_list = _itinerary_from_cache(cached, time_hours, origin, start_label)
+        logger.info("Route served from cache in %.3fs", time.perf_counter() - route_started)
+        return itinerary, coords_list
     
     # 2) Собираем МНОГО мест из 2ГИС с разными радиусами
-    pool: List[Dict[str, Any]] = []
-    radii = [5000, 10000]  # 5км, 10км
+    pool: List[Place] = []
+    radii = SEARCH_RADII
+    all_queries = _route_queries(cats, interests)
+    await _emit_progress(progress, f"🔎 Ищу места: {', '.join(all_queries[:5])}…")
     
-    # Собираем все запросы из всех категорий
-    all_queries: List[str] = []
+    found_by_query, live_queries, searches = _split_searches(all_queries, origin)
+    with stage("search"):
+        found_lists = await search_places_2gis_many(searches, origin=origin)
+    for (q, _, _, _), found in zip(searches, found_lists):
+        found_by_query.setdefault(q, []).extend(found)
+    # Запоминаем, по какой категории интересов найдено место: от неё зависит пояснение
+    query_category = {}
     for cat in ALL_CATEGORIES:
-        all_queries.extend(cats.get(cat) or [])
-    
-    # Если запросов мало, добавим общий поиск
-    if not all_queries:
-        all_queries = [interests]
-    
-    # Ищем с разными радиусами для большего охвата
-    for radius in radii:
-        for q in all_queries[:5]:  # Ограничим количество запросов
-            pool.extend(search_places_2gis_by_query(q, origin=origin, limit=10, radius_m=radius))
+        for q in cats.get(cat) or []:
+            query_category.setdefault(q, cat)
+    main_category = next((cat for cat in ALL_CATEGORIES if cats.get(cat)), "general")
+    for q in dict.fromkeys(all_queries[:5]):
+        for place in found_by_query.get(q) or []:
+            place.category = query_category.get(q, main_category)
+            pool.append(place)
+    with stage("filter"):
+        pool = _assign_radius_bands(pool, origin, radii)
     
-    # Дедупликация
-    candidates = _dedupe_places(pool)
+        # Дедупликация
+        candidates = _dedupe_places(pool)
     
-    # Фильтруем нежелательные места
-    interests_lower = (interests or "").lower()
-    allow_food = bool(cats.get("food"))
-    if not allow_food and any(k in interests_lower for k in FOOD_KEYWORDS):
-        if not any(k in interests_lower for k in PARK_KEYWORDS):
-            allow_food = True
-    candidates_before_filter = len(candidates)
-    candidates_filtered = _filter_unwanted_places(candidates, allow_food=allow_food)
-    candidates_after_filter = len(candidates_filtered)
+        # Фильтруем нежелательные места
+        candidates_before_filter = len(candidates)
+        candidates_filtered = _filter_unwanted_places(candidates, allow_food=allow_food)
+        candidates_after_filter = len(candidates_filtered)
     
     # Для DEBUG
     alt_queries_used = []
     
     # Если после фильтрации осталось мало мест, переформулируем запрос и ищем еще
-    if len(candidates_filtered) < 3:
-        client = get_client()
+    if len(candidates_filtered) < 3 and use_llm:
+        reformulate_started, reformulate_outcome = time.perf_counter(), "ok"
         model_name = get_model()
         
         # Просим GPT придумать альтернативные запросы
@@ -540,7 +999,9 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
         )
         
         try:
-            resp = client.chat.completions.create(
+            started = time.perf_counter()
+            resp = await chat_completion(
+                "reformulate",
                 model=model_name,
                 messages=[
                     {"role": "system", "content": "Ты помогаешь находить альтернативные поисковые запросы. Отвечай ТОЛЬКО JSON-массивом строк."},
@@ -549,6 +1010,7 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
                 temperature=0.7,
                 max_tokens=200,
             )
+            _record_llm_usage("reformulate", resp.usage, started)
             import json as _json
             content = (resp.choices[0].message.content or "").strip()
             # Убираем markdown
@@ -561,10 +1023,12 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
                 alt_queries_used = alt_queries[:7]
                 
                 # Ищем по альтернативным запросам с большим радиусом
-                alt_pool: List[Dict[str, Any]] = []
-                for q in alt_queries_used:
-                    for radius in [10000, 20000]:  # 10км и 20км
-                        alt_pool.extend(search_places_2gis_by_query(str(q), origin=origin, limit=12, radius_m=radius))
+                alt_pool: List[Place] = []
+                alt_radii = [10000, 20000]  # 10км и 20км
+                alt_searches = plan_searches([str(q) for q in alt_queries_used], alt_radii, limit=12)
+                for found in await search_places_2gis_many(alt_searches, origin=origin):
+                    alt_pool.extend(found)
+                alt_pool = _assign_radius_bands(alt_pool, origin, alt_radii)
                 
                 # Объединяем и фильтруем
                 if alt_pool:
@@ -572,38 +1036,81 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
                     candidates = _dedupe_places(pool)
                     candidates_filtered = _filter_unwanted_places(candidates, allow_food=allow_food)
                     candidates_after_filter = len(candidates_filtered)
-        except Exception:
-            pass
+        except Exception as e:
+            logger.warning("Query reformulation failed: %s", e)
+            reformulate_outcome = "fallback"
+        observe("reformulate", time.perf_counter() - reformulate_started, reformulate_outcome)
     
     candidates = candidates_filtered
 
-    for place in candidates:
-        coords = place.get("coords")
-        if coords and isinstance(coords, (list, tuple)) and len(coords) == 2:
-            try:
-                place["distance_km"] = _place_distance_km(origin, (float(coords[0]), float(coords[1])))
-            except Exception:
-                place["distance_km"] = None
-        else:
-            place["distance_km"] = None
+    # Расстояния от старта — одним пакетным вызовом для всех кандидатов
+    distances = distances_from(origin, [place.coords for place in candidates])
+    for place, distance_km in zip(candidates, distances.tolist()):
+        place.distance_km = distance_km if place.coords else None
     
     if len(candidates) < 1:
-        return "Не удалось найти достаточно мест по запросу. Уточните интересы или адрес."
+        return "Не удалось найти достаточно мест по запросу. Уточните интересы или адрес.", []
+    
+    await _emit_progress(progress, f"📍 Нашёл {len(candidates)} подходящих мест рядом, выбираю лучшие…")
     
-    # 3) GPT выбирает лучшие 3-5 мест
     target = max(3, min(5, int(time_hours * 2)))
-    shortlist = _gpt_select_best_places(candidates, interests, target_count=target)
+    candidates_before_ranking = len(candidates)
+    local_only = RANKING_MODE == "local" or not use_llm
+    if RANKING_MODE != "off" or local_only:
+        # Локальное ранжирование: в GPT уходят только лучшие кандидаты (в режиме local — сразу шортлист)
+        catalog = get_catalog()
+        wanted_rubrics: set = set()
+        for q in all_queries[:5]:
+            wanted_rubrics |= catalog.rubrics_for_query(q)
+        with stage("rank"):
+            candidates = rank_candidates(
+                candidates,
+                all_queries[:5] + [str(q) for q in alt_queries_used],
+                wanted_rubrics,
+                limit=target if local_only else RANKING_TOP_K,
+            )
+    
+    # 3) GPT выбирает лучшие 3-5 мест
+    progress_items: Dict[int, str] = {}
     
-    # 4) GPT объясняет выбор И определяет время на каждое место
-    explanations, times = _gpt_explain_and_estimate_time(shortlist, interests)
-    for i, p in enumerate(shortlist):
-        if i < len(explanations):
-            p["gpt_reason"] = explanations[i]
-        if i < len(times):
-            p["gpt_time"] = times[i]
+    def progress_text(header: str) -> str:
+        return "\n\n".join([header] + [progress_items[k] for k in sorted(progress_items)])
+    
+    shortlist = None
+    if LLM_PIPELINE_MODE == "single" and not local_only:
+        # 3+4) Выбор, пояснения и время — одним структурированным вызовом
+        async def on_pick(place: Place, explanation: str, minutes: int) -> None:
+            progress_items[len(progress_items)] = f"{len(progress_items) + 1}) {place.name or 'Место'} — {explanation} ({minutes} мин)"
+            await _emit_progress(progress, progress_text("✍️ Составляю маршрут…"))
+        
+        with stage("select_explain"):
+            shortlist = await _gpt_select_and_explain(candidates, interests, target, main_category, on_pick=on_pick)
+    if shortlist is None:
+        progress_items.clear()
+        if local_only:
+            # Выбор без GPT: шортлист — лучшие по локальной оценке
+            record_local_only()
+            shortlist = candidates[:target]
+        else:
+            with stage("select"):
+                shortlist = await _gpt_select_best_places(candidates, interests, target_count=target)
+        names = ", ".join(p.name or "Место" for p in shortlist)
+        await _emit_progress(progress, f"✅ Выбрал: {names}. Готовлю описания…")
+        
+        async def on_item(i: int, explanation: str, minutes: int) -> None:
+            progress_items[i] = f"{i + 1}) {shortlist[i].name or 'Место'} — {explanation} ({minutes} мин)"
+            await _emit_progress(progress, progress_text(f"✅ Выбрал: {names}"))
+        
+        # 4) GPT объясняет выбор И определяет время на каждое место
+        with stage("explain"):
+            explanations, times = await _explain_with_store(shortlist, interests, main_category, on_item=on_item if progress else None, use_llm=use_llm)
+        for i, p in enumerate(shortlist):
+            if i < len(explanations):
+                p.gpt_reason = explanations[i]
+            if i < len(times):
+                p.gpt_time = times[i]
     
     # DEBUG
-    debug = os.getenv("DGIS_DEBUG", "0").lower() in ("1", "true", "yes")
     dbg_lines = [] if debug else None
     
     if debug:
@@ -615,13 +1122,16 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
             if queries:
                 dbg_lines.append(f"  {cat}: {queries}")
         dbg_lines.append(f"\nВсе запросы к 2ГИС ({len(all_queries[:10])}): {all_queries[:10]}")
-        dbg_lines.append(f"Радиусы поиска: {radii} метров")
+        dbg_lines.append(f"Радиусы поиска: {radii} метров (один запрос на {max(radii)} м, запросов к 2ГИС: {len(searches)})")
+        dbg_lines.append(f"Из локального каталога: {len(all_queries[:5]) - len(live_queries)} запросов, в 2ГИС: {len(live_queries)}")
+        for band in radii:
+            dbg_lines.append(f"  В полосе до {band} м: {sum(1 for it in pool if it.radius_m == band)} мест")
         dbg_lines.append("")
         
         dbg_lines.append("=== Результаты от 2ГИС ===")
         dbg_lines.append(f"Всего найдено: {len(pool)} мест")
         dbg_lines.append(f"После дедупликации: {candidates_before_filter} мест")
-        dbg_lines.append(f"После фильтрации нежелательных мест: {len(candidates)} мест")
+        dbg_lines.append(f"После фильтрации нежелательных мест: {candidates_before_ranking} мест")
         if candidates_after_filter < candidates_before_filter:
             dbg_lines.append(f"⚠️ Фильтр удалил {candidates_before_filter - candidates_after_filter} мест (административные, еда)")
         
@@ -629,61 +1139,62 @@ def generate_route(data, model: str | None = None) -> tuple[str, list[tuple[floa
         if alt_queries_used:
             dbg_lines.append(f"\n🔄 GPT переформулировал запрос:")
             dbg_lines.append(f"   Альтернативные запросы: {alt_queries_used}")
-            dbg_lines.append(f"   Найдено дополнительно: {len(candidates) - candidates_after_filter} мест")
-            dbg_lines.append(f"   Итого после переформулировки: {len(candidates)} мест")
+            dbg_lines.append(f"   Найдено дополнительно: {candidates_before_ranking - candidates_after_filter} мест")
+            dbg_lines.append(f"   Итого после переформулировки: {candidates_before_ranking} мест")
         
         if len(candidates) > 0:
             dbg_lines.append(f"\nПервые 10 мест от 2ГИС:")
             for idx, it in enumerate(candidates[:10]):
-                name = it.get('name', '?')
-                rubrics = ', '.join(it.get('rubrics', []))
-                rating = it.get('rating')
-                rating_str = f" [{rating:.1f}★]" if rating else ""
-                dbg_lines.append(f"  {idx+1}. {name}{rating_str}")
-                dbg_lines.append(f"     Рубрики: {rubrics}")
+                rating_str = f" [{it.rating:.1f}★]" if it.rating else ""
+                dbg_lines.append(f"  {idx+1}. {it.name or '?'}{rating_str}")
+                dbg_lines.append(f"     Рубрики: {', '.join(it.rubrics)}")
         
         dbg_lines.append("")
-        dbg_lines.append("=== Запрос к GPT для выбора мест ===")
+        dbg_lines.append(f"Локальное ранжирование ({RANKING_MODE}): {candidates_before_ranking} → {len(candidates)} кандидатов")
+        dbg_lines.append(f"=== Запрос к GPT для выбора мест (режим {LLM_PIPELINE_MODE}) ===")
         dbg_lines.append(f"Запросили у GPT выбрать {target} лучших мест из {len(candidates)}")
         
         dbg_lines.append("")
         dbg_lines.append(f"=== GPT выбрал {len(shortlist)} мест ===")
         for idx, it in enumerate(shortlist):
-            name = it.get('name', '?')
-            rubrics = ', '.join(it.get('rubrics', []))
-            gpt_time = it.get('gpt_time', 30)
-            dbg_lines.append(f"{idx+1}. {name} (время: {gpt_time} мин)")
-            dbg_lines.append(f"   Рубрики: {rubrics}")
+            dbg_lines.append(f"{idx+1}. {it.name or '?'} (время: {it.gpt_time} мин)")
+            dbg_lines.append(f"   Рубрики: {', '.join(it.rubrics)}")
         
         dbg_lines.append("")
         dbg_lines.append("=== Формирование маршрута ===")
         dbg_lines.append(f"Доступно времени: {int(time_hours * 60)} минут")
     
     # 5) Формируем маршрут
-    itinerary, included_indices = _format_itinerary_from_2gis(shortlist, time_hours=time_hours, start_coords=origin, start_label=start_label, debug_info=dbg_lines)
+    with stage("format"):
+        itinerary, included_indices = _format_itinerary_from_2gis(shortlist, time_hours=time_hours, start_coords=origin, start_label=start_label, debug_info=dbg_lines)
 
     # 6) Собираем координаты
     coords_list: list[tuple[float, float]] = []
     for idx in included_indices:
-        place = shortlist[idx]
-        c = place.get("coords")
-        if c and isinstance(c, (list, tuple)) and len(c) == 2:
-            coords_list.append((float(c[0]), float(c[1])))
+        coords = shortlist[idx].coords
+        if coords:
+            coords_list.append(coords)
 
     if debug and dbg_lines:
         dbg_lines.append("="*50)
         itinerary += "\n" + "\n".join(dbg_lines)
+    elif use_llm and len(coords_list) >= 3:
+        store_route(route_key, shortlist, itinerary, coords_list, origin, start_label, time_hours)
     
+    logger.info("Route built in %.2fs (LLM mode %s, ranking %s), LLM usage so far: %s, ranking: %s, LLM scheduler: %s",
+                time.perf_counter() - route_started, LLM_PIPELINE_MODE, RANKING_MODE, get_llm_usage_stats(), get_ranking_stats(),
+                get_llm_scheduler_stats())
     return itinerary, coords_list
 
 
-def generate_route_result(data, model: str | None = None) -> tuple[str, list[tuple[float, float]], bool]:
+async def generate_route_result(data, model: str | None = None, progress=None, use_llm: bool = True) -> tuple[str, list[tuple[float, float]], bool]:
     """
     Возвращает (text, coords_list, ok).
     ok=False, если мест < 3 либо произошла ошибка подбора.
     """
     try:
-        itinerary, coords_list = generate_route(data, model)
+        with stage("route"):
+            itinerary, coords_list = await generate_route(data, model, progress=progress, use_llm=use_llm)
         if "Не удалось найти" in itinerary or len(coords_list) < 3:
             return (itinerary, coords_list, False)
         return (itinerary, coords_list, True)
@@ -0,0 +1,87 @@
+"""
+Поиск многих ключевых слов за один проход по строке.
+
+Все ключевые слова таблицы собираются в одно регулярное выражение
+(?=(a|b|...)) с альтернативами от длинных к коротким: в каждой позиции
+строки находится самое длинное совпадение, а более короткие слова,
+начинающиеся там же, — это его префиксы, они добавляются по заранее
+посчитанному замыканию. Ключевое слово вида «военн&тех» срабатывает,
+когда в строке найдены все его части.
+
+Когда нужен ответ «есть ли хоть одно слово метки» (has), достаточно
+обычного re.search по альтернации слов этой метки — он останавливается на
+первом совпадении.
+
+Сравнение со старыми проверками any(k in text ...): python -m src.bench.keywords
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, FrozenSet, Hashable, Iterable, List, Mapping, Optional, Set, Tuple
+
+
+class KeywordMatcher:
+    """Таблица «метка → ключевые слова», скомпилированная в один поиск.
+
+    Слова сравниваются как подстроки; текст передаётся уже в нижнем регистре.
+    """
+
+    def __init__(self, groups: Mapping[Hashable, Iterable[str]]) -> None:
+        self._keywords: List[Tuple[Hashable, Tuple[str, ...]]] = []
+        by_atom: Dict[str, List[int]] = {}
+        for label, keywords in groups.items():
+            for keyword in keywords:
+                parts = tuple(part.strip() for part in keyword.split("&") if part.strip())
+                if not parts:
+                    continue
+                index = len(self._keywords)
+                self._keywords.append((label, parts))
+                for part in parts:
+                    by_atom.setdefault(part, []).append(index)
+        self._by_atom = by_atom
+        # Для has: альтернация простых слов метки; метки со словами «а&б» проверяются через matched
+        self._label_patterns: Dict[Hashable, Optional[re.Pattern]] = {}
+        for label, keywords in groups.items():
+            simple = [kw.strip() for kw in keywords if "&" not in kw and kw.strip()]
+            if len(simple) == len([kw for kw in keywords if kw.strip("& ")]):
+                ordered = sorted(set(simple), key=lambda a: (-len(a), a))
+                self._label_patterns[label] = re.compile("|".join(map(re.escape, ordered))) if ordered else None
+        atoms = sorted(by_atom, key=lambda a: (-len(a), a))
+        self._pattern = re.compile("(?=(" + "|".join(map(re.escape, atoms)) + "))") if atoms else None
+        # Совпавшее в позиции слово «приносит» и все слова-префиксы, начинающиеся там же
+        self._closure: Dict[str, FrozenSet[str]] = {
+            atom: frozenset(other for other in atoms if atom.startswith(other)) for atom in atoms
+        }
+
+    def atoms(self, text: str) -> Set[str]:
+        """Все части ключевых слов, встречающиеся в тексте."""
+        found: Set[str] = set()
+        if self._pattern is None or not text:
+            return found
+        for match in self._pattern.finditer(text):
+            atom = match.group(1)
+            if atom not in found:
+                found |= self._closure[atom]
+        return found
+
+    def matched(self, text: str) -> List[Tuple[Hashable, Tuple[str, ...]]]:
+        """Сработавшие ключевые слова (метка, части) в порядке таблицы."""
+        found = self.atoms(text)
+        indices = {index for atom in found for index in self._by_atom[atom]}
+        return [
+            self._keywords[index]
+            for index in sorted(indices)
+            if all(part in found for part in self._keywords[index][1])
+        ]
+
+    def labels(self, text: str) -> Set[Hashable]:
+        """Метки, у которых сработало хотя бы одно ключевое слово."""
+        return {label for label, _ in self.matched(text)}
+
+    def has(self, label: Hashable, text: str) -> bool:
+        """Есть ли в тексте хотя бы одно ключевое слово метки label."""
+        if label in self._label_patterns:
+            pattern = self._label_patterns[label]
+            return pattern is not None and bool(text) and pattern.search(text) is not None
+        return label in self.labels(text)
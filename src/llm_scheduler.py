@@ -0,0 +1,321 @@
+"""
+Общий на процесс планировщик вызовов OpenAI.
+
+Все chat.completions идут через chat_completion(): перед вызовом запрос
+ждёт своей очереди в двух «вёдрах» — запросов в минуту (OPENAI_RPM) и
+токенов в минуту (OPENAI_TPM, оценка по длине промпта плюс max_tokens).
+Очередь приоритетная: интерактивные этапы маршрута идут раньше фоновой
+работы (подготовка пояснений, прогрев кэшей), внутри приоритета — по
+порядку. На 429 и 5xx вызов повторяется с экспоненциальной паузой со
+случайным разбросом (или сколько просит Retry-After); собственные повторы
+SDK отключены, чтобы не удваивать их.
+
+Фоновый код помечает свои вызовы так:
+    with background_priority():
+        await pregenerate(...)
+
+Если результат фоновой работы понадобился пользователю (подготовка маршрута,
+которую ждёт его построение), её вызовы поднимаются до интерактивных:
+    with background_priority() as priority:
+        ...
+    priority.promote()  # из другой задачи, пока вызовы ждут в очереди
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import openai
+from dotenv import load_dotenv
+
+from .client import get_client
+from .metrics import register_gauge
+
+load_dotenv()
+
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "200000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = 20.0  # сек, потолок одной паузы
+CHARS_PER_TOKEN = 3.0  # грубая оценка для русского текста
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    """Приоритет группы вызовов; его можно поднять, пока вызовы ждут в очереди."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+    def promote(self) -> None:
+        """Делает ждущие и будущие вызовы группы интерактивными."""
+        if self.value != PRIORITY_INTERACTIVE:
+            self.value = PRIORITY_INTERACTIVE
+            if _scheduler is not None:
+                _scheduler.reorder()
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority(PRIORITY_INTERACTIVE))
+
+
+@contextmanager
+def background_priority(priority: Optional[Priority] = None) -> Iterator[Priority]:
+    """Вызовы GPT внутри блока (и в задачах, созданных из него) уступают интерактивным.
+
+    priority — заранее созданная группа, если поднять её может понадобиться
+    ещё до входа в блок.
+    """
+    priority = priority or Priority(PRIORITY_BACKGROUND)
+    token = _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(request: Dict[str, Any]) -> int:
+    """Оценка расхода токенов запроса до вызова: промпт по длине текста плюс max_tokens ответа."""
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in request.get("messages") or [])
+    if request.get("response_format"):
+        prompt_chars += len(json.dumps(request["response_format"], ensure_ascii=False))
+    return int(prompt_chars / CHARS_PER_TOKEN) + int(request.get("max_tokens") or 0)
+
+
+class _Bucket:
+    """Ведро с непрерывным пополнением: capacity единиц, capacity в минуту."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._at) * self.rate)
+        self._at = now
+
+    def wait_time(self, amount: float) -> float:
+        # Запрос больше ведра пропускаем, когда оно полное, иначе он не пройдёт никогда
+        need = min(amount, self.capacity) - self.level
+        return max(0.0, need / self.rate)
+
+
+class _Waiter:
+    __slots__ = ("group", "seq", "tokens", "wake", "enqueued_at")
+
+    def __init__(self, group: Priority, seq: int, tokens: int) -> None:
+        self.group = group
+        self.seq = seq
+        self.tokens = tokens
+        self.wake = asyncio.Event()
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def priority(self) -> int:
+        return self.group.value
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """Приоритетная очередь перед OpenAI с бюджетами RPM/TPM и повторами."""
+
+    def __init__(self, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM, max_retries: int = OPENAI_MAX_RETRIES) -> None:
+        self._requests = _Bucket(rpm)
+        self._tokens = _Bucket(tpm)
+        self.max_retries = max_retries
+        self._heap: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    def _class_stats(self, priority: int) -> Dict[str, float]:
+        name = _PRIORITY_NAMES.get(priority, str(priority))
+        return self._stats.setdefault(name, {"calls": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0})
+
+    def _wake_head(self) -> None:
+        if self._heap:
+            self._heap[0].wake.set()
+
+    def reorder(self) -> None:
+        """Приоритет ждущих изменился: восстанавливает порядок очереди и будит новую голову."""
+        heapq.heapify(self._heap)
+        self._wake_head()
+
+    async def acquire(self, tokens: int, priority: Union[int, Priority]) -> float:
+        """Ждёт бюджета под запрос; возвращает время ожидания в секундах."""
+        group = priority if isinstance(priority, Priority) else Priority(priority)
+        waiter = _Waiter(group, next(self._seq), tokens)
+        heapq.heappush(self._heap, waiter)
+        self._wake_head()
+        try:
+            while True:
+                await waiter.wake.wait()
+                waiter.wake.clear()
+                if self._heap[0] is not waiter:
+                    continue  # вперёд встал более срочный запрос — он разбудит нас, когда пройдёт
+                now = time.monotonic()
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                delay = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                if delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(waiter.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.wake.set()
+        except BaseException:
+            was_head = self._heap and self._heap[0] is waiter
+            self._heap.remove(waiter)
+            heapq.heapify(self._heap)
+            if was_head:
+                self._wake_head()
+            raise
+        heapq.heappop(self._heap)
+        self._requests.level -= 1
+        self._tokens.level -= min(tokens, self._tokens.capacity)
+        self._wake_head()
+
+        waited = time.monotonic() - waiter.enqueued_at
+        stats = self._class_stats(group.value)
+        stats["calls"] += 1
+        if waited > 0.01:
+            stats["waited"] += 1
+        stats["wait_seconds"] += waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+        return waited
+
+    def settle(self, estimated: int, usage: Any) -> None:
+        """Поправляет ведро токенов на разницу между оценкой и фактическим расходом."""
+        actual = getattr(usage, "total_tokens", None)
+        if actual:
+            self._tokens.level = min(self._tokens.capacity, self._tokens.level + estimated - actual)
+
+    @staticmethod
+    def _retry_delay(attempt: int, error: Exception) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+        # «Полный разброс»: случайная пауза до экспоненциального потолка
+        return random.uniform(0, min(BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+    async def complete(self, stage: str, **request: Any) -> Any:
+        priority = _priority.get()
+        estimated = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(estimated, priority)
+            try:
+                response = await get_client().chat.completions.create(**request)
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limited += 1
+                if attempt == self.max_retries:
+                    self.failures += 1
+                    logger.warning("OpenAI %s failed after %d attempts: %s", stage, attempt + 1, e)
+                    raise
+                delay = self._retry_delay(attempt, e)
+                self.retries += 1
+                logger.info("OpenAI %s: %s, retry %d in %.1fs", stage, type(e).__name__, attempt + 1, delay)
+                await asyncio.sleep(delay)
+                continue
+            if not request.get("stream"):
+                self.settle(estimated, getattr(response, "usage", None))
+            return response
+        raise RuntimeError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        for waiter in self._heap:
+            name = _PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+            queued[name] = queued.get(name, 0) + 1
+        per_class = {}
+        for name, s in self._stats.items():
+            per_class[name] = {
+                "calls": int(s["calls"]),
+                "waited": int(s["waited"]),
+                "wait_seconds": round(s["wait_seconds"], 3),
+                "max_wait_seconds": round(s["max_wait_seconds"], 3),
+                "avg_wait_seconds": round(s["wait_seconds"] / s["calls"], 3) if s["calls"] else 0.0,
+            }
+        return {
+            "queue_depth": len(self._heap),
+            "queued": queued,
+            "classes": per_class,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "tokens_available": int(self._tokens.level),
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = LLMScheduler()
+    return _scheduler
+
+
+async def chat_completion(stage: str, **request: Any) -> Any:
+    """chat.completions.create через общий планировщик (stream=True тоже: тогда возвращается поток).
+
+    Для потоковых ответов фактический расход не известен заранее, ведро
+    списывает оценку с max_tokens — с запасом.
+    """
+    return await get_llm_scheduler().complete(stage, **request)
+
+
+def get_llm_scheduler_stats() -> Dict[str, Any]:
+    """Глубина очереди, ожидание по приоритетам, повторы и 429."""
+    return get_llm_scheduler().stats()
+
+
+register_gauge(
+    "llm_queue_depth",
+    "Вызовов GPT в очереди планировщика по приоритетам",
+    lambda: [({"priority": name}, get_llm_scheduler_stats()["queued"].get(name, 0)) for name in _PRIORITY_NAMES.values()],
+)
+register_gauge(
+    "llm_wait_seconds_total",
+    "Суммарное ожидание вызовов GPT в очереди планировщика",
+    lambda: [({"priority": name}, s["wait_seconds"]) for name, s in get_llm_scheduler_stats()["classes"].items()],
+    kind="counter",
+)
+register_gauge(
+    "llm_retries_total",
+    "Повторы вызовов GPT по причине: retry — любой повтор, rate_limited — ответ 429, failed — попытки кончились",
+    lambda: [
+        ({"reason": "retry"}, get_llm_scheduler().retries),
+        ({"reason": "rate_limited"}, get_llm_scheduler().rate_limited),
+        ({"reason": "failed"}, get_llm_scheduler().failures),
+    ],
+    kind="counter",
+)
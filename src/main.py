@@ -1,9 +1,13 @@
 import asyncio
 import logging
+import os
 import sys
 
 from src.bot import bot, dp
 
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()  # polling | webhook
+
+
 async def main():
     try:
         await dp.start_polling(bot)
@@ -12,8 +16,13 @@ async def main():
 
 
 if __name__ == "__main__":
-    try:
-        logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print('FINISHED')
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    if BOT_MODE == "webhook":
+        from src.server import run_webhook
+
+        run_webhook()
+    else:
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            print('FINISHED')
@@ -0,0 +1,267 @@
+"""
+Метрики конвейера маршрутов и их выдача в формате Prometheus.
+
+Конвейер оборачивает этапы в `with stage("search"):`. Для каждого этапа
+считаются длительности (гистограмма и последние METRICS_SAMPLES замеров для
+перцентилей) и исходы: ok, fallback — этап отработал запасным путём
+(эвристики вместо GPT, первые кандидаты вместо выбора), error — исключение.
+Запасной путь отмечается изнутри этапа вызовом mark_fallback().
+
+Счётчики (токены GPT и т.п.) ведутся через inc(), а состояние других
+модулей (очереди, кэши) снимается в момент запроса колбэками register_gauge().
+
+Всё это отдаётся на http://METRICS_HOST:METRICS_PORT/metrics; в режиме
+вебхука каждый воркер слушает свой порт METRICS_PORT + номер воркера.
+Нагрузочный бенчмарк (python -m src.bench.load) печатает этапы таблицей.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_SAMPLES = int(os.getenv("METRICS_SAMPLES", "10000"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 — не поднимать /metrics
+
+PERCENTILES = (50, 95, 99)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)  # сек
+OUTCOMES = ("ok", "fallback", "error")
+PREFIX = "tour_bot_"
+
+Labels = Tuple[Tuple[str, str], ...]
+GaugeValue = Union[float, Iterable[Tuple[Dict[str, str], float]]]
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Длительности и исходы одного этапа, сек."""
+
+    __slots__ = ("count", "total", "outcomes", "buckets", "samples")
+
+    def __init__(self, samples: int = METRICS_SAMPLES) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.outcomes: Dict[str, int] = dict.fromkeys(OUTCOMES, 0)
+        self.buckets: List[int] = [0] * len(BUCKETS)
+        self.samples: Deque[float] = deque(maxlen=samples)
+
+    @property
+    def errors(self) -> int:
+        return self.outcomes["error"]
+
+    def observe(self, seconds: float, outcome: str = "ok") -> None:
+        self.count += 1
+        self.total += seconds
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.samples.append(seconds)
+
+    def percentiles(self, points: Sequence[int] = PERCENTILES) -> Dict[int, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {p: 0.0 for p in points}
+        # Ближайший ранг: p99 из 100 замеров — 99-й по величине
+        return {p: ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))] for p in points}
+
+
+class Span:
+    """Текущий замер этапа: исход можно поменять изнутри блока."""
+
+    __slots__ = ("name", "outcome")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.outcome = "ok"
+
+
+_stages: Dict[str, StageStats] = {}
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("metrics_span", default=None)
+_counters: Dict[str, Dict[Labels, float]] = {}
+_help: Dict[str, Tuple[str, str]] = {}  # имя → (тип, описание)
+_gauges: Dict[str, Tuple[str, str, List[Callable[[], GaugeValue]]]] = {}  # имя → (тип, описание, колбэки)
+
+
+def observe(name: str, seconds: float, outcome: str = "ok") -> None:
+    stats = _stages.get(name)
+    if stats is None:
+        stats = _stages[name] = StageStats()
+    stats.observe(seconds, outcome)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Span]:
+    """Замеряет блок как этап name; исключение засчитывается как error и пробрасывается.
+
+    Отменённый блок (CancelledError) не учитывается: это не время этапа.
+    """
+    span = Span(name)
+    token = _current.set(span)
+    started = time.perf_counter()
+    cancelled = False
+    try:
+        yield span
+    except Exception:
+        span.outcome = "error"
+        raise
+    except BaseException:
+        cancelled = True
+        raise
+    finally:
+        _current.reset(token)
+        if not cancelled:
+            observe(name, time.perf_counter() - started, span.outcome)
+
+
+def mark_fallback() -> None:
+    """Отмечает текущий этап как отработавший запасным путём."""
+    span = _current.get()
+    if span is not None and span.outcome == "ok":
+        span.outcome = "fallback"
+
+
+def get_stage_stats() -> Dict[str, StageStats]:
+    return dict(_stages)
+
+
+def reset_stage_stats() -> None:
+    _stages.clear()
+
+
+def describe(name: str, help_text: str, kind: str = "counter") -> None:
+    _help[name] = (kind, help_text)
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    """Прибавляет value к счётчику name с метками labels."""
+    series = _counters.setdefault(name, {})
+    key = tuple(sorted(labels.items()))
+    series[key] = series.get(key, 0.0) + value
+
+
+def register_gauge(name: str, help_text: str, read: Callable[[], GaugeValue], kind: str = "gauge") -> None:
+    """Метрика, значение которой снимается в момент запроса /metrics.
+
+    read() возвращает число или пары (метки, значение). kind="counter" —
+    для накопленных модулем счётчиков (повторы, попадания в кэш). Одно имя
+    могут регистрировать несколько модулей с разными метками.
+    """
+    _gauges.setdefault(name, (kind, help_text, []))[2].append(read)
+
+
+_CACHE_RESULTS = (("hit", "hits"), ("disk_hit", "disk_hits"), ("stale_hit", "stale_hits"), ("miss", "misses"))
+
+
+def register_cache(cache: str, read_stats: Callable[[], Dict[str, Any]]) -> None:
+    """Размер и попадания TTLCache (его stats()) с меткой cache."""
+    register_gauge(
+        "cache_lookups_total",
+        "Обращения к кэшам: hit, disk_hit, stale_hit, miss",
+        lambda: [({"cache": cache, "result": result}, read_stats()[key]) for result, key in _CACHE_RESULTS],
+        kind="counter",
+    )
+    register_gauge("cache_entries", "Записей в памяти кэша", lambda: [({"cache": cache}, read_stats()["size"])])
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+    return "{" + body + "}" if body else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus() -> str:
+    """Текст в формате экспозиции Prometheus 0.0.4."""
+    lines: List[str] = []
+
+    def header(name: str, kind: str, help_text: str) -> None:
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    stages = sorted(_stages.items())
+    header("stage_duration_seconds", "histogram", "Длительность этапов построения маршрута")
+    for name, stats in stages:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            lines.append(f"{PREFIX}stage_duration_seconds_bucket{_labels((('stage', name), ('le', _number(bound))))} {cumulative}")
+        lines.append(f"{PREFIX}stage_duration_seconds_bucket{_labels((('stage', name), ('le', '+Inf')))} {stats.count}")
+        lines.append(f"{PREFIX}stage_duration_seconds_sum{_labels((('stage', name),))} {stats.total!r}")
+        lines.append(f"{PREFIX}stage_duration_seconds_count{_labels((('stage', name),))} {stats.count}")
+    header("stage_total", "counter", "Исходы этапов: ok, fallback (запасной путь), error")
+    for name, stats in stages:
+        for outcome, count in stats.outcomes.items():
+            lines.append(f"{PREFIX}stage_total{_labels((('stage', name), ('outcome', outcome)))} {count}")
+
+    for name, series in sorted(_counters.items()):
+        kind, help_text = _help.get(name, ("counter", name))
+        header(name, kind, help_text)
+        for key, value in sorted(series.items()):
+            lines.append(f"{PREFIX}{name}{_labels(key)} {_number(value)}")
+
+    for name, (kind, help_text, readers) in _gauges.items():
+        header(name, kind, help_text)
+        for read in readers:
+            try:
+                value = read()
+                samples = [({}, value)] if isinstance(value, (int, float)) else list(value)
+            except Exception as e:
+                logger.debug("Metric %s is unavailable: %s", name, e)
+                continue
+            for labels, sample in samples:
+                lines.append(f"{PREFIX}{name}{_labels(sorted(labels.items()))} {_number(sample)}")
+    return "\n".join(lines) + "\n"
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _metrics_view(_: web.Request) -> web.Response:
+    return web.Response(body=render_prometheus().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(worker_index: int = 0) -> None:
+    """Поднимает /metrics на METRICS_PORT + worker_index (хук запуска Dispatcher)."""
+    global _runner
+    if not METRICS_PORT or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = METRICS_PORT + worker_index
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logger.warning("Metrics endpoint is disabled: cannot listen on %s:%s: %s", METRICS_HOST, port, e)
+        await runner.cleanup()
+        return
+    _runner = runner
+    logger.info("Metrics on http://%s:%s/metrics", METRICS_HOST, port)
+
+
+async def stop_metrics_server() -> None:
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
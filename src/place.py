@@ -0,0 +1,129 @@
+"""
+Место (POI) в конвейере: компактная запись вместо словаря.
+
+Поля фиксированы (__slots__), координаты — float, рубрики хранятся
+кортежем id из общей таблицы RUBRICS: одна строка «Музеи» на процесс,
+а не копия в каждом месте. В кэши и файл каталога место пишется
+словарём (to_dict) и читается обратно через from_dict.
+
+Сравнение памяти со словарями: python -m src.bench.place_memory
+"""
+
+from __future__ import annotations
+
+import sys
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_STAY_MIN = 30
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+
+class RubricTable:
+    """Интернирование названий рубрик: название ↔ небольшой целый id."""
+
+    def __init__(self) -> None:
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._normalized: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def intern(self, name: str) -> int:
+        rid = self._ids.get(name)
+        if rid is None:
+            rid = len(self._names)
+            self._ids[name] = rid
+            self._names.append(sys.intern(name))
+            self._normalized.append(sys.intern(_norm(name)))
+        return rid
+
+    def ids(self, names: Iterable[Any]) -> Tuple[int, ...]:
+        return tuple(self.intern(name.strip()) for name in names if isinstance(name, str) and name.strip())
+
+    def name(self, rid: int) -> str:
+        return self._names[rid]
+
+    def normalized(self, rid: int) -> str:
+        """Название в нижнем регистре и без «ё» — для сравнения с запросами и индексов."""
+        return self._normalized[rid]
+
+
+RUBRICS = RubricTable()
+
+
+@dataclass(slots=True)
+class Place:
+    """Место из 2ГИС или каталога и поля, которые дописывает конвейер."""
+
+    name: str
+    address: str = ""
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    rubric_ids: Tuple[int, ...] = ()
+    rating: Optional[float] = None
+    type: str = ""
+    # Заполняются по ходу построения маршрута
+    category: str = ""
+    distance_km: Optional[float] = None
+    radius_m: int = 0
+    local_score: float = 0.0
+    gpt_reason: str = ""
+    gpt_time: int = DEFAULT_STAY_MIN
+    route_value: float = 1.0
+
+    @property
+    def coords(self) -> Optional[Tuple[float, float]]:
+        if self.lat is None or self.lon is None:
+            return None
+        return self.lat, self.lon
+
+    @property
+    def rubrics(self) -> List[str]:
+        return [RUBRICS.name(rid) for rid in self.rubric_ids]
+
+    @property
+    def normalized_rubrics(self) -> List[str]:
+        return [RUBRICS.normalized(rid) for rid in self.rubric_ids]
+
+    @property
+    def key(self) -> str:
+        """Идентичность места для дедупликации и кэшей: название|адрес."""
+        return _norm(self.name) + "|" + _norm(self.address)
+
+    def copy(self, **changes: Any) -> "Place":
+        return replace(self, **changes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Исходные поля места (без полей конвейера) для JSON-кэшей и файла каталога."""
+        return {
+            "name": self.name,
+            "address": self.address,
+            "coords": list(self.coords) if self.coords else None,
+            "rubrics": self.rubrics,
+            "rating": self.rating,
+            "type": self.type,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Place":
+        coords = data.get("coords")
+        rating = data.get("rating")
+        return cls(
+            name=str(data.get("name") or ""),
+            address=str(data.get("address") or ""),
+            lat=float(coords[0]) if coords else None,
+            lon=float(coords[1]) if coords else None,
+            rubric_ids=RUBRICS.ids(data.get("rubrics") or ()),
+            rating=float(rating) if isinstance(rating, (int, float)) else None,
+            type=sys.intern(str(data.get("type") or "")),
+        )
+
+
+def places_from_dicts(items: Iterable[Any]) -> List[Place]:
+    """Места из JSON-кэша: словари превращаются в Place, готовые Place копируются."""
+    return [it.copy() if isinstance(it, Place) else Place.from_dict(it) for it in items]
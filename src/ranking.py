@@ -0,0 +1,142 @@
+"""
+Локальное ранжирование кандидатов перед выбором мест в GPT.
+
+Каждое место получает оценку по совпадению рубрик с классифицированными
+интересами, рейтингу и расстоянию от старта; при отборе повторы одной
+категории и рубрики штрафуются, чтобы маршрут не состоял из пяти музеев.
+В GPT уходят только лучшие RANKING_TOP_K мест, а в режиме local выбор
+делается вовсе без GPT.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+
+from .place import Place
+
+load_dotenv()
+
+RANKING_MODE = os.getenv("RANKING_MODE", "topk").lower()  # off | topk | local
+RANKING_TOP_K = int(os.getenv("RANKING_TOP_K", "15"))
+
+# Веса составляющих оценки (в сумме 1) и штрафы за однообразие
+WEIGHT_RELEVANCE = 0.5
+WEIGHT_RATING = 0.3
+WEIGHT_DISTANCE = 0.2
+DISTANCE_SCALE_KM = 3.0  # на таком расстоянии вклад близости падает в e раз
+SAME_CATEGORY_PENALTY = 0.04
+SAME_RUBRIC_PENALTY = 0.03
+STEM_LEN = 4  # «музеи» и «музейный» считаем одним словом
+
+_ranking_stats = {"routes": 0, "pool_in": 0, "pool_out": 0, "local_only": 0, "seconds": 0.0}
+
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").lower().replace("ё", "е").split())
+
+
+@lru_cache(maxsize=4096)
+def _stems(text: str) -> frozenset:
+    return frozenset(word[:STEM_LEN] for word in _norm(text).replace(",", " ").split() if len(word) >= 3)
+
+
+def query_stems(queries: Iterable[str]) -> Set[str]:
+    """Основы слов поисковых запросов — для сравнения с названиями рубрик."""
+    stems: Set[str] = set()
+    for query in queries:
+        stems |= _stems(query)
+    return stems
+
+
+def _relevance(place: Place, wanted_rubrics: Set[str], stems: Set[str]) -> float:
+    rubrics = place.normalized_rubrics
+    if not rubrics:
+        return 0.0
+    matched = sum(1 for r in rubrics if r in wanted_rubrics or _stems(r) & stems)
+    # Хотя бы одна подходящая рубрика — уже половина оценки, остальное — доля совпавших
+    return (0.5 + 0.5 * matched / len(rubrics)) if matched else 0.0
+
+
+def _rating_score(rating: Optional[float]) -> float:
+    if rating is None:
+        return 0.4  # без рейтинга — чуть ниже среднего
+    return min(1.0, max(0.0, (rating - 3.0) / 2.0))
+
+
+def _distance_score(distance_km: Optional[float]) -> float:
+    if distance_km is None:
+        return 0.3
+    return math.exp(-distance_km / DISTANCE_SCALE_KM)
+
+
+def score_place(place: Place, wanted_rubrics: Set[str], stems: Set[str]) -> float:
+    """Оценка места от 0 до 1 без учёта разнообразия."""
+    return (
+        WEIGHT_RELEVANCE * _relevance(place, wanted_rubrics, stems)
+        + WEIGHT_RATING * _rating_score(place.rating)
+        + WEIGHT_DISTANCE * _distance_score(place.distance_km)
+    )
+
+
+def rank_candidates(
+    places: List[Place],
+    queries: Iterable[str],
+    wanted_rubrics: Optional[Set[str]] = None,
+    limit: int = RANKING_TOP_K,
+) -> List[Place]:
+    """Возвращает до limit лучших мест по убыванию оценки с учётом разнообразия.
+
+    Оценка записывается в поле local_score. Порядок детерминирован:
+    при равных оценках выигрывает место, стоявшее в пуле раньше.
+    """
+    started = time.perf_counter()
+    wanted = {_norm(r) for r in wanted_rubrics or ()}
+    stems = query_stems(queries)
+    base = [score_place(p, wanted, stems) for p in places]
+    categories = [p.category for p in places]
+    first_rubrics = [p.rubric_ids[0] if p.rubric_ids else -1 for p in places]
+
+    picked: List[int] = []
+    used_categories: Dict[str, int] = {}
+    used_rubrics: Dict[int, int] = {}
+    left = set(range(len(places)))
+    while left and len(picked) < limit:
+        def adjusted(i: int) -> float:
+            return (
+                base[i]
+                - SAME_CATEGORY_PENALTY * used_categories.get(categories[i], 0)
+                - SAME_RUBRIC_PENALTY * used_rubrics.get(first_rubrics[i], 0)
+            )
+
+        best = max(left, key=lambda i: (adjusted(i), -i))
+        left.remove(best)
+        picked.append(best)
+        places[best].local_score = round(adjusted(best), 4)
+        used_categories[categories[best]] = used_categories.get(categories[best], 0) + 1
+        if first_rubrics[best] >= 0:
+            used_rubrics[first_rubrics[best]] = used_rubrics.get(first_rubrics[best], 0) + 1
+
+    _ranking_stats["routes"] += 1
+    _ranking_stats["pool_in"] += len(places)
+    _ranking_stats["pool_out"] += len(picked)
+    _ranking_stats["seconds"] += time.perf_counter() - started
+    return [places[i] for i in picked]
+
+
+def record_local_only() -> None:
+    _ranking_stats["local_only"] += 1
+
+
+def get_ranking_stats() -> Dict[str, Any]:
+    """Сколько кандидатов было до и после ранжирования и сколько раз выбор обошёлся без GPT."""
+    stats = dict(_ranking_stats)
+    routes = stats["routes"]
+    stats["avg_pool_in"] = round(stats["pool_in"] / routes, 1) if routes else 0.0
+    stats["avg_pool_out"] = round(stats["pool_out"] / routes, 1) if routes else 0.0
+    return stats
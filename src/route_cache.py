@@ -0,0 +1,128 @@
+"""
+Кэш готовых маршрутов.
+
+Похожие запросы («история и набережные, 2 часа, от Кремля») приводят к
+одному и тому же маршруту. Ключ — набор поисковых запросов по категориям
+после классификации интересов, точка старта, привязанная к ячейке сетки
+ROUTE_CACHE_CELL_M, и время прогулки, округлённое до шага
+ROUTE_CACHE_TIME_STEP_MIN. Хранится шортлист (с пояснениями и временем на
+месте), текст маршрута и координаты включённых мест.
+
+На ключ копится до ROUTE_CACHE_VARIANTS вариантов: пока построено меньше,
+маршрут строится заново и добавляется в запись, дальше пользователь получает
+случайный из сохранённых — одинаковые запросы не дают всем один маршрут.
+Облегчённый режим без GPT (перегрузка) отдаёт любой уже сохранённый вариант.
+
+Текст маршрута зависит от точки старта (адрес, переходы), поэтому для
+другого старта в той же ячейке он собирается заново из шортлиста — без
+сетевых вызовов.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .cache import TTLCache, open_store
+from .metrics import register_cache
+from .place import Place
+from .twogis import snap_to_cell
+
+load_dotenv()
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "2000"))  # 0 — не кэшировать маршруты
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", str(6 * 3600)))
+ROUTE_CACHE_CELL_M = float(os.getenv("ROUTE_CACHE_CELL_M", "500"))
+ROUTE_CACHE_TIME_STEP_MIN = float(os.getenv("ROUTE_CACHE_TIME_STEP_MIN", "30"))
+ROUTE_CACHE_VARIANTS = max(1, int(os.getenv("ROUTE_CACHE_VARIANTS", "3")))
+
+_routes = TTLCache(max(1, ROUTE_CACHE_SIZE), ROUTE_CACHE_TTL, store=open_store("route_cache") if ROUTE_CACHE_SIZE else None)
+register_cache("routes", _routes.stats)
+
+
+def route_cache_key(cats: Dict[str, List[str]], origin: Tuple[float, float], time_hours: float, allow_food: bool) -> Optional[str]:
+    """Ключ маршрута или None, если кэш выключен."""
+    if not ROUTE_CACHE_SIZE:
+        return None
+    queries = sorted(
+        (cat, sorted({" ".join(str(q).lower().replace("ё", "е").split()) for q in qs}))
+        for cat, qs in cats.items() if qs
+    )
+    cell, _ = snap_to_cell(origin, ROUTE_CACHE_CELL_M)
+    time_bucket = round(time_hours * 60 / ROUTE_CACHE_TIME_STEP_MIN)
+    return json.dumps([queries, list(cell), time_bucket, allow_food], ensure_ascii=False, separators=(",", ":"))
+
+
+def _dump_place(place: Place) -> Dict[str, Any]:
+    return {
+        **place.to_dict(),
+        "category": place.category,
+        "gpt_reason": place.gpt_reason,
+        "gpt_time": place.gpt_time,
+        "route_value": place.route_value,
+    }
+
+
+def cached_shortlist(variant: Dict[str, Any]) -> List[Place]:
+    """Свежие Place из сохранённого варианта: конвейер дописывает в них поля, кэш не трогается."""
+    places = []
+    for data in variant["shortlist"]:
+        place = Place.from_dict(data)
+        place.category = data.get("category") or ""
+        place.gpt_reason = data.get("gpt_reason") or ""
+        place.gpt_time = int(data.get("gpt_time") or place.gpt_time)
+        place.route_value = float(data.get("route_value") or place.route_value)
+        places.append(place)
+    return places
+
+
+def pick_cached_route(key: Optional[str], build_more: bool = True) -> Optional[Dict[str, Any]]:
+    """Случайный сохранённый вариант маршрута.
+
+    None — строить заново: записи нет или (при build_more) вариантов ещё
+    меньше ROUTE_CACHE_VARIANTS.
+    """
+    if key is None:
+        return None
+    entry = _routes.get(key)
+    if not entry or not entry["variants"]:
+        return None
+    if build_more and entry["builds"] < ROUTE_CACHE_VARIANTS:
+        return None
+    return random.choice(entry["variants"])
+
+
+def store_route(
+    key: Optional[str],
+    shortlist: List[Place],
+    itinerary: str,
+    coords: List[Tuple[float, float]],
+    start: Tuple[float, float],
+    start_label: Optional[str],
+    time_hours: float,
+) -> None:
+    """Добавляет построенный маршрут вариантом к записи ключа (повтор того же шортлиста не добавляется)."""
+    if key is None:
+        return
+    entry = _routes.get(key) or {"builds": 0, "variants": []}
+    variants = list(entry["variants"])
+    places = [_dump_place(p) for p in shortlist]
+    signature = sorted(p.key for p in shortlist)
+    if all(sorted(p.key for p in cached_shortlist(v)) != signature for v in variants):
+        variants.append({
+            "shortlist": places,
+            "itinerary": itinerary,
+            "coords": [list(c) for c in coords],
+            "start": [start[0], start[1], start_label or ""],
+            "time_hours": time_hours,
+        })
+    _routes.set(key, {"builds": entry["builds"] + 1, "variants": variants[-ROUTE_CACHE_VARIANTS:]})
+
+
+def get_route_cache_stats() -> Dict[str, Any]:
+    """Статистика кэша маршрутов."""
+    return _routes.stats()
@@ -0,0 +1,370 @@
+"""
+Планировщик порядка посещения мест (задача ориентирования).
+
+По шортлисту, времени на каждом месте и попарному времени в пути выбирает,
+какие места взять и в каком порядке их обойти, чтобы уложиться в
+time_hours (+30 минут запаса) и набрать наибольшую ценность. Для небольших
+шортлистов решение точное (динамика по подмножествам), для больших —
+ближайший сосед с улучшениями 2-opt и or-opt. Результат детерминирован.
+
+Сравнение с порядком от GPT: python -m src.bench.route_planner
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from .geo import INVALID_KM, MODE_INVALID, MODE_NAMES, Coords, distances_from, travel_matrix
+from .place import Place
+
+load_dotenv()
+
+ROUTE_PLANNER = os.getenv("ROUTE_PLANNER", "optimal")  # optimal | llm_order
+ROUTE_EXACT_MAX = int(os.getenv("ROUTE_EXACT_MAX", "8"))  # до стольких мест — точный перебор подмножеств
+
+MIN_PLACES = 3  # столько мест берём в маршрут даже сверх бюджета времени
+BUDGET_SLACK_MIN = 30
+UNREACHABLE_MIN = 10 ** 6
+
+
+@dataclass
+class RoutePlan:
+    """Выбранные места (индексы шортлиста по порядку обхода) и переходы к каждому из них."""
+
+    order: List[int]
+    legs: List[Tuple[int, str, float]]
+    stays: List[int]
+    budget_min: int
+    skipped: List[Tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def travel_min(self) -> int:
+        return sum(leg[0] for leg in self.legs)
+
+    @property
+    def stay_min(self) -> int:
+        return sum(self.stays)
+
+    @property
+    def total_min(self) -> int:
+        return self.travel_min + self.stay_min
+
+    @property
+    def distance_km(self) -> float:
+        return sum(leg[2] for leg in self.legs)
+
+
+def _value(place: Place, rank: int, n: int) -> float:
+    """Ценность места: каждое место весит ~1, выше в выдаче — чуть дороже."""
+    return place.route_value + (n - rank) * 1e-3
+
+
+class _Legs:
+    """Время переходов: узел 0 — старт, узел i+1 — i-е место шортлиста.
+
+    Переход к месту без координат стоит 0 минут, как и в прежнем
+    форматировании; от старта без координат первый переход тоже бесплатный.
+    Выход из такого места к месту с координатами запрещён (UNREACHABLE_MIN),
+    так что оптимизатор ставит их в конец и не «телепортируется» через них.
+    """
+
+    def __init__(self, places: Sequence[Place], start: Optional[Coords]) -> None:
+        points: List[Optional[Coords]] = [start] + [p.coords for p in places]
+        self.points = points
+        n = len(points)
+        self.legs: List[List[Tuple[int, str, float]]] = [[(0, "старт", 0.0)] * n for _ in range(n)]
+        self.minutes = [[0] * n for _ in range(n)]
+        located = [i for i, point in enumerate(points) if point]
+        minutes, modes, km = travel_matrix([points[i] for i in located])
+        for a, i in enumerate(located):
+            for b, j in enumerate(located):
+                if j and i != j:
+                    mode = int(modes[a, b])
+                    if mode == MODE_INVALID:
+                        self.legs[i][j] = (0, MODE_NAMES[mode], 0.0)
+                        self.minutes[i][j] = UNREACHABLE_MIN
+                    else:
+                        self.legs[i][j] = (int(minutes[a, b]), MODE_NAMES[mode], float(km[a, b]))
+                        self.minutes[i][j] = int(minutes[a, b])
+        for i in range(1, n):
+            if not points[i]:
+                for j in located:
+                    if j:
+                        self.minutes[i][j] = UNREACHABLE_MIN
+        # Координаты проверяем от старта, а без него — от первого места с координатами
+        reference = start or next((pt for pt in points[1:] if pt), None)
+        self._far = distances_from(reference, points) > INVALID_KM if reference else None
+
+    def invalid(self, node: int) -> bool:
+        """Место, до которого от точки отсчёта больше INVALID_KM (ошибка в координатах)."""
+        return self._far is not None and bool(self._far[node])
+
+
+def _path_cost(path: Sequence[int], minutes: List[List[int]]) -> int:
+    cost, prev = 0, 0
+    for node in path:
+        cost += minutes[prev][node]
+        prev = node
+    return cost
+
+
+def _solve_exact(nodes: List[int], minutes: List[List[int]], stays: List[int], values: List[float],
+                 budget: int, min_places: int) -> List[int]:
+    """Перебор подмножеств: dp[маска][последний] — минимальное время пути с такими местами."""
+    k = len(nodes)
+    inf = float("inf")
+    full = 1 << k
+    dp = [[inf] * k for _ in range(full)]
+    parent = [[-1] * k for _ in range(full)]
+    for a in range(k):
+        dp[1 << a][a] = minutes[0][nodes[a]] + stays[nodes[a]]
+    mask_value = [0.0] * full
+    mask_count = [0] * full
+    for mask in range(1, full):
+        low = (mask & -mask).bit_length() - 1
+        mask_value[mask] = mask_value[mask & (mask - 1)] + values[nodes[low]]
+        mask_count[mask] = mask_count[mask & (mask - 1)] + 1
+
+    best: Tuple[float, float] = (-1.0, 0.0)  # (ценность, -время)
+    best_end: Tuple[int, int] = (0, -1)
+    for mask in range(1, full):
+        row = dp[mask]
+        count = mask_count[mask]
+        for a in range(k):
+            cost = row[a]
+            if cost == inf:
+                continue
+            fits = cost <= budget
+            if fits or count <= min_places:
+                key = (mask_value[mask], -cost)
+                if key > best:
+                    best, best_end = key, (mask, a)
+            # Маршрут сверх бюджета дальше не растёт: он и так берётся только ради минимума мест
+            if not fits and count >= min_places:
+                continue
+            from_node = nodes[a]
+            for b in range(k):
+                bit = 1 << b
+                if mask & bit:
+                    continue
+                nxt = cost + minutes[from_node][nodes[b]] + stays[nodes[b]]
+                if nxt < dp[mask | bit][b]:
+                    dp[mask | bit][b] = nxt
+                    parent[mask | bit][b] = a
+
+    mask, a = best_end
+    path: List[int] = []
+    while a != -1:
+        path.append(nodes[a])
+        prev = parent[mask][a]
+        mask ^= 1 << a
+        a = prev
+    return path[::-1]
+
+
+def _two_opt(path: List[int], minutes: List[List[int]]) -> List[int]:
+    """2-opt для открытого пути от старта: разворачивает отрезки, пока это укорачивает путь.
+
+    Матрица несимметрична (выход из места без координат — UNREACHABLE_MIN),
+    поэтому выигрыш считается по рёбрам на концах отрезка и по самому отрезку,
+    пройденному в обратную сторону.
+    """
+    n = len(path)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 1):
+            before = path[i - 1] if i else 0
+            forward = backward = 0  # отрезок path[i..j] туда и обратно
+            for j in range(i + 1, n):
+                forward += minutes[path[j - 1]][path[j]]
+                backward += minutes[path[j]][path[j - 1]]
+                delta = minutes[before][path[j]] - minutes[before][path[i]] + backward - forward
+                if j + 1 < n:
+                    after = path[j + 1]
+                    delta += minutes[path[i]][after] - minutes[path[j]][after]
+                if delta < 0:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+                    improved = True
+                    break
+            if improved:
+                break
+    return path
+
+
+def _or_opt(path: List[int], minutes: List[List[int]]) -> List[int]:
+    """Or-opt: переносит цепочки из 1–3 мест на лучшую позицию."""
+    improved = True
+    while improved:
+        improved = False
+        for size in (1, 2, 3):
+            for i in range(len(path) - size + 1):
+                chain = path[i:i + size]
+                rest = path[:i] + path[i + size:]
+                before = rest[i - 1] if i else 0
+                after = rest[i] if i < len(rest) else None
+                # Сколько экономим, вынимая цепочку, и во что обходится вставка между before/after
+                removed = minutes[before][chain[0]] - (minutes[before][after] if after is not None else 0)
+                if after is not None:
+                    removed += minutes[chain[-1]][after]
+                best_pos, best_gain = -1, 0
+                for pos in range(len(rest) + 1):
+                    if pos == i:
+                        continue
+                    left = rest[pos - 1] if pos else 0
+                    right = rest[pos] if pos < len(rest) else None
+                    added = minutes[left][chain[0]]
+                    if right is not None:
+                        added += minutes[chain[-1]][right] - minutes[left][right]
+                    if removed - added > best_gain:
+                        best_pos, best_gain = pos, removed - added
+                if best_pos >= 0:
+                    path = rest[:best_pos] + chain + rest[best_pos:]
+                    improved = True
+                    break
+            if improved:
+                break
+    return path
+
+
+def _improve(path: List[int], minutes: List[List[int]]) -> List[int]:
+    """2-opt и or-opt по очереди, пока путь строго короче; иначе остаётся прежний."""
+    cost = _path_cost(path, minutes)
+    while True:
+        candidate = _or_opt(_two_opt(list(path), minutes), minutes)
+        candidate_cost = _path_cost(candidate, minutes)
+        if candidate_cost >= cost:
+            return path
+        path, cost = candidate, candidate_cost
+
+
+def _solve_heuristic(nodes: List[int], minutes: List[List[int]], stays: List[int], values: List[float],
+                     budget: int, min_places: int) -> List[int]:
+    """Ближайший сосед + 2-opt/or-opt, затем выбрасываем самые «дорогие» места и вставляем подходящие."""
+
+    def total(path: Sequence[int]) -> int:
+        return _path_cost(path, minutes) + sum(stays[node] for node in path)
+
+    def saving(path: Sequence[int], i: int) -> int:
+        """На сколько минут короче маршрут без i-го места."""
+        before = path[i - 1] if i else 0
+        saved = minutes[before][path[i]] + stays[path[i]]
+        if i + 1 < len(path):
+            saved += minutes[path[i]][path[i + 1]] - minutes[before][path[i + 1]]
+        return saved
+
+    path: List[int] = []
+    left = list(nodes)
+    prev = 0
+    while left:
+        node = min(left, key=lambda n: (minutes[prev][n], n))
+        path.append(node)
+        left.remove(node)
+        prev = node
+    path = _improve(path, minutes)
+
+    # Пока не укладываемся — убираем место с наименьшей ценностью на сэкономленную минуту
+    cost = total(path)
+    while len(path) > min_places and cost > budget:
+        victim = min(range(len(path)), key=lambda i: (values[path[i]] / max(1, saving(path, i)), i))
+        path.pop(victim)
+        path = _improve(path, minutes)
+        cost = total(path)
+
+    # Возвращаем выброшенные места, если они помещаются в самую дешёвую позицию
+    for node in sorted(set(nodes) - set(path), key=lambda n: (-values[n], n)):
+        best_pos, best_added = 0, None
+        for pos in range(len(path) + 1):
+            left_node = path[pos - 1] if pos else 0
+            added = minutes[left_node][node] + stays[node]
+            if pos < len(path):
+                added += minutes[node][path[pos]] - minutes[left_node][path[pos]]
+            if best_added is None or added < best_added:
+                best_pos, best_added = pos, added
+        if cost + best_added <= budget:
+            path = _improve(path[:best_pos] + [node] + path[best_pos:], minutes)
+            cost = total(path)
+    return path
+
+
+def _finish(path: List[int], legs: _Legs, stays: List[int], budget: int, skipped: List[Tuple[int, str]],
+            count: int) -> RoutePlan:
+    chosen = set(path)
+    for node in range(1, count + 1):
+        if node not in chosen and not any(idx == node - 1 for idx, _ in skipped):
+            skipped.append((node - 1, "не хватает времени"))
+    prev = 0
+    route_legs = []
+    for node in path:
+        route_legs.append(legs.legs[prev][node])
+        if legs.points[node] is not None:
+            prev = node
+    return RoutePlan(
+        order=[node - 1 for node in path],
+        legs=route_legs,
+        stays=[stays[node] for node in path],
+        budget_min=budget,
+        skipped=sorted(skipped),
+    )
+
+
+def plan_route(places: Sequence[Place], time_hours: float, start: Optional[Coords],
+               min_places: int = MIN_PLACES) -> RoutePlan:
+    """Выбирает и упорядочивает места шортлиста под бюджет time_hours*60 + 30 минут.
+
+    Ценность места — route_value (по умолчанию 1) с небольшим бонусом за
+    позицию в шортлисте; при равной ценности выигрывает меньшее время.
+    Не меньше min_places мест берётся даже сверх бюджета — как и раньше.
+    """
+    budget = int(round(time_hours * 60)) + BUDGET_SLACK_MIN
+    legs = _Legs(places, start)
+    stays = [0] + [p.gpt_time for p in places]
+    values = [0.0] + [_value(p, i, len(places)) for i, p in enumerate(places)]
+    skipped: List[Tuple[int, str]] = []
+    nodes: List[int] = []
+    for node in range(1, len(places) + 1):
+        if legs.invalid(node):
+            skipped.append((node - 1, "некорректные координаты"))
+        else:
+            nodes.append(node)
+    if not nodes:
+        return _finish([], legs, stays, budget, skipped, len(places))
+    solve = _solve_exact if len(nodes) <= ROUTE_EXACT_MAX else _solve_heuristic
+    path = solve(nodes, legs.minutes, stays, values, budget, min(min_places, len(nodes)))
+    return _finish(path, legs, stays, budget, skipped, len(places))
+
+
+def plan_route_in_order(places: Sequence[Place], time_hours: float, start: Optional[Coords],
+                        min_places: int = MIN_PLACES) -> RoutePlan:
+    """Прежний жадный порядок: места как их вернул GPT, не влезающие в остаток — пропускаются."""
+    budget = int(round(time_hours * 60)) + BUDGET_SLACK_MIN
+    remain = budget
+    legs = _Legs(places, start)
+    stays = [0] + [p.gpt_time for p in places]
+    skipped: List[Tuple[int, str]] = []
+    path: List[int] = []
+    prev = 0
+    for node in range(1, len(places) + 1):
+        if legs.invalid(node):
+            skipped.append((node - 1, "некорректные координаты"))
+            continue
+        needed = legs.minutes[prev][node] + stays[node]
+        if len(path) >= min_places and remain < needed:
+            skipped.append((node - 1, "не хватает времени"))
+            continue
+        remain -= needed
+        path.append(node)
+        if legs.points[node] is not None:
+            prev = node
+    return _finish(path, legs, stays, budget, skipped, len(places))
+
+
+def build_plan(places: Sequence[Place], time_hours: float, start: Optional[Coords]) -> RoutePlan:
+    """План по настройке ROUTE_PLANNER: optimal — оптимизатор, llm_order — порядок от GPT."""
+    if ROUTE_PLANNER == "llm_order":
+        return plan_route_in_order(places, time_hours, start)
+    return plan_route(places, time_hours, start)
@@ -0,0 +1,213 @@
+"""
+Приём обновлений Telegram через вебхук (aiohttp) в нескольких процессах.
+
+Режим выбирается BOT_MODE в src.main: polling — прежний long polling для
+разработки, webhook — HTTP-сервер. WEB_WORKERS процессов слушают один порт
+(SO_REUSEPORT), ядро раскладывает соединения между ними. Родительский процесс
+один раз регистрирует вебхук в Telegram, запускает воркеры, перезапускает
+упавшие и по SIGTERM/SIGINT останавливает их. Воркер при остановке перестаёт
+принимать запросы и ждёт до WEBHOOK_SHUTDOWN_TIMEOUT секунд, пока достроятся
+начатые маршруты, и только потом закрывает клиенты.
+
+Фоновый обход каталога мест идёт только в воркере 0.
+
+Проверить локально без Telegram (WEBHOOK_URL пустой — вебхук не регистрируется):
+    BOT_MODE=webhook python -m src.main
+    python -m src.server "/start"      # отправить фейковое обновление
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import urllib.request
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", "30"))
+
+RESTART_DELAY = 1.0  # пауза перед перезапуском упавшего воркера, сек
+
+logger = logging.getLogger(__name__)
+
+
+class _InFlight:
+    """Внешний middleware: считает обновления в обработке, чтобы дождаться их при остановке."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if not self.count:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> None:
+        if self.count:
+            logger.info("Waiting for %d updates in progress", self.count)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown timeout: %d updates still in progress", self.count)
+
+
+def build_app(worker_index: int = 0) -> web.Application:
+    """aiohttp-приложение воркера: вебхук, /healthz и хуки запуска/остановки бота."""
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+    from src.bot import bot, dp
+
+    inflight = _InFlight()
+    dp.update.outer_middleware(inflight)
+
+    async def drain(_: web.Application) -> None:
+        await inflight.drain(WEBHOOK_SHUTDOWN_TIMEOUT)
+
+    async def healthz(_: web.Request) -> web.Response:
+        return web.json_response({"worker": worker_index, "pid": os.getpid(), "in_flight": inflight.count})
+
+    app = web.Application()
+    # Порядок остановки: дождаться начатых обновлений, закрыть сессию бота, затем хуки dp.shutdown
+    app.on_shutdown.append(drain)
+    SimpleRequestHandler(dp, bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", healthz)
+    setup_application(app, dp, bot=bot, worker_index=worker_index)
+    return app
+
+
+def _serve(worker_index: int) -> None:
+    """Точка входа процесса-воркера."""
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    web.run_app(
+        build_app(worker_index),
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        reuse_port=WEB_WORKERS > 1,
+        shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT,
+        print=None,
+    )
+    logger.info("Worker %d stopped", worker_index)
+
+
+async def _set_webhook() -> None:
+    from src.bot import bot, dp
+
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook set to %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+    finally:
+        await bot.session.close()
+
+
+def run_webhook() -> None:
+    """Регистрирует вебхук и держит WEB_WORKERS процессов-воркеров до SIGTERM/SIGINT."""
+    if WEBHOOK_URL:
+        asyncio.run(_set_webhook())
+    else:
+        logger.warning("WEBHOOK_URL is empty: webhook is not registered in Telegram (local mode)")
+
+    if WEB_WORKERS == 1:
+        _serve(0)
+        return
+
+    from src.bot.storage import FSM_DB_PATH
+
+    if not FSM_DB_PATH:
+        logger.warning("FSM_DB_PATH is empty: form state is per worker, set it to share users between %d workers", WEB_WORKERS)
+
+    # spawn, а не fork: воркер собирает свои клиенты и event loop с нуля
+    ctx = multiprocessing.get_context("spawn")
+    workers: List[multiprocessing.Process] = [None] * WEB_WORKERS  # type: ignore[list-item]
+    stopping = False
+
+    def _stop(signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    def _start(index: int) -> None:
+        proc = ctx.Process(target=_serve, args=(index,), name=f"bot-worker-{index}")
+        proc.start()
+        workers[index] = proc
+        logger.info("Worker %d started (pid %s) on %s:%s", index, proc.pid, WEBHOOK_HOST, WEBHOOK_PORT)
+
+    for index in range(WEB_WORKERS):
+        _start(index)
+
+    while not stopping:
+        time.sleep(RESTART_DELAY)
+        for index, proc in enumerate(workers):
+            if not stopping and not proc.is_alive():
+                logger.warning("Worker %d exited with code %s, restarting", index, proc.exitcode)
+                _start(index)
+
+    logger.info("Stopping %d workers", WEB_WORKERS)
+    for proc in workers:
+        if proc.is_alive():
+            proc.terminate()  # SIGTERM: aiohttp в воркере останавливается штатно
+    deadline = time.monotonic() + WEBHOOK_SHUTDOWN_TIMEOUT + 5
+    for proc in workers:
+        proc.join(max(0.0, deadline - time.monotonic()))
+        if proc.is_alive():
+            logger.warning("Worker %s did not stop in time, killing", proc.name)
+            proc.kill()
+            proc.join()
+
+
+def post_fake_update(text: str, chat_id: int = 1, url: str = "") -> int:
+    """Отправляет в локальный вебхук обновление с сообщением text, как это сделал бы Telegram."""
+    url = url or f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    now = int(time.time())
+    update = {
+        "update_id": now,
+        "message": {
+            "message_id": now % 1_000_000,
+            "date": now,
+            "chat": {"id": chat_id, "type": "private", "first_name": "Test"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST")
+    request.add_header("Content-Type", "application/json")
+    if WEBHOOK_SECRET:
+        request.add_header("X-Telegram-Bot-Api-Secret-Token", WEBHOOK_SECRET)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+if __name__ == "__main__":
+    status = post_fake_update(
+        sys.argv[1] if len(sys.argv) > 1 else "/start",
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+    )
+    print(f"Вебхук ответил: {status}")
@@ -1,7 +1,16 @@
 from __future__ import annotations
+import asyncio
+import logging
+import math
 import os
 from typing import List, Dict, Any, Optional, Tuple
-import httpx
+
+from .cache import MISSING, TTLCache, open_store
+from .client import get_http_client
+from .metrics import mark_fallback, register_cache, stage
+from .place import RUBRICS, Place, places_from_dicts
+
+logger = logging.getLogger(__name__)
 
 
 def _get_2gis_key() -> str:
@@ -13,6 +22,34 @@ def _get_2gis_key() -> str:
 
 CITY_CENTER_NN: Tuple[float, float] = (56.326, 44.006)  # Нижний Новгород (lat, lon)
 
+# Адрес поиска 2ГИС; подменяется на локальный фейковый сервер в нагрузочном бенчмарке
+DGIS_ITEMS_URL = os.getenv("DGIS_ITEMS_URL", "https://catalog.api.2gis.com/3.0/items")
+
+# Сколько поисковых запросов к 2ГИС одновременно «в полёте»: в рамках одного маршрута и на весь процесс
+SEARCH_CONCURRENCY_PER_REQUEST = int(os.getenv("DGIS_SEARCH_CONCURRENCY", "6"))
+SEARCH_CONCURRENCY_GLOBAL = int(os.getenv("DGIS_SEARCH_CONCURRENCY_GLOBAL", "32"))
+
+_global_search_gate = asyncio.Semaphore(max(1, SEARCH_CONCURRENCY_GLOBAL))
+
+# Кэш результатов поиска: origin привязывается к ячейке сетки, поэтому соседние пользователи делят выдачу
+SEARCH_CACHE_SIZE = int(os.getenv("DGIS_CACHE_SIZE", "2000"))
+SEARCH_CACHE_TTL = float(os.getenv("DGIS_CACHE_TTL", str(6 * 3600)))
+SEARCH_CACHE_STALE_TTL = float(os.getenv("DGIS_CACHE_STALE_TTL", str(24 * 3600)))
+SEARCH_CACHE_CELL_M = float(os.getenv("DGIS_CACHE_CELL_M", "300"))
+
+MAX_PAGE_SIZE = 15  # Больше 2ГИС за одну страницу не отдаёт
+
+_search_cache = TTLCache(
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL,
+    store=open_store("dgis_search"),
+    stale_ttl=SEARCH_CACHE_STALE_TTL,
+    decode=places_from_dicts,
+)
+_refreshing: Dict[str, asyncio.Task] = {}
+_searches_in_flight = 0  # Поиски пачками (маршруты, подготовка, обход каталога), которые идут прямо сейчас
+register_cache("dgis_search", lambda: _search_cache.stats())
+
 
 def _normalize_address(text: str) -> str:
     t = (text or "").strip()
@@ -22,10 +59,10 @@ def _normalize_address(text: str) -> str:
     return t
 
 
-def geocode_address_2gis(address_text: str) -> Optional[Tuple[float, float]]:
+async def geocode_address_2gis(address_text: str) -> Optional[Tuple[float, float]]:
     """Грубо геокодирует адрес через items по тексту, ограничивая городом."""
     key = _get_2gis_key()
-    endpoint = "https://catalog.api.2gis.com/3.0/items"
+    endpoint = DGIS_ITEMS_URL
     q = f"{_normalize_address(address_text)} Нижний Новгород"
     params: Dict[str, Any] = {
         "key": key,
@@ -36,10 +73,9 @@ def geocode_address_2gis(address_text: str) -> Optional[Tuple[float, float]]:
         "location": f"{CITY_CENTER_NN[1]:.6f},{CITY_CENTER_NN[0]:.6f}",
     }
     try:
-        with httpx.Client(timeout=8.0) as client:
-            r = client.get(endpoint, params=params)
-            r.raise_for_status()
-            data = r.json() or {}
+        r = await get_http_client().get(endpoint, params=params)
+        r.raise_for_status()
+        data = r.json() or {}
     except Exception:
         return None
     try:
@@ -53,45 +89,37 @@ def geocode_address_2gis(address_text: str) -> Optional[Tuple[float, float]]:
     return None
 
 
-def resolve_origin_2gis(start_coords: Optional[Tuple[float, float]], start_address_text: Optional[str]) -> Tuple[float, float]:
+async def resolve_origin_2gis(start_coords: Optional[Tuple[float, float]], start_address_text: Optional[str]) -> Tuple[float, float]:
     """Определяет точку старта: координаты → геокод адреса → центр Н. Новгорода."""
     if start_coords and isinstance(start_coords, tuple):
         return start_coords
     if start_address_text:
-        geo = geocode_address_2gis(start_address_text)
+        geo = await geocode_address_2gis(start_address_text)
         if geo:
             return geo
     return CITY_CENTER_NN
 
 
-def search_places_2gis_by_query(
-    query: str,
-    origin: Tuple[float, float],
-    limit: int = 6,
-    radius_m: int = 8000,
-) -> List[Dict[str, Any]]:
-    """Ищет места в 2ГИС по одному короткому запросу около origin в Н. Новгороде."""
+async def _fetch_places(query: str, origin: Tuple[float, float], page_size: int, radius_m: int, page: int = 1) -> List[Place]:
+    """Один запрос к 2ГИС items; сетевые ошибки и ошибки HTTP пробрасываются наружу."""
     key = _get_2gis_key()
-    endpoint = "https://catalog.api.2gis.com/3.0/items"
+    endpoint = DGIS_ITEMS_URL
     loc_lat, loc_lon = origin
     q = f"{(query or '').strip()} Нижний Новгород"
     params: Dict[str, Any] = {
         "key": key,
         "q": q,
-        "page_size": max(1, min(limit, 15)),
+        "page_size": page_size,
         "fields": "items.point,items.address_name,items.rubrics,items.rating,items.type",
         "sort": "distance",
         "location": f"{loc_lon:.6f},{loc_lat:.6f}",
         "radius": int(radius_m),
+        "page": int(page),
     }
-    try:
-        with httpx.Client(timeout=8.0) as client:
-            r = client.get(endpoint, params=params)
-            r.raise_for_status()
-            data = r.json() or {}
-    except Exception:
-        return []
-    items: List[Dict[str, Any]] = []
+    r = await get_http_client().get(endpoint, params=params)
+    r.raise_for_status()
+    data = r.json() or {}
+    items: List[Place] = []
     raw_items = (data.get("result") or {}).get("items") or []
     for it in raw_items:
         name = (it.get("name") or "").strip()
@@ -102,16 +130,13 @@ def search_places_2gis_by_query(
             continue
         address = it.get("address_name") or ""
         point = (it.get("point") or {})
-        coords = None
+        lat = lon = None
         if isinstance(point, dict) and "lat" in point and "lon" in point:
-            coords = (float(point["lat"]), float(point["lon"]))
-        rubrics: List[str] = []
+            lat, lon = float(point["lat"]), float(point["lon"])
+        rubric_ids: tuple = ()
         rbs = it.get("rubrics") or []
         if isinstance(rbs, list):
-            for rb in rbs:
-                title = (rb.get("name") or rb.get("title") or "").strip()
-                if title:
-                    rubrics.append(title)
+            rubric_ids = RUBRICS.ids(rb.get("name") or rb.get("title") for rb in rbs if isinstance(rb, dict))
         rating = None
         rt = it.get("rating")
         try:
@@ -119,14 +144,136 @@ def search_places_2gis_by_query(
                 rating = float(rt.get("rating"))
         except Exception:
             rating = None
-        items.append({
-            "name": name,
-            "address": address,
-            "coords": coords,
-            "rubrics": rubrics,
-            "rating": rating,
-            "type": itype,
-        })
+        items.append(Place(
+            name=name,
+            address=address,
+            lat=lat,
+            lon=lon,
+            rubric_ids=rubric_ids,
+            rating=rating,
+            type=itype,
+        ))
     return items
 
 
+def snap_to_cell(origin: Tuple[float, float], cell_m: float = SEARCH_CACHE_CELL_M) -> Tuple[Tuple[int, int], Tuple[float, float]]:
+    """Привязывает точку к ячейке сетки cell_m×cell_m: возвращает (индекс ячейки, центр ячейки).
+
+    Шаг по долготе считается на широте центра города, чтобы сетка была одной для всех.
+    """
+    if cell_m <= 0:
+        return (0, 0), origin
+    dlat = cell_m / 111_320.0
+    dlon = cell_m / (111_320.0 * math.cos(math.radians(CITY_CENTER_NN[0])))
+    i = math.floor(origin[0] / dlat)
+    j = math.floor(origin[1] / dlon)
+    return (i, j), ((i + 0.5) * dlat, (j + 0.5) * dlon)
+
+
+def _search_cache_key(query: str, cell: Tuple[int, int], radius_m: int, page_size: int, page: int) -> str:
+    q = " ".join((query or "").lower().replace("ё", "е").split())
+    return f"{q}|{cell[0]}:{cell[1]}|{int(radius_m)}|{page_size}|{page}"
+
+
+def _copy_items(items: List[Place]) -> List[Place]:
+    """Отдаёт копии: конвейер дописывает в места свои поля, кэш от этого страдать не должен."""
+    return places_from_dicts(items)
+
+
+async def _refresh_search(key: str, query: str, origin: Tuple[float, float], page_size: int, radius_m: int, page: int) -> None:
+    try:
+        async with _global_search_gate:
+            _search_cache.set(key, await _fetch_places(query, origin, page_size, radius_m, page))
+    except Exception as e:
+        logger.debug("2GIS background refresh failed for %r: %s", query, e)
+    finally:
+        _refreshing.pop(key, None)
+
+
+def is_search_cached(query: str, origin: Tuple[float, float], limit: int = 6, radius_m: int = 8000, page: int = 1) -> bool:
+    """Есть ли свежая выдача для такого поиска (ключ тот же, что у search_places_2gis_by_query)."""
+    page_size = max(1, min(limit, MAX_PAGE_SIZE))
+    cell, _ = snap_to_cell(origin)
+    return _search_cache_key(query, cell, radius_m, page_size, page) in _search_cache
+
+
+def searches_in_flight() -> int:
+    """Сколько поисков search_places_2gis_many сейчас ждут 2ГИС или очереди к нему."""
+    return _searches_in_flight
+
+
+def get_search_cache_stats() -> Dict[str, Any]:
+    """Статистика кэша поиска 2ГИС."""
+    return {**_search_cache.stats(), "refreshing": len(_refreshing)}
+
+
+async def search_places_2gis_by_query(
+    query: str,
+    origin: Tuple[float, float],
+    limit: int = 6,
+    radius_m: int = 8000,
+    page: int = 1,
+) -> List[Place]:
+    """Ищет места в 2ГИС по одному короткому запросу около origin в Н. Новгороде.
+
+    Запрос уходит из центра ячейки сетки, в которую попал origin, и кэшируется
+    по (запрос, ячейка, радиус, размер страницы, страница). Устаревший
+    результат отдаётся сразу, а обновляется в фоне.
+    """
+    page_size = max(1, min(limit, MAX_PAGE_SIZE))
+    cell, snapped = snap_to_cell(origin)
+    key = _search_cache_key(query, cell, radius_m, page_size, page)
+    cached, fresh = _search_cache.lookup(key)
+    if cached is not MISSING:
+        if not fresh and key not in _refreshing:
+            _refreshing[key] = asyncio.create_task(_refresh_search(key, query, snapped, page_size, radius_m, page))
+        return _copy_items(cached)
+    with stage("search_query"):
+        try:
+            items = await _fetch_places(query, snapped, page_size, radius_m, page)
+        except Exception as e:
+            logger.warning("2GIS search failed for %r: %s", query, e)
+            mark_fallback()
+            return []
+    _search_cache.set(key, items)
+    return _copy_items(items)
+
+
+def plan_searches(queries: List[str], radii: List[int], limit: int) -> List[Tuple[str, int, int, int]]:
+    """Планирует поиск: по одному проходу на запрос на самом большом радиусе.
+
+    Выдача 2ГИС отсортирована по расстоянию, поэтому ближний радиус даёт
+    подмножество дальнего — отдельный проход по нему только тратит квоту.
+    Полосы расстояний потом считаются локально по координатам.
+    Если limit больше страницы, добирается нужное число страниц.
+    Возвращает список (query, radius_m, page_size, page).
+    """
+    radius = max(radii)
+    page_size = max(1, min(limit, MAX_PAGE_SIZE))
+    pages = math.ceil(limit / page_size)
+    return [(q, radius, page_size, page) for q in queries for page in range(1, pages + 1)]
+
+
+async def search_places_2gis_many(
+    searches: List[Tuple[str, int, int, int]],
+    origin: Tuple[float, float],
+    concurrency: Optional[int] = None,
+) -> List[List[Place]]:
+    """Выполняет пачку поисков (query, radius_m, limit, page) параллельно.
+
+    Число одновременных запросов ограничено и для этой пачки, и глобально на процесс.
+    Результаты возвращаются в том же порядке, что и searches, поэтому
+    склейка детерминирована и совпадает с последовательным обходом.
+    """
+    local_gate = asyncio.Semaphore(max(1, concurrency or SEARCH_CONCURRENCY_PER_REQUEST))
+
+    async def _run(query: str, radius_m: int, limit: int, page: int) -> List[Place]:
+        global _searches_in_flight
+        _searches_in_flight += 1
+        try:
+            async with local_gate, _global_search_gate:
+                return await search_places_2gis_by_query(query, origin=origin, limit=limit, radius_m=radius_m, page=page)
+        finally:
+            _searches_in_flight -= 1
+
+    return list(await asyncio.gather(*(_run(*search) for search in searches)))
@@ -0,0 +1,295 @@
+"""
+Прогрев кэшей после запуска бота.
+
+После деплоя или перезапуска кэши классификации и поиска 2ГИС пусты (без
+CACHE_DB_PATH — совсем, с ним — частично устарели), и первые пользователи
+ждут полный конвейер. Прогрев в фоне:
+
+1. классифицирует WARMUP_TOP_INTERESTS самых частых строк интересов;
+2. выполняет поиски 2ГИС по всем запросам из HEURISTIC_RULES и
+   DEFAULT_CATEGORIES (и по запросам частых интересов) вокруг центра города
+   и WARMUP_TOP_CELLS самых частых ячеек точек старта (ячейки кэша поиска) — те же поиски, что
+   сделал бы generate_route, кроме закрытых локальным каталогом.
+
+Частоты берутся из журнала запросов маршрутов за WARMUP_LOOKBACK_HOURS
+(таблица route_traffic в CACHE_DB_PATH, куда счётчики пишутся пачками в
+потоке записи кэшей; без файла — только память процесса).
+
+С пользователями прогрев не конкурирует: вызовы GPT идут с фоновым
+приоритетом, а перед каждым обращением к провайдеру прогрев ждёт, пока не
+закончатся поиски маршрутов и не опустеет интерактивная очередь GPT. Темп —
+не больше WARMUP_RATE обращений в секунду, всего — не больше WARMUP_BUDGET
+(уже закэшированное не считается).
+
+Ручной прогрев: python -m src.warmup
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .cache import PURGE_INTERVAL, db_thread_connection, open_db, run_on_db_thread
+from .catalog import crawl_queries
+from .llm_scheduler import background_priority, get_llm_scheduler_stats
+from .metrics import register_gauge
+from .twogis import CITY_CENTER_NN, is_search_cached, search_places_2gis_many, searches_in_flight, snap_to_cell
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WARMUP_BUDGET = int(os.getenv("WARMUP_BUDGET", "300"))  # 0 — не прогревать
+WARMUP_RATE = float(os.getenv("WARMUP_RATE", "2"))
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", "30"))
+WARMUP_TOP_INTERESTS = int(os.getenv("WARMUP_TOP_INTERESTS", "50"))
+WARMUP_TOP_CELLS = int(os.getenv("WARMUP_TOP_CELLS", "5"))
+WARMUP_LOOKBACK_HOURS = float(os.getenv("WARMUP_LOOKBACK_HOURS", "168"))
+
+IDLE_POLL = 0.5  # сек между проверками, не заняты ли провайдеры пользователями
+
+
+class TrafficLog:
+    """Сколько раз встречались строки интересов и ячейки точек старта, и когда последний раз.
+
+    С CACHE_DB_PATH счётчики копятся в памяти и раз в PURGE_INTERVAL уходят
+    одной пачкой в поток записи кэшей — запрос маршрута не ждёт SQLite.
+    """
+
+    def __init__(self) -> None:
+        self._memory: Dict[Tuple[str, str], List] = {}  # (вид, ключ) → [образец, раз, когда]
+        self._conn = open_db()
+        if self._conn is not None:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS route_traffic ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, sample TEXT NOT NULL, "
+                "seen INTEGER NOT NULL DEFAULT 0, last_seen REAL NOT NULL, PRIMARY KEY (kind, key))"
+            )
+        self._flushed_at = time.time()
+
+    def record(self, kind: str, key: str, sample: str) -> None:
+        now = time.time()
+        entry = self._memory.setdefault((kind, key), [sample, 0, now])
+        entry[0], entry[1], entry[2] = sample, entry[1] + 1, now
+        if self._conn is not None and now - self._flushed_at >= PURGE_INTERVAL:
+            self.flush()
+
+    def flush(self) -> Optional[Future]:
+        """Отправляет накопленные счётчики в поток записи; без CACHE_DB_PATH — None."""
+        if self._conn is None:
+            return None
+        rows = [(kind, key, sample, seen, last_seen) for (kind, key), (sample, seen, last_seen) in self._memory.items()]
+        self._memory = {}
+        self._flushed_at = time.time()
+        return run_on_db_thread(self._write, rows, self._flushed_at - WARMUP_LOOKBACK_HOURS * 3600)
+
+    @staticmethod
+    def _write(rows: List[Tuple[str, str, str, int, float]], expired_before: float) -> None:
+        conn = db_thread_connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO route_traffic (kind, key, sample, seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET sample = excluded.sample, seen = seen + excluded.seen, "
+                "last_seen = excluded.last_seen",
+                rows,
+            )
+            # Старше окна частот строки прогреву не нужны
+            conn.execute("DELETE FROM route_traffic WHERE last_seen < ?", (expired_before,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _read(kind: str, limit: int, since: float) -> List[str]:
+        rows = db_thread_connection().execute(
+            "SELECT sample FROM route_traffic WHERE kind = ? AND last_seen >= ? ORDER BY seen DESC LIMIT ?",
+            (kind, since, limit),
+        ).fetchall()
+        return [sample for (sample,) in rows]
+
+    async def most_frequent(self, kind: str, limit: int, since: float) -> List[str]:
+        """Образцы самых частых ключей вида kind, встречавшихся после since."""
+        if limit <= 0:
+            return []
+        if self._conn is None:
+            entries = [
+                (seen, sample) for (k, _), (sample, seen, last_seen) in self._memory.items()
+                if k == kind and last_seen >= since
+            ]
+            return [sample for _, sample in sorted(entries, key=lambda e: -e[0])[:limit]]
+        self.flush()  # чтение идёт в том же потоке после записи — видит и свежие счётчики
+        return await asyncio.wrap_future(run_on_db_thread(self._read, kind, limit, since))
+
+_traffic: Optional[TrafficLog] = None
+_warmup_task: Optional[asyncio.Task] = None
+_stats: Dict[str, int] = {
+    "classify_fetched": 0, "classify_cached": 0, "search_fetched": 0, "search_cached": 0, "over_budget": 0,
+}
+_pending = 0  # Сколько обращений прогрева ещё впереди
+
+
+def get_traffic_log() -> TrafficLog:
+    global _traffic
+    if _traffic is None:
+        _traffic = TrafficLog()
+    return _traffic
+
+
+def record_route_request(interests: str, origin: Tuple[float, float]) -> None:
+    """Отмечает запрос маршрута: его интересы и ячейку точки старта (для прогрева после перезапуска)."""
+    log = get_traffic_log()
+    text = " ".join((interests or "").lower().split())
+    if text:
+        log.record("interests", text, text)
+    cell, center = snap_to_cell(origin)  # ячейка кэша поиска: прогрев из её центра попадает в тот же ключ
+    log.record("origin", f"{cell[0]}:{cell[1]}", f"{center[0]:.6f},{center[1]:.6f}")
+
+
+async def popular_interests(limit: int = WARMUP_TOP_INTERESTS) -> List[str]:
+    return await get_traffic_log().most_frequent("interests", limit, time.time() - WARMUP_LOOKBACK_HOURS * 3600)
+
+
+async def popular_origins(limit: int = WARMUP_TOP_CELLS) -> List[Tuple[float, float]]:
+    samples = await get_traffic_log().most_frequent("origin", limit, time.time() - WARMUP_LOOKBACK_HOURS * 3600)
+    return [(float(lat), float(lon)) for lat, lon in (sample.split(",") for sample in samples)]
+
+
+def _providers_idle() -> bool:
+    """Пользовательские маршруты сейчас не ищут в 2ГИС и не ждут GPT."""
+    return searches_in_flight() == 0 and not get_llm_scheduler_stats()["queued"].get("interactive")
+
+
+class _Budget:
+    """Сколько обращений к провайдерам осталось и темп между ними."""
+
+    def __init__(self, calls: int, rate: float) -> None:
+        self.left = calls
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+
+    async def spend(self) -> bool:
+        """Ждёт свободных провайдеров и своей очереди по темпу; False — бюджет исчерпан."""
+        if self.left <= 0:
+            return False
+        while True:
+            if not _providers_idle():
+                await asyncio.sleep(IDLE_POLL)
+                continue
+            delay = self._next_at - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self.left -= 1
+        self._next_at = time.monotonic() + self.interval
+        return True
+
+
+async def warm_up_caches(budget: int = WARMUP_BUDGET, rate: float = WARMUP_RATE) -> Dict[str, int]:
+    """Прогревает кэши классификации и поиска 2ГИС; возвращает счётчики прогрева."""
+    from .gpt_chat import _classify_interests_to_queries, _route_queries, _split_searches, classification_cost
+
+    global _pending
+    spend = _Budget(budget, rate)
+    interests = await popular_interests()
+    origins = [CITY_CENTER_NN]
+    for origin in await popular_origins():
+        if all(snap_to_cell(origin)[0] != snap_to_cell(o)[0] for o in origins):
+            origins.append(origin)
+
+    # 1) Классификации: из них же берутся запросы, которые пользователи задают чаще всего
+    queries: List[str] = []
+    _pending = len(interests)
+    with background_priority():
+        for text in interests:
+            _pending -= 1
+            if classification_cost(text):
+                if not await spend.spend():
+                    _stats["over_budget"] += _pending + 1
+                    break
+                _stats["classify_fetched"] += 1
+            else:
+                _stats["classify_cached"] += 1
+            cats = await _classify_interests_to_queries(text, source="warmup")
+            queries.extend(_route_queries(cats, text))
+    queries = list(dict.fromkeys(queries + crawl_queries()))
+
+    # 2) Поиски вокруг каждой точки: только то, что generate_route спросил бы у 2ГИС
+    plans = [(origin, search) for origin in origins for q in queries for search in _split_searches([q], origin)[2]]
+    _pending = len(plans)
+    for origin, search in plans:
+        _pending -= 1
+        query, radius_m, page_size, page = search
+        if is_search_cached(query, origin, page_size, radius_m, page):
+            _stats["search_cached"] += 1
+            continue
+        if not await spend.spend():
+            _stats["over_budget"] += _pending + 1
+            break
+        # Тем же путём, что поиски маршрутов: глобальный лимит параллельности и счётчик поисков в полёте
+        await search_places_2gis_many([search], origin, concurrency=1)
+        _stats["search_fetched"] += 1
+    _pending = 0
+    logger.info(
+        "Cache warm-up finished: %d interests, %d queries around %d points, %s",
+        len(interests), len(queries), len(origins), _stats,
+    )
+    return dict(_stats)
+
+
+async def _warm_up_later() -> None:
+    await asyncio.sleep(WARMUP_DELAY)
+    try:
+        await warm_up_caches()
+    except Exception as e:
+        logger.warning("Cache warm-up failed: %s", e)
+
+
+async def start_cache_warmup(worker_index: int = 0) -> None:
+    """Запускает прогрев через WARMUP_DELAY секунд после старта бота (если WARMUP_BUDGET > 0).
+
+    В режиме вебхука прогревает только воркер 0: кэши с CACHE_DB_PATH общие
+    через SQLite, а без него каждый воркер прогревается запросами пользователей.
+    """
+    global _warmup_task
+    if WARMUP_BUDGET > 0 and _warmup_task is None and worker_index == 0:
+        _warmup_task = asyncio.create_task(_warm_up_later())
+
+
+async def stop_cache_warmup() -> None:
+    global _warmup_task
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+        _warmup_task = None
+    if _traffic is not None:
+        _traffic.flush()  # счётчики с последней пачки не теряются при остановке
+
+
+register_gauge("warmup_pending", "Обращений прогрева кэшей, которые ещё впереди", lambda: _pending)
+register_gauge(
+    "warmup_total",
+    "Прогрев кэшей: classify/search — fetched (обращение к провайдеру) или cached; over_budget — пропущено, бюджет кончился",
+    lambda: [({"result": result}, count) for result, count in _stats.items()],
+    kind="counter",
+)
+
+
+async def _main() -> None:
+    from .client import shutdown_clients
+
+    try:
+        stats = await warm_up_caches()
+        print(f"Прогрев кэшей: {stats}")
+    finally:
+        await shutdown_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
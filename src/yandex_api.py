@@ -1,50 +1,92 @@
-import aiohttp
 import os
+import re
 from dotenv import load_dotenv
 
+from .cache import MISSING, TTLCache, open_store
+from .client import get_aiohttp_session
+from .metrics import register_cache
+
 load_dotenv()
 YANDEX_API_KEY = os.getenv("YANDEX_API_KEY")
-GEOCODER_URL = "https://geocode-maps.yandex.ru/1.x/"
+GEOCODER_URL = os.getenv("YANDEX_GEOCODER_URL", "https://geocode-maps.yandex.ru/1.x/")
+
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "5000"))
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = float(os.getenv("GEOCODE_NEGATIVE_TTL", "600"))  # «адрес не найден» живёт недолго
+
+_coordinates_cache = TTLCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, store=open_store("geocode_forward"))
+_address_cache = TTLCache(GEOCODE_CACHE_SIZE, GEOCODE_CACHE_TTL, store=open_store("geocode_reverse"))
+register_cache("geocode_forward", _coordinates_cache.stats)
+register_cache("geocode_reverse", _address_cache.stats)
+
+
+def _address_key(address: str) -> str:
+    """Нормализует адрес для ключа кэша: регистр, ё/е, пробелы и знаки препинания."""
+    key = (address or "").lower().replace("ё", "е")
+    key = re.sub(r"[\s,.;]+", " ", key)
+    return key.strip()
+
+
+def _point_key(lat: float, lon: float) -> str:
+    return f"{lat:.5f},{lon:.5f}"  # ~1 м — точнее геокодер всё равно не различает
+
+
+def get_geocode_cache_stats() -> dict:
+    """Статистика попаданий кэша прямого и обратного геокодирования."""
+    return {"coordinates": _coordinates_cache.stats(), "address": _address_cache.stats()}
+
 
 async def get_coordinates(address: str) -> tuple[float, float] | None:
+    key = _address_key(address)
+    cached = _coordinates_cache.get(key, MISSING)
+    if cached is not MISSING:
+        return tuple(cached) if cached else None
+
     params = {
         "apikey": YANDEX_API_KEY,
         "geocode": address,
         "format": "json"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(GEOCODER_URL, params=params) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
+    async with get_aiohttp_session().get(GEOCODER_URL, params=params) as resp:
+        if resp.status != 200:
+            return None
+        data = await resp.json()
 
     try:
         pos = data["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]["Point"]["pos"]
         lon, lat = map(float, pos.split())
 
+        _coordinates_cache.set(key, (lat, lon))
         return lat, lon
     except (KeyError, IndexError, ValueError):
+        _coordinates_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
         return None
 
 async def get_address(lat: float, lon: float) -> str | None:
+    key = _point_key(lat, lon)
+    cached = _address_cache.get(key, MISSING)
+    if cached is not MISSING:
+        return cached
+
     params = {
         "apikey": YANDEX_API_KEY,
         "geocode": f"{lon},{lat}",
         "format": "json"
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(GEOCODER_URL, params=params) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
+    async with get_aiohttp_session().get(GEOCODER_URL, params=params) as resp:
+        if resp.status != 200:
+            return None
+        data = await resp.json()
 
     try:
         geo_object = data["response"]["GeoObjectCollection"]["featureMember"][0]["GeoObject"]
         address = geo_object["metaDataProperty"]["GeocoderMetaData"]["text"]
+        _address_cache.set(key, address)
         return address
     except (KeyError, IndexError, ValueError):
+        _address_cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
         return None
 
 def get_map(places: list[tuple[float, float]]) -> str: